@@ -0,0 +1,177 @@
+import asyncio
+import copy
+import logging
+import time
+from urllib.parse import urljoin
+
+from concurrency import RETRYABLE_STATUS_CODES, retry_delay
+from harbor_client import HarborApiError, HarborClient, build_query
+from records import TagRecord
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+logger = logging.getLogger('logger')
+
+
+class AsyncHarborClient:
+    """
+    asyncio variant of HarborClient, built on httpx. A semaphore bounds the number of in-flight requests,
+    so thousands of listing and delete calls can be scheduled at once from a single thread.
+    """
+
+    def __init__(self, harbor_url, project_name, username, password, ssl_verify=False, max_concurrency=100,
+                 http2=False, semaphore=None, metrics=None, retries=3, backoff=1.0):
+        """
+        `semaphore` bounds the requests in flight together with the clients of other registries.
+        Listings failing with 429/5xx or a transport error are retried `retries` times.
+        Every request is recorded in the Metrics `metrics` if given.
+        """
+        if httpx is None:
+            raise RuntimeError("AsyncHarborClient requires the 'httpx' package")
+        self._harbor_url = harbor_url
+        self._project_name = project_name
+        self._max_concurrency = max_concurrency
+        self._semaphore = semaphore
+        self._metrics = metrics
+        self._retries = retries
+        self._backoff = backoff
+        self._owns_client = True
+        limits = httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+        self._client = httpx.AsyncClient(http2=http2, headers=HarborClient.HEADERS, auth=(username, password),
+                                         verify=ssl_verify, limits=limits)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        if self._owns_client:
+            await self._client.aclose()
+
+    def _get_semaphore(self):
+        # created lazily so that it belongs to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        return self._semaphore
+
+    def for_project(self, project_name):
+        """Return a client of another project of the same registry, sharing the connections and semaphore."""
+        self._get_semaphore()
+        client = copy.copy(self)
+        client._project_name = project_name
+        client._owns_client = False
+        return client
+
+    async def _request(self, method, url, params=None):
+        """
+        Send a request, retrying GET requests failing with 429/5xx or a transport error after their Retry-After
+        or an exponential backoff. Deletions are retried by delete_images_async.
+        """
+        retries = self._retries if method == 'GET' else 0
+        for attempt in range(retries + 1):
+            try:
+                response = await self._send(method, url, params)
+            except httpx.TransportError as e:
+                if attempt == retries:
+                    raise
+                error = e
+            else:
+                if response.status_code not in RETRYABLE_STATUS_CODES or attempt == retries:
+                    return response
+                error = HarborApiError(response.status_code, url, response.headers.get('Retry-After'))
+            delay = retry_delay(self._backoff, attempt, error)
+            logger.warning(f"{method} {url} failed ({error}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def _send(self, method, url, params=None):
+        async with self._get_semaphore():
+            if self._metrics is None:
+                return await self._client.request(method, url, params=params)
+            started = time.monotonic()
+            try:
+                response = await self._client.request(method, url, params=params)
+            except httpx.TransportError:
+                self._metrics.observe_request(method, url, None, time.monotonic() - started)
+                raise
+            self._metrics.observe_request(method, url, response.status_code, time.monotonic() - started,
+                                          len(response.content))
+            return response
+
+    def _get_data_from_response(self, resp):
+        if resp.status_code != 200:
+            raise HarborApiError(resp.status_code, str(resp.url), resp.headers.get('Retry-After'))
+        return resp.json()
+
+    async def _iter_response(self, url, params=None):
+        """Yield the items of every page of a listing, following the 'next' links one page at a time."""
+        params = dict(params or {}, page_size=HarborClient.PAGE_SIZE)
+        page = await self._request('GET', url, params=params)
+        for item in self._get_data_from_response(page):
+            yield item
+        while page.links.get('next', {}).get('url'):
+            page = await self._request('GET', urljoin(f'{self._harbor_url}/', page.links['next']['url']))
+            for item in self._get_data_from_response(page):
+                yield item
+
+    async def _get_response(self, url, params=None):
+        return [item async for item in self._iter_response(url, params)]
+
+    async def get_repositories(self, name=None, name_prefix=None):
+        """List repositories of the project, optionally only the one named `name` or those starting with `name_prefix`."""
+        url = f'{self._harbor_url}/api/v2.0/projects/{self._project_name}/repositories'
+        if name:
+            return await self._get_response(url, {'q': build_query(exact={'name': f'{self._project_name}/{name}'})})
+        if name_prefix:
+            full_prefix = f'{self._project_name}/{name_prefix}'
+            return [repository for repository in
+                    await self._get_response(url, {'q': build_query(fuzzy={'name': full_prefix})})
+                    if repository['name'].startswith(full_prefix)]
+        return await self._get_response(url)
+
+    async def get_images(self, repository_name, query=None):
+        """Return one TagRecord per tag of the repository."""
+        rep_name_without_slash = repository_name.replace('/', '%2F')
+        url = f'{self._harbor_url}/api/v2.0/projects/{self._project_name}/repositories/' \
+              f'{rep_name_without_slash}/artifacts'
+        params = dict(HarborClient.ARTIFACT_PARAMS)
+        if query:
+            params['q'] = query
+        repo_name = f"{self._project_name}/{repository_name}"
+        return [TagRecord.from_harbor(repo_name, tag, artifact.get("digest"), artifact.get("size") or 0)
+                async for artifact in self._iter_response(url, params) for tag in artifact["tags"] or []]
+
+    async def get_storage_quota(self):
+        """Return the storage used by the project and its quota, in bytes, the quota being -1 when unlimited."""
+        quota = self._get_data_from_response(
+            await self._request('GET', f'{self._harbor_url}/api/v2.0/projects/{self._project_name}/summary'))['quota']
+        return quota['used']['storage'], quota['hard']['storage']
+
+    def _repository_url(self, repository_name):
+        rep_name_without_slash = repository_name.replace(f'{self._project_name}/', '').replace('/', '%2F')
+        return f'{self._harbor_url}/api/v2.0/projects/{self._project_name}/repositories/{rep_name_without_slash}'
+
+    async def _delete(self, url):
+        response = await self._request('DELETE', url)
+        if response.status_code != 200:
+            raise HarborApiError(response.status_code, url, response.headers.get('Retry-After'))
+
+    async def delete_image(self, image):
+        image_name, tag = image.split(':')
+        await self._delete(f'{self._repository_url(image_name)}/artifacts/{tag}')
+
+    async def delete_artifact(self, repository_name, reference):
+        await self._delete(f'{self._repository_url(repository_name)}/artifacts/{reference}')
+
+    async def delete_tag(self, repository_name, reference, tag):
+        await self._delete(f'{self._repository_url(repository_name)}/artifacts/{reference}/tags/{tag}')
+
+    async def delete_action(self, action):
+        if action.artifact:
+            await self.delete_artifact(action.repository, action.digest or action.tags[0])
+        else:
+            await self.delete_tag(action.repository, action.digest, action.tags[0])
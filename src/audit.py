@@ -0,0 +1,71 @@
+import json
+import logging
+import threading
+
+logger = logging.getLogger('logger')
+
+DELETE = 'delete'
+KEEP = 'keep'
+
+
+class AuditLog:
+    """
+    JSON Lines file of the decision taken on every tag evaluated by every policy: deleted by a rule, or kept
+    because it is deployed, ignored, retained by a rule or matched by none. Lines are written as repositories
+    are evaluated, so the file never has to fit in memory; the projects of a run share it.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._file = open(path, 'w')
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @staticmethod
+    def _line(policy_name, record, decision, rule=None, reason=None):
+        return json.dumps({"policy": policy_name, "repository": record.name, "tag": record.tag,
+                           "digest": record.digest, "decision": decision, "rule": rule, "reason": reason},
+                          separators=(',', ':')) + '\n'
+
+    def _write(self, lines):
+        with self._lock:
+            self._file.write(''.join(lines))
+            self.count += len(lines)
+
+    def record(self, policy_name, record, decision, rule=None, reason=None):
+        """Write the decision taken by a policy on one TagRecord."""
+        self._write([self._line(policy_name, record, decision, rule, reason)])
+
+    def record_ignored_repository(self, policy_name, records):
+        self._write([self._line(policy_name, record, KEEP, 'IgnoreRepos', 'ignored_repository')
+                     for record in records])
+
+    def record_repository(self, policy_name, records, matched, condemned, ignored, deployed):
+        """
+        Write the decisions of a policy on the records of a repository, `matched` and `condemned` giving the
+        first rule matching and condemning each tag, `ignored` and `deployed` the condemned tags spared.
+        """
+        lines = []
+        for record in records:
+            tag = record.tag
+            if tag in ignored:
+                lines.append(self._line(policy_name, record, KEEP, 'IgnoreTags', 'ignored_tag'))
+            elif tag in deployed:
+                lines.append(self._line(policy_name, record, KEEP, condemned[tag], 'deployed'))
+            elif tag in condemned:
+                lines.append(self._line(policy_name, record, DELETE, condemned[tag], 'matched'))
+            elif tag in matched:
+                lines.append(self._line(policy_name, record, KEEP, matched[tag], 'retained'))
+            else:
+                lines.append(self._line(policy_name, record, KEEP, None, 'no_rule'))
+        self._write(lines)
+
+    def close(self):
+        self._file.close()
+        logger.info(f"Wrote {self.count} decisions to the audit log {self._path}")
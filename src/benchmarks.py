@@ -0,0 +1,339 @@
+import argparse
+import gc
+import json
+import logging
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, NamedTuple
+from urllib.parse import parse_qs, unquote, urlparse
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+from deleter import DeletionExecutor, count_tags_per_digest, group_deletions
+from fake_harbor import FakeHarbor, FakeHarborServer
+from harbor_client import HarborClient
+from inventory import build_inventory
+from kustomization import KustomizationIndex, build_kustomization_index
+from main import (get_delete_actions, get_target_args, get_targets, get_tags_to_delete, get_tags_to_delete_streaming,
+                  parse_args, run)
+from policy import compile_policy
+from synthetic import SyntheticRegistry
+
+logger = logging.getLogger('logger')
+
+HARBOR_URL = 'https://harbor.bench'
+DOMAIN_NAME = 'harbor.bench'
+DEFAULT_SIZES = [1000, 100000, 1000000]
+BENCHMARK_POLICY = {'name': 'benchmark', 'rules': [
+    {'type': 'DeleteByTimeInName', 'regexp': '^master_.*', 'limit': 50},
+    {'type': 'DeleteByTagName', 'regexp': '^dev_.*', 'limit': 20},
+    {'type': 'DeleteByTagName', 'regexp': r'^v\d+\.\d+\.\d+$', 'limit': 10},
+    {'type': 'DeleteByCreateTime', 'regexp': '.*', 'days': 90},
+    {'type': 'IgnoreRepos', 'repos': ['app-1']},
+    {'type': 'IgnoreTags', 'tags': ['latest', 'build-1']}]}
+# concurrency of the benchmarks running against the fake Harbor server
+HTTP_WORKERS = 8
+
+
+class SyntheticAdapter(BaseAdapter):
+    """requests transport answering Harbor listing calls from pages rendered up front, without sockets."""
+
+    def __init__(self, registry, page_size=HarborClient.PAGE_SIZE):
+        super().__init__()
+        self._repositories = json.dumps(registry.repositories()).encode()
+        self._pages = {}
+        for name in registry.repository_names():
+            artifacts = registry.artifacts(name)
+            pages = [artifacts[start:start + page_size] for start in range(0, len(artifacts), page_size)] or [[]]
+            self._pages[name] = [json.dumps(page).encode() for page in pages]
+
+    def send(self, request, **_kwargs):
+        url = urlparse(request.url)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        headers = CaseInsensitiveDict({'Content-Type': 'application/json'})
+        if url.path.endswith('/artifacts'):
+            name = unquote(url.path.split('/repositories/')[1].rsplit('/', 1)[0])
+            page = int(query.get('page', 1))
+            pages = self._pages[name]
+            body = pages[page - 1]
+            if page < len(pages):
+                headers['Link'] = f'<{url.path}?page={page + 1}&page_size={query["page_size"]}>; rel="next"'
+        else:
+            body = self._repositories
+        response = requests.Response()
+        response.status_code = 200
+        response.headers = headers
+        response._content = body
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+class Workload:
+    """A synthetic registry of a given size and the inputs derived from it, each built once on first use."""
+
+    def __init__(self, tag_count, workdir, seed=0, latency=0.0):
+        self.tag_count = tag_count
+        self.workdir = workdir
+        self.latency = latency
+        self.registry = SyntheticRegistry(tag_count=tag_count, seed=seed)
+        self.plan = compile_policy(BENCHMARK_POLICY)
+        self._inventory = None
+        self._adapter = None
+        self._kustomization_root = None
+        self._server = None
+        self._deleted = 0
+
+    @property
+    def inventory(self):
+        if self._inventory is None:
+            self._inventory = self.registry.inventory()
+        return self._inventory
+
+    @property
+    def adapter(self):
+        if self._adapter is None:
+            self._adapter = SyntheticAdapter(self.registry)
+        return self._adapter
+
+    @property
+    def kustomization_root(self):
+        if self._kustomization_root is None:
+            self._kustomization_root = tempfile.mkdtemp(prefix='kustomization-', dir=self.workdir)
+            self.registry.write_kustomizations(self._kustomization_root, DOMAIN_NAME, max(10, self.tag_count // 100))
+        return self._kustomization_root
+
+    @property
+    def server(self):
+        """A fake Harbor server of the registry, answering after `latency` seconds."""
+        if self._server is None:
+            fake_harbor = FakeHarbor(latency=self.latency).add_registry(self.registry)
+            self._server = FakeHarborServer(fake_harbor).start()
+        return self._server
+
+    def harbor_client(self):
+        harbor_client = HarborClient(HARBOR_URL, self.registry.project_name, 'username', 'password')
+        harbor_client._session.mount(HARBOR_URL, self.adapter)
+        return harbor_client
+
+    def http_harbor_client(self):
+        return HarborClient(self.server.url, self.registry.project_name, 'username', 'password',
+                            pool_size=HTTP_WORKERS, max_concurrency=HTTP_WORKERS)
+
+    def take_deletions(self, tag_count):
+        """DeleteActions of about `tag_count` tags of the fake server, never handing out the same tag twice."""
+        actions = []
+        start, end = self._deleted, self._deleted + tag_count
+        for repository, records in self.inventory:
+            condemned = records[max(start, 0):max(end, 0)]
+            start, end = start - len(records), end - len(records)
+            if condemned:
+                # the tags of a digest spread over two batches are deleted one by one
+                actions += group_deletions(repository['name'], condemned, count_tags_per_digest(records))
+        self._deleted += tag_count
+        return actions
+
+    def close(self):
+        if self._server is not None:
+            self._server.stop()
+
+    def args(self, *extra):
+        """Command-line arguments of a dry run of the project."""
+        args = parse_args(['--harbor-url', HARBOR_URL, '--username', 'username', '--password', 'password',
+                           '--project-name', self.registry.project_name, '--domain-name', DOMAIN_NAME,
+                           '--kustomization-root', self.kustomization_root, '--dry-run', *extra])
+        return get_target_args(args, get_targets(args)[0])
+
+
+class Benchmark(NamedTuple):
+    """`setup` prepares the input of `run` from a Workload, only `run` is measured."""
+    name: str
+    setup: Callable
+    run: Callable
+
+
+def setup_rules(workload):
+    return workload.inventory, workload.plan, workload.args()
+
+
+def run_rules(state):
+    inventory, plan, args = state
+    kustomization_index = KustomizationIndex()
+    for repository, records in inventory:
+        get_delete_actions(repository, records,
+                           get_tags_to_delete(repository, records, kustomization_index, args, plan))
+
+
+def run_streaming(state):
+    inventory, plan, args = state
+    kustomization_index = KustomizationIndex()
+    for repository, records in inventory:
+        tags_per_digest = count_tags_per_digest(records)
+        records_to_delete, = get_tags_to_delete_streaming(repository, iter(records), kustomization_index, args,
+                                                          [plan])
+        group_deletions(repository['name'], records_to_delete, tags_per_digest)
+
+
+def setup_pagination(workload):
+    return workload.harbor_client(), workload.registry.repository_names()
+
+
+def run_pagination(state):
+    harbor_client, repository_names = state
+    for name in repository_names:
+        harbor_client.get_images(name)
+
+
+def setup_http_scan(workload):
+    return workload.http_harbor_client(), workload.registry.project_name
+
+
+def run_http_scan(state):
+    harbor_client, project_name = state
+    with harbor_client:
+        build_inventory(harbor_client, project_name, workers=HTTP_WORKERS)
+
+
+def setup_http_delete(workload):
+    return workload.http_harbor_client(), workload.take_deletions(max(10, workload.tag_count // 100))
+
+
+def run_http_delete(state):
+    harbor_client, actions = state
+    with harbor_client:
+        DeletionExecutor(harbor_client, workers=HTTP_WORKERS).delete(actions)
+    return sum(len(action.tags) for action in actions)
+
+
+def setup_kustomization(workload):
+    return workload.kustomization_root
+
+
+def run_kustomization(root):
+    build_kustomization_index(DOMAIN_NAME, root)
+
+
+def setup_dry_run(workload):
+    return workload.args(), workload.plan, workload.harbor_client()
+
+
+def run_dry_run(state):
+    args, plan, harbor_client = state
+    kustomization_index = build_kustomization_index(DOMAIN_NAME, args.kustomization_root)
+    run(args, [plan], kustomization_index, harbor_client)
+
+
+BENCHMARKS = [
+    Benchmark('rules', setup_rules, run_rules),
+    Benchmark('streaming', setup_rules, run_streaming),
+    Benchmark('pagination', setup_pagination, run_pagination),
+    Benchmark('http_scan', setup_http_scan, run_http_scan),
+    Benchmark('http_delete', setup_http_delete, run_http_delete),
+    Benchmark('kustomization', setup_kustomization, run_kustomization),
+    Benchmark('dry_run', setup_dry_run, run_dry_run),
+]
+
+
+def measure(benchmark, workload, memory=True):
+    """
+    Run a benchmark once timed, then once more under tracemalloc for its peak memory, which would
+    otherwise slow the timed run down. Return a result dict, the throughput being of the number of tags
+    `run` returns, else of all the tags of the workload.
+    """
+    gc.collect()
+    state = benchmark.setup(workload)
+    started = time.perf_counter()
+    tag_count = benchmark.run(state) or workload.tag_count
+    seconds = time.perf_counter() - started
+
+    peak = None
+    if memory:
+        state = benchmark.setup(workload)
+        gc.collect()
+        tracemalloc.start()
+        benchmark.run(state)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {"benchmark": benchmark.name, "tags": workload.tag_count, "seconds": round(seconds, 4),
+            "tags_per_second": round(tag_count / seconds) if seconds else None,
+            "peak_mib": round(peak / 2 ** 20, 2) if peak is not None else None}
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, names=None, memory=True, seed=0, latency=0.0):
+    """
+    Run the selected benchmarks on a synthetic registry of each size, return their results. `latency` is
+    added by the fake Harbor server to each response of the http_* benchmarks.
+    """
+    benchmarks = [benchmark for benchmark in BENCHMARKS if not names or benchmark.name in names]
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for tag_count in sizes:
+            workload = Workload(tag_count, workdir, seed, latency)
+            try:
+                for benchmark in benchmarks:
+                    result = measure(benchmark, workload, memory)
+                    print_result(result)
+                    results.append(result)
+            finally:
+                workload.close()
+    return results
+
+
+def print_result(result):
+    peak = f"{result['peak_mib']:10.1f}" if result['peak_mib'] is not None else f"{'-':>10}"
+    print(f"{result['benchmark']:<15}{result['tags']:>10}{result['seconds']:>10.3f}s"
+          f"{result['tags_per_second'] or 0:>14} tags/s{peak} MiB", flush=True)
+
+
+def find_regressions(results, baseline, max_slowdown):
+    """Return the results whose throughput fell below the baseline's divided by max_slowdown."""
+    baseline_throughput = {(result['benchmark'], result['tags']): result['tags_per_second'] for result in baseline}
+    regressions = []
+    for result in results:
+        reference = baseline_throughput.get((result['benchmark'], result['tags']))
+        if reference and result['tags_per_second'] * max_slowdown < reference:
+            regressions.append((result, reference))
+    return regressions
+
+
+def parse_benchmark_args():
+    parser = argparse.ArgumentParser(description='Benchmark the cleanup on synthetic Harbor registries.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Numbers of tags')
+    parser.add_argument('--only', nargs='+', default=None, choices=[benchmark.name for benchmark in BENCHMARKS],
+                        help='Benchmarks to run (default: all)')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the tracemalloc run measuring peak memory')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic registries')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds the fake Harbor server of the http_* benchmarks adds to each response')
+    parser.add_argument('--json-out', default=None, help='Write the results to this JSON file')
+    parser.add_argument('--baseline', default=None, help='JSON results of an earlier run to compare with')
+    parser.add_argument('--max-slowdown', type=float, default=1.25,
+                        help='Exit with code 1 when a benchmark is this many times slower than the baseline')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    benchmark_args = parse_benchmark_args()
+    # the cleanup logs its progress at INFO level, e.g. the repositories fetched, which would split the table
+    logging.disable(logging.INFO)
+    print(f"{'benchmark':<15}{'tags':>10}{'time':>11}{'throughput':>21}{'peak':>14}")
+    benchmark_results = run_benchmarks(benchmark_args.sizes, benchmark_args.only, not benchmark_args.no_memory,
+                                       benchmark_args.seed, benchmark_args.latency)
+    if benchmark_args.json_out:
+        with open(benchmark_args.json_out, 'w') as f:
+            json.dump(benchmark_results, f, indent=2)
+    if benchmark_args.baseline:
+        with open(benchmark_args.baseline) as f:
+            regressions = find_regressions(benchmark_results, json.load(f), benchmark_args.max_slowdown)
+        for result, reference in regressions:
+            logger.error(f"Regression in {result['benchmark']} at {result['tags']} tags: "
+                         f"{result['tags_per_second']} tags/s, baseline {reference} tags/s")
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,103 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger('logger')
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def parse_retry_after(value):
+    """Return the delay in seconds of a Retry-After header, None when missing or not a number of seconds."""
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        return None
+
+
+def retry_delay(backoff, attempt, error):
+    """Delay before retrying a failed request: the Retry-After header if any, else exponential backoff."""
+    retry_after = parse_retry_after(getattr(error, 'retry_after', None))
+    if retry_after is not None:
+        return retry_after
+    return backoff * 2 ** attempt
+
+
+class AdaptiveLimiter:
+    """
+    AIMD limit on the number of requests in flight, shared by all the threads of a client.
+
+    The limit starts at `floor` and grows by one per successful response until the first sign of congestion
+    (slow start), then by one per `limit` successful responses. It is multiplied by `decrease_factor` on a
+    429/5xx, a transport error, or a response slower than `latency_tolerance` times the best latency seen for
+    the same kind of request; congestion signals of requests started before the last decrease are ignored.
+    A Retry-After header holds back every new request until the delay has passed.
+    """
+    # latency increase ignored whatever the baseline, so that fast local responses do not look congested
+    LATENCY_SLACK = 0.05
+    # weight of a slower response in the latency baseline, letting the baseline follow a slower registry
+    BASELINE_DRIFT = 0.01
+
+    def __init__(self, floor=1, ceiling=10, latency_tolerance=2.0, decrease_factor=0.5):
+        self.floor = max(1, floor)
+        self.ceiling = max(self.floor, ceiling)
+        self.limit = float(self.floor)
+        self._latency_tolerance = latency_tolerance
+        self._decrease_factor = decrease_factor
+        self._slow_start = True
+        self._in_flight = 0
+        self._baselines = {}
+        self._last_decrease = float('-inf')
+        self._resume_at = 0.0
+        self._condition = threading.Condition()
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def acquire(self):
+        """Wait for a free slot and return the start time to pass to release()."""
+        with self._condition:
+            while True:
+                delay = self._resume_at - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                elif self._in_flight >= int(self.limit):
+                    self._condition.wait()
+                else:
+                    break
+            self._in_flight += 1
+        return time.monotonic()
+
+    def release(self, started, status_code=None, retry_after=None, key=None):
+        """
+        Free the slot of a request started at `started` and adjust the limit from its outcome, `status_code`
+        being None for a transport error. `key` groups the requests sharing a latency baseline.
+        """
+        now = time.monotonic()
+        latency = now - started
+        with self._condition:
+            self._in_flight -= 1
+            if retry_after:
+                self._resume_at = max(self._resume_at, now + retry_after)
+            congested = status_code is None or status_code in RETRYABLE_STATUS_CODES
+            if not congested:
+                baseline = self._baselines.get(key)
+                if baseline is None or latency < baseline:
+                    self._baselines[key] = latency
+                else:
+                    congested = latency > baseline * self._latency_tolerance + AdaptiveLimiter.LATENCY_SLACK
+                    self._baselines[key] = baseline + (latency - baseline) * AdaptiveLimiter.BASELINE_DRIFT
+            if congested:
+                if started >= self._last_decrease:
+                    self.limit = max(self.floor, self.limit * self._decrease_factor)
+                    self._last_decrease = now
+                    self._slow_start = False
+                    logger.debug(f"Harbor is congested, concurrency limit lowered to {int(self.limit)}")
+            elif self._slow_start:
+                self.limit = min(self.ceiling, self.limit + 1)
+            else:
+                self.limit = min(self.ceiling, self.limit + 1 / self.limit)
+            self._condition.notify_all()
@@ -1,6 +1,8 @@
 import yaml
 import os
 
+DEFAULT_POLICY_FILE = "harbor_cleanup_policy.yaml"
+
 # Default policies
 DEFAULT_POLICIES = [{
     'name': 'Default Policy',
@@ -13,13 +15,20 @@ DEFAULT_POLICIES = [{
 }]
 
 
-def load_cleanup_policy():
+def load_cleanup_policy(path=None):
     """
-    Load Harbor cleanup policy from harbor_cleanup_policy.yaml file or return default policies
+    Load Harbor cleanup policy from harbor_cleanup_policy.yaml file, or return default policies.
+    A file given as `path` must define policies.
     """
+    if path is not None:
+        with open(path, "r") as f:
+            cleanup_policy = yaml.safe_load(f) or {}
+        if "policies" not in cleanup_policy:
+            raise ValueError(f"Policy file {path} has no policies")
+        return cleanup_policy["policies"]
     # Check if .harbor_cleanup_policy.yaml file exists
-    if os.path.exists("harbor_cleanup_policy.yaml"):
-        with open("harbor_cleanup_policy.yaml", "r") as f:
+    if os.path.exists(DEFAULT_POLICY_FILE):
+        with open(DEFAULT_POLICY_FILE, "r") as f:
             cleanup_policy = yaml.safe_load(f)
         # Check if policies key exists in cleanup_policy dict
         if "policies" in cleanup_policy:
@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+from typing import NamedTuple
+
+from concurrency import RETRYABLE_STATUS_CODES, retry_delay
+from harbor_client import TRANSPORT_ERRORS, HarborApiError
+from scanner import ordered_map
+
+logger = logging.getLogger('logger')
+
+
+class DeleteAction(NamedTuple):
+    """
+    One delete request: a whole artifact when all the tags of its digest are deleted, else a single tag.
+    `harbor_url` is only set for the registries other than --harbor-url of a multi-registry run.
+    `size` is the bytes of the artifact an artifact delete reclaims, 0 for a tag delete or when unknown.
+    """
+    repository: str
+    digest: str
+    tags: tuple
+    artifact: bool
+    harbor_url: str = None
+    size: int = 0
+
+    def __str__(self):
+        if self.artifact and self.digest:
+            return f"{self.repository}@{self.digest} ({', '.join(self.tags)})"
+        return f"{self.repository}:{self.tags[0]}"
+
+
+def count_tags_per_digest(records):
+    return Counter(record.digest for record in records if record.digest)
+
+
+def group_deletions(repository_name, condemned_records, tags_per_digest):
+    """
+    Turn the tag records to delete into DeleteActions: one artifact delete per digest whose tags are all
+    condemned, and tag-only deletes when some tags of the digest must survive.
+    """
+    actions = []
+    tags_by_digest = {}
+    sizes = {}
+    for record in condemned_records:
+        if record.digest is None:
+            # unknown digest: delete the artifact by tag, as before digests were tracked
+            actions.append(DeleteAction(repository_name, None, (record.tag,), True, size=record.size))
+        else:
+            tags_by_digest.setdefault(record.digest, []).append(record.tag)
+            sizes[record.digest] = record.size
+    for digest, tags in tags_by_digest.items():
+        if len(tags) >= tags_per_digest.get(digest, 0):
+            actions.append(DeleteAction(repository_name, digest, tuple(tags), True, size=sizes[digest]))
+        else:
+            actions += [DeleteAction(repository_name, digest, (tag,), False) for tag in tags]
+    return actions
+
+
+class RateLimiter:
+    """Spread calls so that no more than `rps` of them start per second, across all threads."""
+
+    def __init__(self, rps=None):
+        self._interval = 1.0 / rps if rps else 0
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Reserve the next slot and return how long to wait for it."""
+        if not self._interval:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + self._interval
+        return slot - now
+
+    def wait(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class DeletionLimits(NamedTuple):
+    """
+    The --delete-rps rate and --delete-workers deletions in flight of a registry,
+    shared by the DeletionExecutors of its projects.
+    """
+    rate_limiter: RateLimiter
+    budget: threading.BoundedSemaphore
+
+    @classmethod
+    def create(cls, rps=None, workers=1):
+        return cls(RateLimiter(rps), threading.BoundedSemaphore(max(workers, 1)))
+
+
+class DeletionReport:
+    """
+    The DeleteActions deleted and the (action, error) pairs that failed. Without `keep_deleted`, the deleted
+    actions are only counted, for runs that must not hold every deletion of a project.
+    """
+
+    def __init__(self, keep_deleted=True):
+        self.deleted = []
+        self.deleted_count = 0
+        self.failed = []
+        self._keep_deleted = keep_deleted
+
+    def add(self, action, error):
+        if error is None:
+            self.deleted_count += 1
+            if self._keep_deleted:
+                self.deleted.append(action)
+        else:
+            self.failed.append((action, error))
+
+    def log_summary(self):
+        logger.info(f"Sent {self.deleted_count} delete requests, {len(self.failed)} failed")
+        for action, error in self.failed:
+            logger.error(f"Failed to delete image {action}: {error}")
+
+
+class DeletionExecutor:
+    """
+    Run DeleteActions concurrently, rate limited, retrying throttled and failed requests with backoff.
+    With the DeletionLimits `limits` of a registry, the rate and deletions in flight are shared with the
+    executors of its other projects, and `rps` is ignored.
+    """
+
+    def __init__(self, harbor_client, workers=1, rps=None, retries=3, backoff=1.0, limits=None):
+        self._harbor_client = harbor_client
+        self._workers = workers
+        self._rate_limiter = RateLimiter(rps) if limits is None else limits.rate_limiter
+        self._budget = nullcontext() if limits is None else limits.budget
+        self._retries = retries
+        self._backoff = backoff
+
+    def _retry_delay(self, attempt, error):
+        return retry_delay(self._backoff, attempt, error)
+
+    def delete_one(self, action):
+        """Run one DeleteAction with retries, return None when it succeeded or the last error."""
+        for attempt in range(self._retries + 1):
+            try:
+                with self._budget:
+                    self._rate_limiter.wait()
+                    self._harbor_client.delete_action(action)
+                return None
+            except HarborApiError as e:
+                error = e
+                if e.status_code == 404:
+                    logger.warning(f"Image {action} already deleted")
+                    return None
+                if e.status_code not in RETRYABLE_STATUS_CODES:
+                    return error
+            except TRANSPORT_ERRORS as e:
+                # connection errors of requests, and of httpx with --http2
+                error = e
+            if attempt < self._retries:
+                delay = self._retry_delay(attempt, error)
+                logger.warning(f"Deleting image {action} failed ({error}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+        return error
+
+    def delete(self, actions, journal=None, report=None):
+        """
+        Run the actions, recording the completed ones in the PlanJournal `journal` if given.
+        Return the DeletionReport `report` they are added to, a new one if not given.
+        """
+        if report is None:
+            report = DeletionReport()
+        for action, error in ordered_map(self.delete_one, actions, self._workers):
+            if error is None:
+                logger.debug("Deleted image %s", action)
+                if journal is not None:
+                    journal.record(action)
+            report.add(action, error)
+        return report
+
+
+async def delete_images_async(harbor_client, actions, rps=None, retries=3, backoff=1.0, journal=None,
+                              rate_limiter=None):
+    """
+    Run DeleteActions with an AsyncHarborClient, all of them scheduled at once; the client's semaphore
+    bounds the requests in flight. The RateLimiter `rate_limiter` shared by the projects of the registry
+    replaces `rps` if given. Completed actions are recorded in the PlanJournal `journal` if given.
+    Return a DeletionReport.
+    """
+    if rate_limiter is None:
+        rate_limiter = RateLimiter(rps)
+
+    async def delete_one(action):
+        for attempt in range(retries + 1):
+            delay = rate_limiter.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                await harbor_client.delete_action(action)
+                error = None
+            except HarborApiError as e:
+                error = e
+                if e.status_code == 404:
+                    error = None
+                elif e.status_code not in RETRYABLE_STATUS_CODES:
+                    return error
+            except Exception as e:  # pylint: disable=broad-except
+                # transport errors of the async HTTP library
+                error = e
+            if error is None:
+                if journal is not None:
+                    journal.record(action)
+                return None
+            if attempt < retries:
+                await asyncio.sleep(retry_delay(backoff, attempt, error))
+        return error
+
+    report = DeletionReport()
+    for action, error in zip(actions, await asyncio.gather(*(delete_one(action) for action in actions))):
+        report.add(action, error)
+    return report
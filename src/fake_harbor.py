@@ -0,0 +1,312 @@
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlencode, urlparse
+
+from quota import parse_size
+from synthetic import SyntheticRegistry, format_harbor_time
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+logger = logging.getLogger('logger')
+
+API_PREFIX = '/api/v2.0/projects/'
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 100
+
+
+def parse_query(q):
+    """
+    Parse a Harbor 'q' parameter into (key, kind, value) conditions, kind being 'exact' for k=v,
+    'fuzzy' for k=~v and 'range' for k=[low~high], value then being a (low, high) tuple.
+    """
+    conditions = []
+    for condition in filter(None, (q or '').split(',')):
+        key, _, value = condition.partition('=')
+        if value.startswith('~'):
+            conditions.append((key, 'fuzzy', value[1:]))
+        elif value.startswith('[') and value.endswith(']'):
+            low, _, high = value[1:-1].partition('~')
+            conditions.append((key, 'range', (low or None, high or None)))
+        else:
+            conditions.append((key, 'exact', value))
+    return conditions
+
+
+def _matches(values, kind, value):
+    if kind == 'exact':
+        return value in values
+    if kind == 'fuzzy':
+        return any(value in candidate for candidate in values)
+    low, high = value
+    return any((low is None or candidate >= low) and (high is None or candidate <= high) for candidate in values)
+
+
+def _harbor_time_to_query(harbor_time):
+    """'2024-01-01T10:00:00.000Z' as the '2024-01-01 10:00:00' form of Harbor range queries."""
+    return harbor_time[:19].replace('T', ' ')
+
+
+def _artifact_values(artifact, key):
+    if key == 'tags':
+        return [tag['name'] for tag in artifact['tags']]
+    if key in ('push_time', 'pull_time'):
+        return [_harbor_time_to_query(artifact[key])] if artifact.get(key) else []
+    return [artifact.get(key)]
+
+
+class FakeHarbor:
+    """
+    In-memory stand-in of the Harbor v2 API parts used by the cleaner: repository and artifact listings with
+    Link pagination, page_size and q filters, artifact and tag deletion, and the project summary with the storage
+    used, counting each digest once, and the storage `quota` of every project, -1 for none.
+
+    Faults can be injected: a fixed `latency` plus `congestion_latency` per request already in flight,
+    a share `error_rate` of 503 and `throttle_rate` of 429 answers with a Retry-After of `retry_after` seconds,
+    and 429 answers to any request above `capacity` concurrent ones.
+    """
+
+    def __init__(self, latency=0.0, congestion_latency=0.0, error_rate=0.0, throttle_rate=0.0, retry_after=1,
+                 capacity=None, seed=0, quota=-1):
+        self.latency = latency
+        self.congestion_latency = congestion_latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.capacity = capacity
+        self.quota = quota
+        self.stats = Counter()
+        self.peak_in_flight = 0
+        self._projects = {}
+        self._update_times = {}
+        self._in_flight = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def add_registry(self, registry):
+        """Serve the repositories and artifacts of a SyntheticRegistry."""
+        project = self._projects.setdefault(registry.project_name, {})
+        for name in registry.repository_names():
+            project[name] = registry.artifacts(name)
+            self._update_times[(registry.project_name, name)] = format_harbor_time(registry.now)
+        return self
+
+    def artifacts(self, project_name, repository_name):
+        return self._projects[project_name][repository_name]
+
+    def handle(self, method, path, query):
+        """Answer a request with (status, headers, body), after the injected latency and faults."""
+        with self._lock:
+            self._in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self._in_flight)
+            in_flight = self._in_flight
+            draw = self._random.random()
+        try:
+            delay = self.latency + self.congestion_latency * (in_flight - 1)
+            if delay > 0:
+                time.sleep(delay)
+            if self.capacity is not None and in_flight > self.capacity or draw < self.throttle_rate:
+                result = 429, {'Retry-After': str(self.retry_after)}, {"errors": [{"code": "TOO_MANY_REQUESTS"}]}
+            elif draw < self.throttle_rate + self.error_rate:
+                result = 503, {}, {"errors": [{"code": "SERVICE_UNAVAILABLE"}]}
+            else:
+                with self._lock:
+                    result = self._route(method, path, query)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+        with self._lock:
+            self.stats[(method, result[0])] += 1
+        return result
+
+    def _route(self, method, path, query):
+        if not path.startswith(API_PREFIX):
+            return self._not_found(path)
+        parts = path[len(API_PREFIX):].split('/')
+        project = self._projects.get(parts[0])
+        if project is None:
+            return self._not_found(path)
+        if method == 'GET' and parts[1:] == ['repositories']:
+            return self._list_repositories(parts[0], project, path, query)
+        if method == 'GET' and parts[1:] == ['summary']:
+            return self._summary(project)
+        if len(parts) < 4 or parts[1] != 'repositories' or parts[3] != 'artifacts':
+            return self._not_found(path)
+        repository_name = unquote(parts[2])
+        artifacts = project.get(repository_name)
+        if artifacts is None:
+            return self._not_found(path)
+        if method == 'GET' and len(parts) == 4:
+            return self._page(path, query, [artifact for artifact in artifacts
+                                            if self._filter(query, artifact, _artifact_values)])
+        if method == 'DELETE' and len(parts) == 5:
+            return self._delete_artifact(parts[0], repository_name, artifacts, unquote(parts[4]), path)
+        if method == 'DELETE' and len(parts) == 7 and parts[5] == 'tags':
+            return self._delete_tag(parts[0], repository_name, artifacts, unquote(parts[4]), unquote(parts[6]),
+                                    path)
+        return self._not_found(path)
+
+    @staticmethod
+    def _not_found(path):
+        return 404, {}, {"errors": [{"code": "NOT_FOUND", "message": f"{path} not found"}]}
+
+    @staticmethod
+    def _filter(query, item, get_values):
+        return all(_matches(get_values(item, key), kind, value) for key, kind, value in parse_query(query.get('q')))
+
+    def _summary(self, project):
+        sizes = {artifact['digest']: artifact.get('size', 0)
+                 for artifacts in project.values() for artifact in artifacts}
+        return 200, {}, {"repo_count": len(project),
+                         "quota": {"hard": {"storage": self.quota}, "used": {"storage": sum(sizes.values())}}}
+
+    def _list_repositories(self, project_name, project, path, query):
+        repositories = [{"name": f"{project_name}/{name}", "artifact_count": len(artifacts),
+                         "update_time": self._update_times[(project_name, name)]}
+                        for name, artifacts in project.items()]
+        return self._page(path, query, [repository for repository in repositories
+                                        if self._filter(query, repository, lambda item, key: [item.get(key)])])
+
+    @staticmethod
+    def _page(path, query, items):
+        page = max(int(query.get('page', 1)), 1)
+        page_size = min(max(int(query.get('page_size', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        headers = {'X-Total-Count': str(len(items))}
+        links = []
+        link_query = {key: value for key, value in query.items() if key not in ('page', 'page_size')}
+        if page > 1:
+            links.append(f'<{path}?{urlencode(dict(link_query, page=page - 1, page_size=page_size))}>; '
+                         f'rel="prev"')
+        if page * page_size < len(items):
+            links.append(f'<{path}?{urlencode(dict(link_query, page=page + 1, page_size=page_size))}>; '
+                         f'rel="next"')
+        if links:
+            headers['Link'] = ' , '.join(links)
+        return 200, headers, items[(page - 1) * page_size:page * page_size]
+
+    def _touch(self, project_name, repository_name):
+        self._update_times[(project_name, repository_name)] = format_harbor_time(time.time())
+
+    def _delete_artifact(self, project_name, repository_name, artifacts, reference, path):
+        for index, artifact in enumerate(artifacts):
+            if artifact['digest'] == reference or any(tag['name'] == reference for tag in artifact['tags']):
+                del artifacts[index]
+                self._touch(project_name, repository_name)
+                return 200, {}, None
+        return self._not_found(path)
+
+    def _delete_tag(self, project_name, repository_name, artifacts, reference, tag_name, path):
+        for artifact in artifacts:
+            if artifact['digest'] == reference or any(tag['name'] == reference for tag in artifact['tags']):
+                tags = [tag for tag in artifact['tags'] if tag['name'] != tag_name]
+                if len(tags) == len(artifact['tags']):
+                    break
+                # like Harbor, the artifact is kept even once its last tag is removed
+                artifact['tags'] = tags
+                self._touch(project_name, repository_name)
+                return 200, {}, None
+        return self._not_found(path)
+
+
+class _FakeHarborHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, Nagle's algorithm would hold the body back for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def _serve(self, method):
+        # the path is routed still quoted, so that the %2F of nested repository names survives its split
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        status, headers, body = self.server.fake_harbor.handle(method, url.path, query)
+        payload = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self._serve('GET')
+
+    def do_DELETE(self):
+        self._serve('DELETE')
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeHarborServer:
+    """Serve a FakeHarbor over HTTP from a background thread, at `url`."""
+
+    def __init__(self, fake_harbor, host='127.0.0.1', port=0):
+        self.fake_harbor = fake_harbor
+        self._server = ThreadingHTTPServer((host, port), _FakeHarborHandler)
+        self._server.daemon_threads = True
+        self._server.fake_harbor = fake_harbor
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description='Serve a fake Harbor v2 API seeded with synthetic projects.')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on')
+    parser.add_argument('--project-name', nargs='+', default=['project'], help='Names of the generated projects')
+    parser.add_argument('--tags', type=int, default=10000, help='Number of tags of each project')
+    parser.add_argument('--repositories', type=int, default=None,
+                        help='Number of repositories of each project (default: one per 1000 tags)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the generated projects and injected faults')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+    parser.add_argument('--congestion-latency', type=float, default=0.0,
+                        help='Seconds added to a response per other request in flight')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with 503')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Share of requests answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After of the 429 answers, in seconds')
+    parser.add_argument('--capacity', type=int, default=None,
+                        help='Number of concurrent requests above which requests are answered with 429')
+    parser.add_argument('--quota', type=parse_size, default=-1,
+                        help='Storage quota of every project, e.g. 500G (default: unlimited)')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    fake = FakeHarbor(args.latency, args.congestion_latency, args.error_rate, args.throttle_rate, args.retry_after,
+                      args.capacity, args.seed, args.quota)
+    for project_name in args.project_name:
+        fake.add_registry(SyntheticRegistry(project_name, args.tags, args.repositories, args.seed))
+    server = FakeHarborServer(fake, args.host, args.port)
+    logger.info(f"Serving a fake Harbor with projects {', '.join(args.project_name)} at {server.url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._server.server_close()
+        logger.info(f"Requests served: {dict(fake.stats)}")
@@ -1,79 +1,278 @@
+import copy
 import logging
+import threading
+import time
+from urllib.parse import urljoin
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from concurrency import RETRYABLE_STATUS_CODES, AdaptiveLimiter, parse_retry_after, retry_delay
+from metrics import endpoint_of
+from records import TagRecord
+
+try:
+    import httpx
+    TRANSPORT_ERRORS = (requests.exceptions.RequestException, httpx.TransportError)
+except ImportError:
+    httpx = None
+    TRANSPORT_ERRORS = (requests.exceptions.RequestException,)
 
 logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
 logger = logging.getLogger('logger')
 
 
+class HarborApiError(Exception):
+    def __init__(self, status_code, url, retry_after=None):
+        super().__init__(f"Harbor API returned {status_code} for {url}")
+        self.status_code = status_code
+        self.url = url
+        self.retry_after = retry_after
+
+
+def build_query(exact=None, fuzzy=None, ranges=None):
+    """
+    Build the value of Harbor's 'q' query parameter, e.g.
+    build_query(fuzzy={'name': 'app'}, ranges={'push_time': (None, '2024-01-01 00:00:00')})
+    gives 'name=~app,push_time=[~2024-01-01 00:00:00]'.
+    """
+    conditions = [f'{key}={value}' for key, value in (exact or {}).items()]
+    conditions += [f'{key}=~{value}' for key, value in (fuzzy or {}).items()]
+    conditions += [f'{key}=[{low or ""}~{high or ""}]' for key, (low, high) in (ranges or {}).items()]
+    return ','.join(conditions) or None
+
+
 class HarborClient:
     HEADERS = {'Content-Type': 'application/json', 'accept': 'application/json'}
+    # largest page size accepted by the Harbor API
+    PAGE_SIZE = 100
+    # only tags are needed, skip the expensive parts of the artifact payload
+    ARTIFACT_PARAMS = {'with_tag': 'true', 'with_label': 'false', 'with_scan_overview': 'false',
+                       'with_signature': 'false', 'with_immutable_status': 'false', 'with_accessory': 'false'}
 
-    def __init__(self, harbor_url, project_name, username, password, ssl_verify=False):
+    def __init__(self, harbor_url, project_name, username, password, ssl_verify=False, pool_size=10, http2=False,
+                 min_concurrency=1, max_concurrency=None, retries=3, backoff=1.0, budget=None, metrics=None):
+        """
+        Requests in flight are limited by an AdaptiveLimiter between `min_concurrency` and `max_concurrency`
+        (default `pool_size`), and by the semaphore `budget` shared with the clients of other registries.
+        Listings failing with 429/5xx or a transport error are retried `retries` times.
+        Every request is recorded in the Metrics `metrics` if given.
+        """
         self._harbor_url = harbor_url
         self._project_name = project_name
         self._username = username
         self._password = password
         self._verify = ssl_verify
+        self._pool_size = pool_size
+        self._http2 = http2
+        self._session = self._create_session()
+        self._limiter = AdaptiveLimiter(min_concurrency, max_concurrency or pool_size)
+        self._retries = retries
+        self._backoff = backoff
+        self._budget = budget
+        self._metrics = metrics
+        # shared with the clients of other projects created by for_project()
+        self._counters = {"requests": 0}
+        self._owns_session = True
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def for_project(self, project_name):
+        """Return a client of another project of the same registry, sharing the session and concurrency limit."""
+        client = copy.copy(self)
+        client._project_name = project_name
+        client._owns_session = False
+        return client
+
+    def _create_session(self):
+        """Create a keep-alive session reused for every request of the run."""
+        if self._http2:
+            if httpx is None:
+                raise RuntimeError("HTTP/2 support requires the 'httpx[http2]' package")
+            limits = httpx.Limits(max_connections=self._pool_size, max_keepalive_connections=self._pool_size)
+            return httpx.Client(http2=True, headers=HarborClient.HEADERS, auth=(self._username, self._password),
+                                verify=self._verify, limits=limits)
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self._pool_size, pool_maxsize=self._pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update(HarborClient.HEADERS)
+        session.auth = (self._username, self._password)
+        session.verify = self._verify
+        return session
+
+    def _request(self, method, url, params=None):
+        """
+        Send a request once the adaptive limiter allows it, feeding back its latency and status.
+        Each method and endpoint has its own latency baseline: a page of artifacts is slower than a page of
+        repositories without Harbor being congested.
+        Only GET requests are retried here, deletions are retried by the DeletionExecutor.
+        """
+        retries = self._retries if method == 'GET' else 0
+        key = (method, endpoint_of(url))
+        for attempt in range(retries + 1):
+            with self._lock:
+                self._counters["requests"] += 1
+            started = self._limiter.acquire()
+            try:
+                if self._budget is None:
+                    response = self._session.request(method, url, params=params)
+                else:
+                    with self._budget:
+                        # waiting for the budget of the other registries is not latency of this one
+                        started = time.monotonic()
+                        response = self._session.request(method, url, params=params)
+            except TRANSPORT_ERRORS as e:
+                self._limiter.release(started, key=key)
+                if self._metrics is not None:
+                    self._metrics.observe_request(method, url, None, time.monotonic() - started)
+                if attempt == retries:
+                    raise
+                error = e
+            except BaseException:
+                # free the slot of a request that will not be retried
+                self._limiter.release(started, key=key)
+                raise
+            else:
+                retry_after = response.headers.get('Retry-After')
+                self._limiter.release(started, response.status_code, parse_retry_after(retry_after), key=key)
+                if self._metrics is not None:
+                    self._metrics.observe_request(method, url, response.status_code, time.monotonic() - started,
+                                                  len(response.content))
+                if response.status_code not in RETRYABLE_STATUS_CODES or attempt == retries:
+                    return response
+                error = HarborApiError(response.status_code, url, retry_after)
+            delay = retry_delay(self._backoff, attempt, error)
+            logger.warning(f"{method} {url} failed ({error}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+    @property
+    def concurrency_limit(self):
+        """Current limit of requests in flight."""
+        return int(self._limiter.limit)
+
+    def close(self):
+        if self._owns_session:
+            self._session.close()
+
+    def connection_stats(self):
+        """Return the number of requests sent and connections opened by the session."""
+        request_count = self._counters["requests"]
+        stats = {"requests": request_count, "connections": None, "reused": None}
+        if isinstance(self._session, requests.Session):
+            connections = 0
+            for adapter in set(self._session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools.get(key)
+                    if pool is not None:
+                        connections += pool.num_connections
+            stats["connections"] = connections
+            stats["reused"] = max(request_count - connections, 0)
+        return stats
 
     def _get_data_from_response(self, resp):
         if resp.status_code == 200:
             return resp.json()
-        else:
-            logger.error(f"ERROR: Not found. {resp.status_code}")
-            exit(1)
-
-    def _get_response(self, url):
-        responces = []
-        first_page = requests.get(url, headers=HarborClient.HEADERS, auth=(self._username, self._password),
-                                  verify=self._verify)
-        responces += self._get_data_from_response(first_page)
-        next_page = first_page
-        while next_page.links.get('next', None) is not None:
+        raise HarborApiError(resp.status_code, str(resp.url), resp.headers.get('Retry-After'))
+
+    def _iter_response(self, url, params=None):
+        """Yield the items of every page of a listing, following the 'next' links one page at a time."""
+        params = dict(params or {}, page_size=HarborClient.PAGE_SIZE)
+        page = self._request('GET', url, params=params)
+        yield from self._get_data_from_response(page)
+        while page.links.get('next', None) is not None:
             try:
-                next_page_url = next_page.links['next']['url']
-                next_page = requests.get(f'{self._harbor_url}/{next_page_url}', headers=HarborClient.HEADERS,
-                                         auth=(self._username, self._password),
-                                         verify=self._verify)
-                responces += self._get_data_from_response(next_page)
+                next_page_url = page.links['next']['url']
             except KeyError:
                 logger.info("No data")
                 exit(1)
+            # the next link already carries page, page_size and q
+            page = self._request('GET', urljoin(f'{self._harbor_url}/', next_page_url))
+            yield from self._get_data_from_response(page)
 
-        return responces
+    def _get_response(self, url, params=None):
+        return list(self._iter_response(url, params))
 
     def _delete_image(self, url):
-        response = requests.delete(url, headers=HarborClient.HEADERS,
-                                   auth=(self._username, self._password), verify=self._verify)
+        response = self._request('DELETE', url)
         if response.status_code != 200:
-            logger.error(f"ERROR: Not found. {response.status_code}")
-            exit(1)
-        else:
-            logging.info("Image deleted successfully")
+            raise HarborApiError(response.status_code, url, response.headers.get('Retry-After'))
+        logger.debug("Image deleted successfully")
 
-    def _get_images(self, artifacts, repo_name):
-        list_images = []
+    def _iter_images(self, artifacts, repo_name):
+        """Flatten artifacts into one TagRecord per tag, consuming them as they stream in."""
         for artifact in artifacts:
             if artifact["tags"]:
                 for tag in artifact["tags"]:
-                    list_images.append({"name": repo_name, "tag": tag['name'], "push_time": tag["push_time"],
-                                        "pull_time": tag["pull_time"]})
+                    yield TagRecord.from_harbor(repo_name, tag, artifact.get("digest"), artifact.get("size") or 0)
+
+    def _get_images(self, artifacts, repo_name):
+        return list(self._iter_images(artifacts, repo_name))
 
-        return list_images
+    def get_repositories(self, name=None, name_prefix=None):
+        """List repositories of the project, optionally only the one named `name` or those starting with `name_prefix`."""
+        if name:
+            url = f'{self._harbor_url}/api/v2.0/projects/{self._project_name}/repositories'
+            return self._get_response(url, {'q': build_query(exact={'name': f'{self._project_name}/{name}'})})
+        return list(self.iter_repositories(name_prefix))
 
-    def get_repositories(self):
+    def iter_repositories(self, name_prefix=None):
+        """Yield the repositories of the project as pages arrive, only those starting with `name_prefix` if given."""
         url = f'{self._harbor_url}/api/v2.0/projects/{self._project_name}/repositories'
-        return self._get_response(url)
+        if not name_prefix:
+            yield from self._iter_response(url)
+            return
+        # Harbor only supports fuzzy (substring) matching, the prefix is enforced here
+        full_prefix = f'{self._project_name}/{name_prefix}'
+        for repository in self._iter_response(url, {'q': build_query(fuzzy={'name': full_prefix})}):
+            if repository['name'].startswith(full_prefix):
+                yield repository
 
-    def get_images(self, repository_name):
+    def iter_images(self, repository_name, query=None):
+        """Yield one TagRecord per tag of the repository as pages arrive, `query` being a Harbor 'q' filter."""
         rep_name_without_slash = repository_name.replace('/', '%2F')
         url = f'{self._harbor_url}/api/v2.0/projects/{self._project_name}/repositories/' \
-              f'{rep_name_without_slash}/artifacts?with_tag=true'
-        return self._get_images(self._get_response(url), f"{self._project_name}/{repository_name}")
+              f'{rep_name_without_slash}/artifacts'
+        params = dict(HarborClient.ARTIFACT_PARAMS)
+        if query:
+            params['q'] = query
+        return self._iter_images(self._iter_response(url, params), f"{self._project_name}/{repository_name}")
+
+    def get_images(self, repository_name, query=None):
+        """Return one TagRecord per tag of the repository."""
+        return list(self.iter_images(repository_name, query))
+
+    def get_storage_quota(self):
+        """Return the storage used by the project and its quota, in bytes, the quota being -1 when unlimited."""
+        quota = self._get_data_from_response(
+            self._request('GET', f'{self._harbor_url}/api/v2.0/projects/{self._project_name}/summary'))['quota']
+        return quota['used']['storage'], quota['hard']['storage']
+
+    def _repository_url(self, repository_name):
+        rep_name_without_slash = repository_name.replace(f'{self._project_name}/', '').replace('/', '%2F')
+        return f'{self._harbor_url}/api/v2.0/projects/{self._project_name}/repositories/{rep_name_without_slash}'
 
     def delete_image(self, image):
         image_name, tag = image.split(':')
-        rep_name_without_slash = image_name.replace(f'{self._project_name}/', '').replace('/', '%2F')
-        url = f'{self._harbor_url}/api/v2.0/projects/{self._project_name}/repositories/{rep_name_without_slash}' \
-              f'/artifacts/{tag}'
-        self._delete_image(url)
+        self._delete_image(f'{self._repository_url(image_name)}/artifacts/{tag}')
+
+    def delete_artifact(self, repository_name, reference):
+        """Delete an artifact, with all its tags, by digest or tag."""
+        self._delete_image(f'{self._repository_url(repository_name)}/artifacts/{reference}')
+
+    def delete_tag(self, repository_name, reference, tag):
+        """Remove only a tag from an artifact, the artifact and its other tags are kept."""
+        self._delete_image(f'{self._repository_url(repository_name)}/artifacts/{reference}/tags/{tag}')
+
+    def delete_action(self, action):
+        if action.artifact:
+            self.delete_artifact(action.repository, action.digest or action.tags[0])
+        else:
+            self.delete_tag(action.repository, action.digest, action.tags[0])
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+from functools import partial
+
+from metrics import timed
+from scanner import scan_repositories
+
+logger = logging.getLogger('logger')
+
+
+class Inventory:
+    """In-memory snapshot of the repositories of a project and their tag records, shared by all policies."""
+
+    def __init__(self, project_name):
+        self.project_name = project_name
+        self.repositories = []
+        self._images = {}
+
+    def add(self, repository, images):
+        self.repositories.append(repository)
+        self._images[repository['name']] = images
+
+    def images(self, repository_name):
+        return self._images[repository_name]
+
+    def __iter__(self):
+        for repository in self.repositories:
+            yield repository, self._images[repository['name']]
+
+    def __len__(self):
+        return len(self.repositories)
+
+
+def short_repository_name(repository, project_name):
+    return repository["name"].replace(f'{project_name}/', '')
+
+
+def _repository_not_found(repository_name, repositories):
+    repositories_names = [repository_["name"] for repository_ in repositories]
+    return ValueError(f"The repository_name - '{repository_name}' not found. "
+                      f"List of repositories names - {repositories_names}")
+
+
+def _index_repositories(repositories, project_name, repository_name):
+    repositories_by_name = {}
+    for repository in repositories:
+        name = short_repository_name(repository, project_name)
+        if repository_name and repository_name != name:
+            continue
+        repositories_by_name[name] = repository
+    return repositories_by_name
+
+
+def _filter_shard(repositories_by_name, shard):
+    if shard is None:
+        return repositories_by_name
+    return {name: repository for name, repository in repositories_by_name.items()
+            if shard.contains(repository['name'])}
+
+
+def list_repositories(harbor_client, project_name, repository_name=None, repository_prefix=None, shard=None):
+    """
+    Return {short repository name: repository} of the project, filtered by name or prefix,
+    and only those of the Shard `shard` if given.
+    """
+    repositories = harbor_client.get_repositories(name=repository_name, name_prefix=repository_prefix)
+    repositories_by_name = _index_repositories(repositories, project_name, repository_name)
+    if repository_name and not repositories_by_name:
+        raise _repository_not_found(repository_name, harbor_client.get_repositories())
+    return _filter_shard(repositories_by_name, shard)
+
+
+def iter_repositories(harbor_client, project_name, repository_name=None, repository_prefix=None, shard=None):
+    """
+    Yield the (short repository name, repository) pairs of list_repositories as the pages of the listing arrive,
+    so that the first repositories can be fetched while the next ones are listed.
+    """
+    if repository_name:
+        yield from list_repositories(harbor_client, project_name, repository_name, shard=shard).items()
+        return
+    for repository in harbor_client.iter_repositories(name_prefix=repository_prefix):
+        if shard is None or shard.contains(repository['name']):
+            yield short_repository_name(repository, project_name), repository
+
+
+def build_inventory(harbor_client, project_name, repository_name=None, workers=1, cache=None, refresh_all=False,
+                    repository_prefix=None, query=None, shard=None, metrics=None):
+    """
+    Crawl the project once: list its repositories and fetch the images of each of them.
+    With an InventoryCache, only repositories whose update_time or artifact_count changed are fetched,
+    unless refresh_all is set. repository_name, repository_prefix and the artifact query are filtered by Harbor.
+    Both steps are timed as phases of the Metrics `metrics` if given.
+    """
+    with timed(metrics, 'repository_listing'):
+        repositories_by_name = list_repositories(harbor_client, project_name, repository_name, repository_prefix,
+                                                 shard)
+
+    cached_images = {}
+    if cache is not None and not refresh_all:
+        for name, repository in repositories_by_name.items():
+            images = cache.get(project_name, repository, query)
+            if images is not None:
+                cached_images[name] = images
+    stale_names = [name for name in repositories_by_name if name not in cached_images]
+    logger.info(f"Fetching artifacts of {len(stale_names)} repositories, "
+                f"{len(cached_images)} repositories unchanged since the last run")
+
+    fetched_images = {}
+    get_images = partial(harbor_client.get_images, query=query) if query else harbor_client.get_images
+    with timed(metrics, 'artifact_fetch'):
+        for name, images in scan_repositories(get_images, stale_names, workers):
+            fetched_images[name] = images
+            if cache is not None:
+                cache.put(project_name, repositories_by_name[name], images, query)
+
+    if cache is not None:
+        if not repository_name and not repository_prefix and shard is None:
+            cache.prune(project_name, [repository["name"] for repository in repositories_by_name.values()])
+        cache.commit()
+
+    inventory = Inventory(project_name)
+    for name, repository in repositories_by_name.items():
+        inventory.add(repository, cached_images[name] if name in cached_images else fetched_images[name])
+    logger.info(f"Inventory of project {project_name}: {len(inventory)} repositories, "
+                f"{sum(len(images) for _, images in inventory)} images")
+    return inventory
+
+
+async def build_inventory_async(harbor_client, project_name, repository_name=None, repository_prefix=None,
+                                query=None, shard=None, metrics=None):
+    """build_inventory for an AsyncHarborClient: the artifacts of all repositories are requested at once."""
+    with timed(metrics, 'repository_listing'):
+        repositories = await harbor_client.get_repositories(name=repository_name, name_prefix=repository_prefix)
+        repositories_by_name = _index_repositories(repositories, project_name, repository_name)
+        if repository_name and not repositories_by_name:
+            raise _repository_not_found(repository_name, await harbor_client.get_repositories())
+    repositories_by_name = _filter_shard(repositories_by_name, shard)
+
+    with timed(metrics, 'artifact_fetch'):
+        all_images = await asyncio.gather(*(harbor_client.get_images(name, query) for name in repositories_by_name))
+    inventory = Inventory(project_name)
+    for repository, images in zip(repositories_by_name.values(), all_images):
+        inventory.add(repository, images)
+    logger.info(f"Inventory of project {project_name}: {len(inventory)} repositories, "
+                f"{sum(len(images) for _, images in inventory)} images")
+    return inventory
@@ -0,0 +1,116 @@
+import json
+import logging
+import sqlite3
+import threading
+
+from inventory import Inventory
+from records import TagRecord
+
+logger = logging.getLogger('logger')
+
+# columns of TagRecord.to_row: tag, pushed_at, pulled_at, digest, size
+ROW_LENGTH = 5
+
+
+class InventoryCache:
+    """
+    SQLite store of the tag records of each repository, keyed by project and repository name.
+    An entry is only reused while the repository's update_time and artifact_count are unchanged
+    and it was fetched with the same artifact query. Entries written before artifact sizes were stored are stale.
+    The projects of a run share one cache: its calls are serialized and each put is committed at once,
+    so no write transaction is held while a project is crawled.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS repositories (
+                project TEXT NOT NULL,
+                name TEXT NOT NULL,
+                update_time TEXT,
+                artifact_count INTEGER,
+                query TEXT NOT NULL,
+                images TEXT NOT NULL,
+                PRIMARY KEY (project, name)
+            )""")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, project, repository, query=None):
+        """Return the cached tag records of the repository, or None if missing or stale."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT update_time, artifact_count, query, images FROM repositories WHERE project = ? AND name = ?",
+                (project, repository['name'])).fetchone()
+        if row is None:
+            return None
+        update_time, artifact_count, cached_query, images = row
+        if update_time != repository.get('update_time') or artifact_count != repository.get('artifact_count') \
+                or cached_query != (query or ''):
+            return None
+        rows = json.loads(images)
+        if rows and len(rows[0]) < ROW_LENGTH:
+            return None
+        return [TagRecord.from_row(repository['name'], row) for row in rows]
+
+    def load(self, project_names=None):
+        """
+        Return an Inventory of every cached project, or of those in `project_names`, whatever their age,
+        as snapshots to evaluate policies offline. Entries written before artifact sizes were stored have size 0.
+        """
+        inventories = {}
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT project, name, update_time, artifact_count, images FROM repositories ORDER BY project, name"
+            ).fetchall()
+        for project, name, update_time, artifact_count, images in rows:
+            if project_names and project not in project_names:
+                continue
+            if project not in inventories:
+                inventories[project] = Inventory(project)
+            inventories[project].add({"name": name, "update_time": update_time, "artifact_count": artifact_count},
+                                     [TagRecord.from_row(name, row) for row in json.loads(images)])
+        return list(inventories.values())
+
+    def put(self, project, repository, images, query=None):
+        rows = json.dumps([image.to_row() for image in images], separators=(',', ':'))
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO repositories (project, name, update_time, artifact_count, query, images) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (project, repository['name'], repository.get('update_time'), repository.get('artifact_count'),
+                 query or '', rows))
+            self._connection.commit()
+
+    def prune(self, project, repository_names):
+        """Drop entries of repositories that no longer exist in the project."""
+        repository_names = set(repository_names)
+        with self._lock:
+            cached_names = [row[0] for row in
+                            self._connection.execute("SELECT name FROM repositories WHERE project = ?", (project,))]
+            removed = [(project, name) for name in cached_names if name not in repository_names]
+            self._connection.executemany("DELETE FROM repositories WHERE project = ? AND name = ?", removed)
+            self._connection.commit()
+        return len(removed)
+
+    def clear(self, project=None):
+        with self._lock:
+            if project is None:
+                self._connection.execute("DELETE FROM repositories")
+            else:
+                self._connection.execute("DELETE FROM repositories WHERE project = ?", (project,))
+            self._connection.commit()
+
+    def commit(self):
+        with self._lock:
+            self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
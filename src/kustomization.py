@@ -0,0 +1,142 @@
+import json
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import yaml
+
+logger = logging.getLogger('logger')
+
+# libyaml based loader when PyYAML was built with it
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+DEFAULT_PRUNE_DIRS = ['.git', '.hg', '.svn', 'vendor', 'node_modules', '.terraform', '.venv', '__pycache__']
+KUSTOMIZATION_FILE_REGEXP = re.compile('(kustomization.*)')
+
+
+def get_kustomization_files(root='.', prune_dirs=DEFAULT_PRUNE_DIRS):
+    """Get all kustomization files in root and its subdirectories, skipping the prune_dirs directories."""
+    prune_dirs = set(prune_dirs)
+    kustomization_files = []
+    for dirpath, dirs, files in os.walk(root):
+        dirs[:] = [directory for directory in dirs if directory not in prune_dirs]
+        for file in files:
+            if KUSTOMIZATION_FILE_REGEXP.match(file):
+                kustomization_files.append(os.path.join(dirpath, file))
+    return sorted(kustomization_files)
+
+
+def get_harbor_images(kustomization_yaml, domain_name):
+    """Extract harbor images from kustomization yaml file."""
+    images = kustomization_yaml.get('images', [])
+    harbor_images = []
+    for image in images:
+        if 'name' not in image and 'newName' not in image:
+            logger.error(f"ERROR: Not found 'name' in images section. {images}")
+            exit(1)
+        if 'newName' in image:
+            if image['newName'].split('/')[0] == domain_name:
+                harbor_images.append({"name": f"{image['newName']}", "tag": f"{image['newTag']}"})
+        elif image['name'].split('/')[0] == domain_name:
+            harbor_images.append({"name": f"{image['name']}", "tag": f"{image['newTag']}"})
+
+    return harbor_images
+
+
+def _load_images_section(path):
+    """Return the images section of a kustomization file."""
+    with open(path, 'r') as f:
+        kustomization_yaml = yaml.load(f, Loader=YAML_LOADER)
+    if not isinstance(kustomization_yaml, dict):
+        return []
+    return kustomization_yaml.get('images') or []
+
+
+class KustomizationCache:
+    """JSON file with the images section of each kustomization file, reused while its mtime and size match."""
+
+    def __init__(self, path):
+        self._path = path
+        self._entries = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self._entries = json.load(f)
+
+    def get(self, path, stat):
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+            return entry[2]
+        return None
+
+    def put(self, path, stat, images):
+        self._entries[path] = [stat.st_mtime_ns, stat.st_size, images]
+
+    def save(self, paths):
+        """Write the entries of the given paths, dropping files that disappeared."""
+        entries = {path: self._entries[path] for path in paths if path in self._entries}
+        with open(self._path, 'w') as f:
+            json.dump(entries, f, separators=(',', ':'))
+
+
+def load_images_sections(paths, workers=1, cache=None):
+    """Return {path: images section}, parsing the files missing from the cache in up to `workers` processes."""
+    sections = {}
+    stats = {path: os.stat(path) for path in paths}
+    if cache is not None:
+        for path in paths:
+            images = cache.get(path, stats[path])
+            if images is not None:
+                sections[path] = images
+    stale_paths = [path for path in paths if path not in sections]
+
+    if workers > 1 and len(stale_paths) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunksize = max(1, len(stale_paths) // (workers * 4))
+            parsed = executor.map(_load_images_section, stale_paths, chunksize=chunksize)
+            sections.update(zip(stale_paths, parsed))
+    else:
+        sections.update((path, _load_images_section(path)) for path in stale_paths)
+
+    if cache is not None:
+        for path in stale_paths:
+            cache.put(path, stats[path], sections[path])
+        cache.save(paths)
+    logger.info(f"Parsed {len(stale_paths)} kustomization files, {len(paths) - len(stale_paths)} unchanged")
+    return sections
+
+
+class KustomizationIndex:
+    """Index of the images deployed by kustomization files: image name -> set of tags."""
+
+    def __init__(self):
+        self._tags = {}
+
+    def add(self, name, tag):
+        self._tags.setdefault(name, set()).add(tag)
+
+    def protected_tags(self, name):
+        return self._tags.get(name, frozenset())
+
+    def images(self):
+        return [{"name": name, "tag": tag} for name in sorted(self._tags) for tag in sorted(self._tags[name])]
+
+    def __len__(self):
+        return sum(len(tags) for tags in self._tags.values())
+
+
+def build_kustomization_index(domain_name, root='.', prune_dirs=DEFAULT_PRUNE_DIRS, workers=1, cache_path=None):
+    """
+    Scan the kustomization files under root and index the images they deploy from the Harbor domain,
+    or from any of the domains when `domain_name` is a list.
+    """
+    domain_names = [domain_name] if isinstance(domain_name, str) else domain_name
+    paths = get_kustomization_files(root, prune_dirs)
+    cache = KustomizationCache(cache_path) if cache_path else None
+    sections = load_images_sections(paths, workers, cache)
+
+    index = KustomizationIndex()
+    for path in paths:
+        for domain in domain_names:
+            for image in get_harbor_images({'images': sections[path]}, domain):
+                index.add(image['name'], image['tag'])
+    return index
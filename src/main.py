@@ -1,91 +1,171 @@
 import argparse
+import asyncio
 import logging
-import os
-import re
-from datetime import datetime, timedelta
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pformat
+from typing import NamedTuple
+from urllib.parse import urlparse
 
 import requests
-import yaml
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 
+from async_harbor_client import AsyncHarborClient
+from audit import DELETE, KEEP, AuditLog
 from config import load_cleanup_policy, validate_policy, merge_policies, get_field_from_rule
-from harbor_client import HarborClient
-from utils import regexp_match, extract_semver
+from deleter import (DeletionExecutor, DeletionLimits, DeletionReport, RateLimiter, count_tags_per_digest,
+                     delete_images_async, group_deletions)
+from harbor_client import HarborApiError, HarborClient, build_query
+from inventory import build_inventory, build_inventory_async, iter_repositories, list_repositories
+from inventory_cache import InventoryCache
+from kustomization import DEFAULT_PRUNE_DIRS, build_kustomization_index
+from metrics import Metrics, profiled, save_metrics, timed, write_prometheus_textfile
+from pipeline import run_pipeline
+from plan import PlanJournal, PlanWriter, read_plan
+from report import build_report, save_report
+from shard import parse_shard
+from policy import StreamingEvaluator, classify_images, compile_policy
+from quota import bytes_over_quota, format_size, parse_percentage, parse_size, select_largest
 
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
 logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
 logger = logging.getLogger('logger')
 
-date_regexp = re.compile(r'\d{8}|\d{12}|\d{14}')
+# below DEBUG: every image listed by Harbor and every image deployed by kustomization files
+TRACE = 5
+logging.addLevelName(TRACE, 'TRACE')
 
 def combined_list(value):
     items = value.replace(',', ' ').split()
     return [item for item in items if item]
 
 
-def parse_args():
-    """Parse command-line arguments."""
+def parse_args(argv=None):
+    """Parse command-line arguments, those of the process unless `argv` is given."""
     parser = argparse.ArgumentParser(description='Delete Docker images from a Harbor registry.')
     parser.add_argument('--harbor-url', required=True,
                         help='URL of the Harbor registry, including protocol (e.g. https://harbor.example.com)')
     parser.add_argument('--username', required=True, help='Username for the Harbor registry')
     parser.add_argument('--password', required=True, help='Password for the Harbor registry')
-    parser.add_argument('--project-name', required=True, help='Name of the Harbor project')
+    parser.add_argument('--project-name', type=combined_list, nargs='+', required=True,
+                        help='Names of the Harbor projects, PROJECT for a project of --harbor-url or '
+                             'PROJECT@HARBOR_URL for a project of another registry')
+    parser.add_argument('--project-workers', type=int, default=4,
+                        help='Number of projects processed concurrently')
     parser.add_argument('--repository-name', default=None, help='Name of the Harbor repository')
+    parser.add_argument('--repository-prefix', default=None,
+                        help='Only process repositories whose name starts with this prefix')
+    parser.add_argument('--tag-filter', default=None,
+                        help='Only fetch artifacts with a tag containing this string (filtered by Harbor)')
+    parser.add_argument('--pushed-after', default=None,
+                        help='Only fetch artifacts pushed after this time, e.g. "2024-01-01 00:00:00"')
+    parser.add_argument('--pushed-before', default=None,
+                        help='Only fetch artifacts pushed before this time, e.g. "2024-01-01 00:00:00"')
     parser.add_argument('--domain-name', default='registry.ru', required=True,
                         help='Domain name to match against image names')
     parser.add_argument('--ignore-tags', type=combined_list, nargs='*', default=[], help='List of image tags to exclude from deletion')
     parser.add_argument('--ignore-repos', type=combined_list, nargs='*', default=[], help='List of image repos to exclude from deletion')
+    parser.add_argument('--kustomization-root', default='.',
+                        help='Directory scanned for kustomization files whose images are never deleted')
+    parser.add_argument('--kustomization-prune', type=combined_list, nargs='*', default=[DEFAULT_PRUNE_DIRS],
+                        help='Directory names skipped while scanning for kustomization files')
+    parser.add_argument('--kustomization-workers', type=int, default=1,
+                        help='Number of processes parsing kustomization files')
+    parser.add_argument('--kustomization-cache', default=None,
+                        help='JSON file caching parsed kustomization files by path and mtime')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Evaluate policies while artifact pages stream in, keeping only `limit` of the tags '
+                             'kept per rule in memory, and delete the images of each repository once it is '
+                             'evaluated (disables --cache-file and --scan-workers)')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='Run repository discovery, artifact fetch, rule evaluation and deletion as concurrent '
+                             'stages connected by bounded queues (cannot be used with --cache-file or --streaming)')
+    parser.add_argument('--queue-size', type=int, default=100, help='Size of the queues between pipeline stages')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='Use the asyncio Harbor client (requires httpx): artifact listings and deletions of '
+                             'all repositories are scheduled at once, bounded by --max-concurrency')
+    parser.add_argument('--max-concurrency', type=int, default=100,
+                        help='Maximum number of in-flight Harbor requests. The threaded client adapts its limit '
+                             'between --min-concurrency and this value from response latency and 429/5xx errors')
+    parser.add_argument('--min-concurrency', type=int, default=1,
+                        help='Number of in-flight Harbor requests the threaded client never goes below')
     parser.add_argument('--dry-run', action='store_true', help='Do a dry run (don\'t actually delete any images)')
-    return parser.parse_args()
-
-
-def get_kustomization_files():
-    """Get all kustomization files in the current directory and its subdirectories."""
-    kustomization_files = []
-    regex = re.compile('(kustomization.*)')
-    for root, dirs, files in os.walk('.'):
-        for file in files:
-            if regex.match(file):
-                kustomization_files.append(os.path.join(root, file))
-    return kustomization_files
-
-
-def get_harbor_images(kustomization_yaml, domain_name):
-    """Extract harbor images from kustomization yaml file."""
-    images = kustomization_yaml.get('images', [])
-    harbor_images = []
-    for image in images:
-        if 'name' not in image and 'newName' not in image:
-            logger.error(f"ERROR: Not found 'name' in images section. {images}")
-            exit(1)
-        if 'newName' in image:
-            if image['newName'].split('/')[0] == domain_name:
-                harbor_images.append({"name": f"{image['newName']}", "tag": f"{image['newTag']}"})
-        elif image['name'].split('/')[0] == domain_name:
-            harbor_images.append({"name": f"{image['name']}", "tag": f"{image['newTag']}"})
-
-    return harbor_images
+    parser.add_argument('--plan-out', default=None,
+                        help='Write the deletions to this JSON Lines plan file instead of running them')
+    parser.add_argument('--apply-plan', default=None,
+                        help='Run the deletions of a plan file written with --plan-out, without listing the registry')
+    parser.add_argument('--shard', type=parse_shard, default=None,
+                        help='Only process the repositories of shard i/N (0 <= i < N), split by a stable hash of '
+                             'their names, so that N jobs share the work without overlap')
+    parser.add_argument('--report-out', default=None,
+                        help='Write the deletions planned, sent and failed of every project to this JSON file')
+    parser.add_argument('--journal', default=None,
+                        help='Journal of the completed deletions of --apply-plan, skipped when the plan is applied '
+                             'again (default: <plan>.journal)')
+    space_target = parser.add_mutually_exclusive_group()
+    space_target.add_argument('--free-bytes', type=parse_size, default=None, metavar='SIZE',
+                              help='Only run the fewest deletions freeing SIZE bytes (e.g. 500G) per project, '
+                                   'largest artifacts first')
+    space_target.add_argument('--target-quota', type=parse_percentage, default=None, metavar='PERCENTAGE',
+                              help='Only run the fewest deletions bringing the storage used by each project down to '
+                                   'PERCENTAGE of its quota (e.g. 80%%), largest artifacts first')
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help='Log the decisions of every repository and rule (-v), and every image listed (-vv); '
+                             'by default only the summaries are logged')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Only log warnings and errors')
+    parser.add_argument('--audit-log', default=None,
+                        help='Write the decision taken on every tag (policy, rule, kept or deleted and why) to this '
+                             'JSON Lines file')
+    parser.add_argument('--metrics-out', default=None,
+                        help='Write the phase timings, HTTP request statistics and evaluation rate to this JSON file')
+    parser.add_argument('--prometheus-out', default=None,
+                        help='Write the same metrics to this file in Prometheus text format, e.g. to a directory '
+                             'of the node exporter textfile collector')
+    parser.add_argument('--profile', default=None, metavar='PREFIX',
+                        help='Profile the run with cProfile and tracemalloc, writing PREFIX.prof and '
+                             'PREFIX.tracemalloc')
+    parser.add_argument('--pool-size', type=int, default=10,
+                        help='Number of keep-alive connections kept in the HTTP connection pool')
+    parser.add_argument('--http2', action='store_true', help='Use HTTP/2 for Harbor API calls (requires httpx[http2])')
+    parser.add_argument('--scan-workers', type=int, default=1,
+                        help='Number of repositories whose artifacts are fetched concurrently')
+    parser.add_argument('--cache-file', default=None,
+                        help='SQLite file caching repository artifacts between runs; only changed repositories '
+                             'are fetched again')
+    parser.add_argument('--refresh-all', action='store_true',
+                        help='Fetch every repository again and rewrite the cache')
+    parser.add_argument('--clear-cache', action='store_true', help='Drop the cached entries of the project first')
+    parser.add_argument('--delete-workers', type=int, default=1, help='Number of concurrent delete requests')
+    parser.add_argument('--delete-rps', type=float, default=None,
+                        help='Maximum number of delete requests per second (default: unlimited)')
+    parser.add_argument('--delete-retries', type=int, default=3,
+                        help='Number of retries with backoff for deletions failing with 429/5xx')
+    args = parser.parse_args(argv)
+    # list arguments may be repeated and hold comma separated values
+    args.project_name = [project for sublist in args.project_name for project in sublist]
+    if args.ignore_repos:
+        args.ignore_repos = [tag for sublist in args.ignore_repos for tag in sublist]
+    if args.ignore_tags:
+        args.ignore_tags = [tag for sublist in args.ignore_tags for tag in sublist]
+    args.kustomization_prune = [directory for sublist in args.kustomization_prune for directory in sublist]
+    return args
 
 
-def get_tags_by_tag_exclusion(tags: list, rule ) -> list:
-    """Return tags that are not in the exclusion list."""
-    exclusions = rule['tags']
-    ignored_list =[]
-    for exclusion in exclusions:
-        if exclusion in tags:
-            ignored_list += [tag for tag in tags if exclusion in tag]
-    return ignored_list
+def get_artifact_query(args):
+    """Build the Harbor artifact filter from the command-line arguments."""
+    ranges = None
+    if args.pushed_after or args.pushed_before:
+        ranges = {'push_time': (args.pushed_after, args.pushed_before)}
+    fuzzy = {'tags': args.tag_filter} if args.tag_filter else None
+    return build_query(fuzzy=fuzzy, ranges=ranges)
 
 
-def sort_tag(tag) -> list:
-    """Sort tags by semantic versioning."""
-    semver = extract_semver(tag)
-    version_parts = semver.split('_')
-    return [int(part) for part in version_parts if part.isdigit()]
-    # return list(map(int, semver.split('_')))
+def get_tags_by_tag_exclusion(tags: list, matcher) -> set:
+    """Return the tags containing any string of the exclusion list."""
+    return {tag for tag in tags if matcher.search(tag)}
 
 
 def get_latest_n_tags(reverse_sorted_tag_list, limit):
@@ -96,188 +176,759 @@ def get_latest_n_tags(reverse_sorted_tag_list, limit):
         return reverse_sorted_tag_list[limit:]
     return reverse_sorted_tag_list
 
-def extract_date(s):
-    match = date_regexp.search(s)
-    if match:
-        date_str = match.group()
-        if len(date_str) == 8:
-            return datetime.strptime(date_str, '%Y%m%d')
-        elif len(date_str) == 12:
-            return datetime.strptime(date_str, '%Y%m%d%H%M')
-        elif len(date_str) == 14:
-            return datetime.strptime(date_str, '%Y%m%d%H%M%S')
-    return None
-
-def get_delete_tags_by_time_in_name(list_tags: list, rule) -> list:
-    """Return the latest tags that match the given regular expression."""
-    exp = rule['regexp']
-    limit = rule['limit']
-
-    # filter by regexp
-    matched_tags = [tag for tag in list_tags if regexp_match(exp, tag)]
-    if matched_tags:
-        # sort by pattern if time pattern found
-        reverse_sorted_tag_list = sorted(matched_tags, key=lambda x: extract_date(x), reverse=True)
-
-        return get_latest_n_tags(reverse_sorted_tag_list, limit)
-    return []
+def get_delete_tags_by_time_in_name(matched_records: list, rule) -> list:
+    """Return the matched tags beyond the `limit` latest ones, by the time in their name."""
+    if matched_records:
+        # tags without a time in their name are the oldest
+        reverse_sorted_tag_list = [record.tag for record in
+                                   sorted(matched_records, key=lambda x: x.name_date, reverse=True)]
 
-def get_delete_tags_by_name_regexp(list_tags: list, rule) -> list:
-    """Return the latest tags that match the given regular expression."""
-    exp = rule['regexp']
-    limit = rule['limit']
+        return get_latest_n_tags(reverse_sorted_tag_list, rule.limit)
+    return []
 
-    # filter by regexp
-    matched_tags = [tag for tag in list_tags if regexp_match(exp, tag)]
-    if matched_tags:
+def get_delete_tags_by_name_regexp(matched_records: list, rule) -> list:
+    """Return the matched tags beyond the `limit` latest ones, by name."""
+    if matched_records:
         # sort by name
-        reverse_sorted_tag_list = sorted(matched_tags, reverse=True)
-        return get_latest_n_tags(reverse_sorted_tag_list, limit)
+        reverse_sorted_tag_list = sorted((record.tag for record in matched_records), reverse=True)
+        return get_latest_n_tags(reverse_sorted_tag_list, rule.limit)
     return []
 
-def get_delete_tags_by_create_time(list_harbor_images, rule):
-    """Return feature tags younger than n days."""
-    delete_docker_images_older_than = rule['days']
-    exp = rule['regexp']
-    matched_images = [image for image in list_harbor_images if regexp_match(exp, image['tag'])]
-    if not matched_images:
+def get_delete_tags_by_create_time(matched_records, rule):
+    """Return the matched tags pushed more than `days` days ago."""
+    if not matched_records:
         return []
 
-    now = datetime.utcnow()
-    last_n_days = now - timedelta(days=delete_docker_images_older_than)
-    sorted_list = sorted(matched_images, key=lambda x: x['push_time'], reverse=True)
-    images_younger_than_n_days = [x for x in sorted_list
-                    if datetime.fromisoformat(x['push_time'].replace('Z', '')) < last_n_days]
-    return [image["tag"] for image in images_younger_than_n_days]
+    last_n_days = int(time.time()) - rule.days * 86400
+    return [record.tag for record in matched_records if 0 < record.pushed_at < last_n_days]
 
 
-def delete_images(harbor_client, list_images_to_delete, dry_run=None):
-    """Delete specified images from the Harbor registry."""
-    logger.info("#" * 10 + " Docker images to remove " + "#" * 10)
-    for image in list_images_to_delete:
-        if dry_run:
-            logger.info(f"DRY RUN: Deleting image {image}")
-        else:
-            logger.info(f"Deleting image {image}")
-            harbor_client.delete_image(image)
+def delete_images(harbor_client, delete_actions, dry_run=None, workers=1, rps=None, retries=3, journal=None,
+                  limits=None):
+    """
+    Run the DeleteActions against the Harbor registry and return a DeletionReport.
+    The DeletionLimits `limits` of the registry, if given, are shared with its other projects.
+    Completed deletions are recorded in the PlanJournal `journal` if given.
+    """
+    logger.debug("#" * 10 + " Docker images to remove " + "#" * 10)
+    if dry_run:
+        for action in delete_actions:
+            logger.debug("DRY RUN: Deleting image %s", action)
+        logger.info(f"DRY RUN: {len(delete_actions)} delete requests not sent")
+        return DeletionReport()
 
+    executor = DeletionExecutor(harbor_client, workers=workers, rps=rps, retries=retries, limits=limits)
+    report = executor.delete(delete_actions, journal)
+    report.log_summary()
+    return report
 
-def get_tags_to_delete(repository, list_harbor_images, kustomization_yaml_images, args, policy):
-    """Process images in a repository."""
-    list_harbor_tags = [image["tag"] for image in list_harbor_images]
-    list_kustomization_yaml_tags = [image["tag"] for image in kustomization_yaml_images if
-                                    image["name"] == f"{args.domain_name}/{repository['name']}"]
-    # logger.info(f"List of all tags: {list_harbor_tags}")
-    # logger.info(f"List of tags to save from kustomization yaml files: {list_kustomization_yaml_tags}")
 
-    tags_to_remove = []
+def get_delete_actions(repository, list_harbor_images, tags_to_delete):
+    """Group the tags to delete of a repository by digest into DeleteActions."""
+    tags_to_delete = set(tags_to_delete)
+    condemned = sorted((image for image in list_harbor_images if image.tag in tags_to_delete), key=lambda x: x.tag)
+    return group_deletions(repository['name'], condemned, count_tags_per_digest(list_harbor_images))
 
-    # ignore repos
-    for rule in policy['rules']:
-        if 'IgnoreRepos' in rule['type']:
-            ignore_repos = rule['repos']
-            for ignore_repo in ignore_repos:
-                if ignore_repo in repository['name']:
-                    logger.info(f"Repository {repository['name']} ignored.")
-                    return []
-
-    for rule in policy['rules']:
-        tags_to_delete_for_rule = []
-        if 'name' not in rule:
-            if rule['type'] not in ['IgnoreTags', 'IgnoreRepos']:
-                rule['name'] = rule['type'] + '-' + rule['regexp']
-            else:
-                rule['name'] = rule['type']
 
-        if rule['type'] == 'DeleteByTimeInName':
-            tags_to_delete = get_delete_tags_by_time_in_name(list_harbor_tags, rule)
-            tags_to_delete_for_rule += set(tags_to_delete)
+def get_tags_to_delete(repository, list_harbor_images, kustomization_index, args, policy, audit=None):
+    """Process images in a repository against a compiled policy, writing every decision to the AuditLog `audit`."""
 
-        elif rule['type'] == 'DeleteByTagName':
-            tags_to_delete = get_delete_tags_by_name_regexp(list_harbor_tags, rule)
-            tags_to_delete_for_rule += set(tags_to_delete)
+    tags_to_remove = []
+
+    # ignore repos
+    if policy.ignore_repos.search(repository['name']):
+        logger.debug("Repository %s ignored.", repository['name'])
+        if audit is not None:
+            audit.record_ignored_repository(policy.name, list_harbor_images)
+        return []
 
-        elif rule['type'] == 'DeleteByCreateTime':
-            tags_to_delete = get_delete_tags_by_create_time(list_harbor_images, rule)
-            tags_to_delete_for_rule += set(tags_to_delete)
+    # first rule matching and condemning each tag, only needed by the audit log
+    matched, condemned = {}, {}
+    for rule, matched_images in zip(policy.delete_rules, classify_images(policy, list_harbor_images)):
+        if rule.type == 'DeleteByTimeInName':
+            tags_to_delete = get_delete_tags_by_time_in_name(matched_images, rule)
+        elif rule.type == 'DeleteByTagName':
+            tags_to_delete = get_delete_tags_by_name_regexp(matched_images, rule)
         else:
-            continue
+            tags_to_delete = get_delete_tags_by_create_time(matched_images, rule)
 
-        logger.info(f"List of tags to delete for rule - {rule['name']}: {tags_to_delete_for_rule}")
+        tags_to_delete_for_rule = sorted(set(tags_to_delete))
+        logger.debug("List of tags to delete for rule - %s: %s", rule.name, tags_to_delete_for_rule)
         tags_to_remove += tags_to_delete_for_rule
+        if audit is not None:
+            for record in matched_images:
+                matched.setdefault(record.tag, rule.name)
+            for tag in tags_to_delete_for_rule:
+                condemned.setdefault(tag, rule.name)
+
+    tags_to_remove = set(tags_to_remove)
+    tags_ignored = set()
+    if policy.ignore_tags:
+        tags_ignored = get_tags_by_tag_exclusion(tags_to_remove, policy.ignore_tags)
+        logger.debug("List of tags to ignore for rule - IgnoreTags: %s", sorted(tags_ignored))
+        tags_to_remove -= tags_ignored
+
+    # tags deployed by kustomization files are never removed
+    tags_deployed = tags_to_remove & kustomization_index.protected_tags(f"{args.domain_name}/{repository['name']}")
+    if tags_deployed:
+        logger.debug("List of tags to save from kustomization yaml files: %s", sorted(tags_deployed))
+        tags_to_remove -= tags_deployed
+
+    tags_to_remove = sorted(tags_to_remove)
+    if audit is not None:
+        audit.record_repository(policy.name, list_harbor_images, matched, condemned, tags_ignored, tags_deployed)
+
+    logger.debug("List of tags in repo %s to remove for policy %s: %s", repository['name'], policy.name,
+                 tags_to_remove)
+    return tags_to_remove
 
-    for rule in policy['rules']:
-        if rule['type'] == 'IgnoreTags':
-            tags_ignored = get_tags_by_tag_exclusion(tags_to_remove, rule)
-            logger.info(f"List of tags to ignore for rule - {rule['name']}: {tags_ignored}")
-            tags_to_remove = [item for item in tags_to_remove if item not in tags_ignored]
-        else:
+
+def get_tags_to_delete_streaming(repository, records, kustomization_index, args, policies, audit=None):
+    """
+    Evaluate compiled policies on tag records as they stream in from Harbor, keeping only the `limit`
+    newest matches of each limit rule and the records to remove in memory, not the records kept.
+    Return the tag records to remove for each policy, sorted by tag, none for a policy ignoring the repository.
+    The AuditLog `audit` gets the decisions of get_tags_to_delete: those of the records kept are written as they
+    are taken, those of the records condemned and of the newest matches once the stream ends.
+    """
+    protected_tags = kustomization_index.protected_tags(f"{args.domain_name}/{repository['name']}")
+    ignored = [bool(policy.ignore_repos.search(repository['name'])) for policy in policies]
+    evaluators = [StreamingEvaluator(policy) for policy in policies]
+    # the record and the index of the first rule, in policy order, condemning each tag
+    candidates_per_policy = [{} for _ in policies]
+    for record in records:
+        for policy, is_ignored, evaluator, condemned in zip(policies, ignored, evaluators, candidates_per_policy):
+            if is_ignored:
+                if audit is not None:
+                    audit.record_ignored_repository(policy.name, [record])
+                continue
+            candidates = evaluator.feed(record)
+            for candidate, rule in candidates:
+                index = policy.delete_rules.index(rule)
+                if candidate.tag not in condemned or index < condemned[candidate.tag][1]:
+                    condemned[candidate.tag] = (candidate, index)
+            if audit is not None and not evaluator.is_limited(record) and \
+                    not any(candidate is record for candidate, _ in candidates):
+                audit.record(policy.name, record, KEEP, *get_kept_reason(policy, record))
+
+    records_to_remove = []
+    for policy, is_ignored, evaluator, condemned in zip(policies, ignored, evaluators, candidates_per_policy):
+        if is_ignored:
+            logger.debug("Repository %s ignored.", repository['name'])
+            records_to_remove.append([])
             continue
+        to_remove = []
+        for tag in sorted(condemned):
+            record, index = condemned[tag]
+            rule_name = policy.delete_rules[index].name
+            # as in get_tags_to_delete, IgnoreTags spares a tag before the kustomization files do
+            if policy.ignore_tags.search(tag):
+                decision = (KEEP, 'IgnoreTags', 'ignored_tag')
+            elif tag in protected_tags:
+                decision = (KEEP, rule_name, 'deployed')
+            else:
+                decision = (DELETE, rule_name, 'matched')
+                to_remove.append(record)
+            if audit is not None:
+                audit.record(policy.name, record, *decision)
+        if audit is not None:
+            retained = {}
+            for record, _ in evaluator.retained():
+                # a record among the newest matches of several rules is kept once
+                if record.tag not in condemned:
+                    retained[record.tag] = record
+            for record in retained.values():
+                audit.record(policy.name, record, KEEP, *get_kept_reason(policy, record))
+        records_to_remove.append(to_remove)
+    return records_to_remove
+
+
+def get_kept_reason(policy, record):
+    """Rule and reason of a record no rule of the policy condemns: retained by the first rule matching it, if any."""
+    rule_name = next((rule.name for rule in policy.delete_rules if rule.pattern.match(record.tag)), None)
+    return rule_name, 'retained' if rule_name else 'no_rule'
+
+
+def run_pipelined(harbor_client, repositories, kustomization_index, args, plans, metrics=None, audit=None,
+                  deletion_limits=None):
+    """
+    Scan, evaluate and delete concurrently the (short name, repository) pairs `repositories` as they are listed,
+    with the DeletionLimits `deletion_limits` of the registry if given.
+    Return the images to delete per policy and the DeletionReport.
+    """
+    def evaluate(repository, records):
+        if metrics is not None:
+            metrics.count('tags_evaluated', len(records) * len(plans))
+        tags_per_policy = [get_tags_to_delete(repository, records, kustomization_index, args, plan, audit)
+                           for plan in plans]
+        tags_to_delete = set().union(*tags_per_policy)
+        return tags_per_policy, get_delete_actions(repository, records, tags_to_delete)
+
+    def dry_run_delete(action):
+        logger.debug("DRY RUN: Deleting image %s", action)
+
+    def plan_delete(action):
+        # the action is only reported, the plan is written once every project is evaluated
+        logger.debug("Planned deleting image %s", action)
+
+    if args.plan_out:
+        delete, delete_workers = plan_delete, 1
+    elif args.dry_run:
+        delete, delete_workers = dry_run_delete, 1
+    else:
+        executor = DeletionExecutor(harbor_client, rps=args.delete_rps, retries=args.delete_retries,
+                                    limits=deletion_limits)
+        delete, delete_workers = executor.delete_one, args.delete_workers
+
+    query = get_artifact_query(args)
+    return run_pipeline(repositories, lambda name: harbor_client.get_images(name, query), evaluate,
+                        delete, len(plans), fetch_workers=args.scan_workers, delete_workers=delete_workers,
+                        queue_size=args.queue_size)
+
+
+def evaluate_inventory(inventory, kustomization_index, args, plans, audit=None):
+    """
+    Evaluate every compiled policy against the inventory snapshot, writing every decision to the AuditLog `audit`.
+    Return the images to delete per policy and the DeleteActions deleting all of them once.
+    """
+    images_to_delete = []
+    tags_to_delete = {repository['name']: set() for repository in inventory.repositories}
+    for plan in plans:
+        list_images_to_delete = []
+        for repository, list_harbor_images in inventory:
+            logger.debug("========> policy: %s, repository: %s start <========", plan.name, repository['name'])
+            if logger.isEnabledFor(TRACE):
+                logger.log(TRACE, "List of images from harbor for repo name %s:\n%s\n", repository['name'],
+                           "\n".join(map(str, list_harbor_images)))
 
-    tags_to_remove = list(set(tags_to_remove))
+            list_tags_to_delete = get_tags_to_delete(repository, list_harbor_images, kustomization_index, args, plan,
+                                                     audit)
 
-    logging.info(f"List of tags in repo {repository['name']} to remove for policy {policy['name']}: {tags_to_remove}\n")
-    return tags_to_remove
+            list_images_to_delete += [f"{repository['name']}:{tag}" for tag in list_tags_to_delete]
+            tags_to_delete[repository['name']].update(list_tags_to_delete)
+            logger.debug("========> policy: %s, repository: %s end <========\n", plan.name, repository['name'])
+        images_to_delete.append(list_images_to_delete)
+
+    delete_actions = []
+    for repository, list_harbor_images in inventory:
+        delete_actions += get_delete_actions(repository, list_harbor_images, tags_to_delete[repository['name']])
+    return images_to_delete, delete_actions
+
+
+def count_digests(records, tags_per_digest):
+    """Count the tags of each digest while the records stream through, those without a digest under None."""
+    for record in records:
+        tags_per_digest[record.digest] += 1
+        yield record
+
+
+def evaluate_streaming(harbor_client, repositories_by_name, kustomization_index, args, plans, flush, metrics=None,
+                       audit=None):
+    """
+    Evaluate every compiled policy while the artifacts of each repository stream in, one repository at a time.
+    The DeleteActions deleting the images of a repository once are passed to `flush` as soon as it is evaluated,
+    as a DeleteAction can only be built once the tags of its digest are all known: only the deletions of the
+    repository being evaluated are held in memory.
+    Return the number of images to delete per policy and the number of DeleteActions flushed.
+    The tags evaluated are counted in the Metrics `metrics` and the decisions written to the AuditLog `audit`.
+    Repositories ignored by every policy are not listed, so their tags are not in the audit log.
+    """
+    image_counts = [0] * len(plans)
+    action_count = 0
+    query = get_artifact_query(args)
+    for repository_name, repository in repositories_by_name.items():
+        active_count = sum(not plan.ignore_repos.search(repository['name']) for plan in plans)
+        if not active_count:
+            logger.debug("Repository %s ignored.", repository['name'])
+            continue
+        tags_per_digest = Counter()
+        records = count_digests(harbor_client.iter_images(repository_name, query), tags_per_digest)
+        records_per_policy = get_tags_to_delete_streaming(repository, records, kustomization_index, args, plans,
+                                                          audit)
+        if metrics is not None:
+            metrics.count('tags_evaluated', sum(tags_per_digest.values()) * active_count)
+        condemned = {}
+        for i, records_to_delete in enumerate(records_per_policy):
+            tags = [record.tag for record in records_to_delete]
+            logger.debug("List of tags in repo %s to remove for policy %s: %s", repository['name'], plans[i].name, tags)
+            image_counts[i] += len(tags)
+            condemned.update((record.tag, record) for record in records_to_delete)
+        delete_actions = group_deletions(repository['name'], [condemned[tag] for tag in sorted(condemned)],
+                                         tags_per_digest)
+        action_count += len(delete_actions)
+        flush(delete_actions)
+    return image_counts, action_count
+
+
+class Target(NamedTuple):
+    """A project of a registry processed by the run."""
+    harbor_url: str
+    project_name: str
+    domain_name: str
+
+
+class RunResult(NamedTuple):
+    """
+    Outcome of a project: the deletions computed and the report of those sent (empty for a dry run or a plan).
+    A --streaming run hands the deletions of each repository over once it is evaluated: they are only counted
+    in `streamed`, not kept in `delete_actions`.
+    """
+    target: Target
+    delete_actions: list
+    report: DeletionReport
+    streamed: int = 0
+
+    @property
+    def planned(self):
+        return len(self.delete_actions) + self.streamed
+
+
+def get_targets(args):
+    """
+    Parse the --project-name entries: PROJECT for a project of --harbor-url, PROJECT@HARBOR_URL for a project
+    of another registry, whose kustomization images are matched against the host of HARBOR_URL.
+    """
+    targets = []
+    for entry in args.project_name:
+        project_name, _, harbor_url = entry.partition('@')
+        harbor_url = harbor_url.rstrip('/')
+        if harbor_url and harbor_url != args.harbor_url.rstrip('/'):
+            targets.append(Target(harbor_url, project_name, urlparse(harbor_url).netloc))
+        else:
+            targets.append(Target(args.harbor_url, project_name, args.domain_name))
+    return targets
 
 
-if __name__ == '__main__':
-    args = parse_args()
-    if args.ignore_repos:
-        args.ignore_repos = [tag for sublist in args.ignore_repos for tag in sublist]
-    if args.ignore_tags:
-        args.ignore_tags = [tag for sublist in args.ignore_tags for tag in sublist]
+def get_target_args(args, target):
+    """Return a copy of the arguments for a single project."""
+    return argparse.Namespace(**dict(vars(args), harbor_url=target.harbor_url, project_name=target.project_name,
+                                     domain_name=target.domain_name))
 
-    cleanup_policy = load_cleanup_policy()
 
-    for policy in merge_policies(cleanup_policy, args):
-        try:
-            validate_policy(policy)
-        except ValueError as e:
-            logger.error(f"Error in policy '{policy['name']}': {str(e)}")
-            exit(1)
-
-        logger.info(f"========== Process with policy '{policy['name']} start ========== \n")
-        logger.info(f"Rules:\n{pformat(policy)}\n")
+def create_harbor_client(args, harbor_url, project_name, project_count=1, budget=None, metrics=None):
+    """Create the HarborClient of a registry, its connection pool sized for `project_count` concurrent projects."""
+    pool_size = max(args.pool_size, args.scan_workers, args.delete_workers) * project_count
+    return HarborClient(harbor_url=harbor_url, project_name=project_name, username=args.username,
+                        password=args.password, pool_size=pool_size, http2=args.http2,
+                        min_concurrency=args.min_concurrency, max_concurrency=args.max_concurrency, budget=budget,
+                        metrics=metrics)
 
-        kustomization_files = get_kustomization_files()
-        kustomization_yaml_images = []
-        for kustomization_file in kustomization_files:
-            with open(kustomization_file, 'r') as f:
-                kustomization_yaml = yaml.safe_load(f)
-                kustomization_yaml_images += get_harbor_images(kustomization_yaml, args.domain_name)
 
-        logger.info(
-            f"List of images from kustomization.yaml files:\n" + "\n".join(map(str, kustomization_yaml_images)) + "\n")
+def log_image_counts(args, plans, image_counts):
+    for plan, image_count in zip(plans, image_counts):
+        logger.info(f"Project {args.project_name}: {image_count} images to remove for policy '{plan.name}'")
 
-        harbor_client = HarborClient(harbor_url=args.harbor_url, project_name=args.project_name, username=args.username, password=args.password)
 
+def log_images_to_delete(args, plans, images_to_delete):
+    """Log the number of images to remove per policy, and the images themselves at DEBUG level."""
+    log_image_counts(args, plans, [len(list_images_to_delete) for list_images_to_delete in images_to_delete])
+    for plan, list_images_to_delete in zip(plans, images_to_delete):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Images to remove for policy '%s':\n%s\n", plan.name, "\n".join(list_images_to_delete))
 
-        repositories = harbor_client.get_repositories()
-        repositories_names = [repository_["name"] for repository_ in repositories]
 
-        list_images_to_delete = []
-        for repository in repositories:
-            logger.info(f"========> policy: {policy['name']}, repository: {repository['name']} start <========")
-            if args.repository_name and f'{args.project_name}/{args.repository_name}' not in repositories_names:
-                logger.error(
-                    f"The repository_name - '{args.repository_name}' not found. "
-                    f"List of repositories names - {repositories_names}")
-                exit(1)
-
-            repository_name = repository["name"].replace(f'{args.project_name}/', '')
-            if args.repository_name and args.repository_name != repository_name:
-                continue
-            list_harbor_images = harbor_client.get_images(repository_name)
+def select_for_space_target(args, delete_actions, storage_quota=None):
+    """
+    Keep the fewest deletions, largest artifacts first, that free --free-bytes or bring the project under
+    --target-quota of its storage quota, `storage_quota` being the (used, hard) storage of the project.
+    """
+    if args.free_bytes is not None:
+        target_bytes = args.free_bytes
+    else:
+        target_bytes = bytes_over_quota(*storage_quota, args.target_quota)
+    selected, reclaimed = select_largest(delete_actions, target_bytes)
+    logger.info(f"Project {args.project_name}: {len(selected)} of {len(delete_actions)} deletions reclaim "
+                f"{format_size(reclaimed)} of the {format_size(target_bytes)} to free")
+    if reclaimed < target_bytes:
+        logger.warning(f"Project {args.project_name}: the policies only allow deleting {format_size(reclaimed)}, "
+                       f"{format_size(target_bytes - reclaimed)} short of the target")
+    return selected
+
+
+def has_space_target(args):
+    return args.free_bytes is not None or args.target_quota is not None
+
+
+def log_connection_stats(harbor_client):
+    logger.info(f"HTTP connection stats: {harbor_client.connection_stats()}, "
+                f"final concurrency limit: {harbor_client.concurrency_limit}")
+
+
+def run(args, plans, kustomization_index, harbor_client=None, metrics=None, audit=None, inventory_cache=None,
+        deletion_limits=None, plan_writer=None):
+    """
+    Crawl, evaluate and delete the project of `args` with the threaded HarborClient `harbor_client`,
+    created for the run when not given. Each phase is timed in the Metrics `metrics` and every decision written
+    to the AuditLog `audit`, if given. The InventoryCache `inventory_cache` of --cache-file is opened for the run
+    when not given, and the deletions share the DeletionLimits `deletion_limits` of the registry if given.
+    With --streaming and --plan-out, the deletions are written to the PlanWriter `plan_writer`, opened for the
+    run when not given. Return a RunResult.
+    """
+    target = Target(args.harbor_url, args.project_name, args.domain_name)
+    owns_client = harbor_client is None
+    if owns_client:
+        harbor_client = create_harbor_client(args, args.harbor_url, args.project_name, metrics=metrics)
+
+    report = DeletionReport()
+    streamed = 0
+    if args.pipeline:
+        # discovery, fetch, evaluation and deletion overlap, they are timed as one phase
+        repositories = iter_repositories(harbor_client, args.project_name, args.repository_name,
+                                         args.repository_prefix, args.shard)
+        with timed(metrics, 'pipeline'):
+            images_to_delete, pipeline_report = run_pipelined(harbor_client, repositories, kustomization_index,
+                                                              args, plans, metrics, audit, deletion_limits)
+        log_images_to_delete(args, plans, images_to_delete)
+        delete_actions = pipeline_report.deleted + [action for action, _ in pipeline_report.failed]
+        if not args.dry_run and not args.plan_out:
+            pipeline_report.log_summary()
+            report = pipeline_report
+    elif args.streaming:
+        with timed(metrics, 'repository_listing'):
+            repositories_by_name = list_repositories(harbor_client, args.project_name, args.repository_name,
+                                                     args.repository_prefix, args.shard)
+        # the deletions of a repository are handed over once it is evaluated, evaluation and deletion
+        # interleave and are timed as one phase
+        owns_writer = plan_writer is None and args.plan_out is not None
+        if owns_writer:
+            plan_writer = PlanWriter(args.plan_out, args.harbor_url)
+        report = DeletionReport(keep_deleted=False)
+        executor = DeletionExecutor(harbor_client, workers=args.delete_workers, rps=args.delete_rps,
+                                    retries=args.delete_retries, limits=deletion_limits)
+
+        def flush(actions):
+            if args.plan_out:
+                plan_writer.write(actions, args.harbor_url)
+            elif args.dry_run:
+                for action in actions:
+                    logger.debug("DRY RUN: Deleting image %s", action)
+            else:
+                executor.delete(actions, report=report)
 
-            logger.info(
-               f"List of images from harbor for repo name "
-               f"{repository['name']}:\n" + "\n".join(map(str, list_harbor_images)) + "\n")
+        try:
+            with timed(metrics, 'streaming_evaluation'):
+                image_counts, streamed = evaluate_streaming(harbor_client, repositories_by_name, kustomization_index,
+                                                            args, plans, flush, metrics, audit)
+        finally:
+            if owns_writer:
+                plan_writer.close()
+        log_image_counts(args, plans, image_counts)
+        if args.dry_run and not args.plan_out:
+            logger.info(f"DRY RUN: {streamed} delete requests not sent")
+        elif not args.plan_out:
+            report.log_summary()
+        delete_actions = []
+    else:
+        owns_cache = inventory_cache is None and args.cache_file is not None
+        if owns_cache:
+            inventory_cache = InventoryCache(args.cache_file)
+        if inventory_cache is not None and args.clear_cache:
+            inventory_cache.clear(args.project_name)
 
+        # the registry is crawled once and every policy is evaluated against the same snapshot
+        try:
+            inventory = build_inventory(harbor_client, args.project_name, args.repository_name,
+                                        args.scan_workers, cache=inventory_cache, refresh_all=args.refresh_all,
+                                        repository_prefix=args.repository_prefix,
+                                        query=get_artifact_query(args), shard=args.shard, metrics=metrics)
+        finally:
+            if owns_cache:
+                inventory_cache.close()
+        with timed(metrics, 'rule_evaluation'):
+            images_to_delete, delete_actions = evaluate_inventory(inventory, kustomization_index, args, plans,
+                                                                  audit)
+        if metrics is not None:
+            metrics.count('tags_evaluated', sum(len(images) for _, images in inventory) * len(plans))
+
+        log_images_to_delete(args, plans, images_to_delete)
+        if has_space_target(args):
+            storage_quota = harbor_client.get_storage_quota() if args.target_quota is not None else None
+            delete_actions = select_for_space_target(args, delete_actions, storage_quota)
+        # images selected by several policies, and tags sharing an artifact, are deleted in a single request
+        if not args.plan_out:
+            with timed(metrics, 'deletion'):
+                report = delete_images(harbor_client, delete_actions, args.dry_run, workers=args.delete_workers,
+                                       rps=args.delete_rps, retries=args.delete_retries, limits=deletion_limits)
+
+    if owns_client:
+        log_connection_stats(harbor_client)
+        harbor_client.close()
+    return RunResult(target, delete_actions, report, streamed)
+
+
+def run_targets(args, targets, plans, kustomization_index, metrics=None, audit=None, plan_writer=None):
+    """
+    Run the projects concurrently, --project-workers at a time. The projects of a registry share one
+    HarborClient session, concurrency limit, --delete-rps rate and --delete-workers deletions in flight,
+    and all registries share the --max-concurrency budget, the --cache-file inventory cache and the PlanWriter
+    `plan_writer` of --plan-out. Return the RunResults in the order of the targets.
+    """
+    budget = threading.BoundedSemaphore(args.max_concurrency)
+    project_workers = max(1, min(args.project_workers, len(targets)))
+    harbor_clients = {}
+    deletion_limits = {}
+    for target in targets:
+        if target.harbor_url not in harbor_clients:
+            project_count = min(project_workers, sum(t.harbor_url == target.harbor_url for t in targets))
+            harbor_clients[target.harbor_url] = create_harbor_client(args, target.harbor_url, target.project_name,
+                                                                     project_count, budget, metrics)
+            deletion_limits[target.harbor_url] = DeletionLimits.create(args.delete_rps, args.delete_workers)
+    # one connection for all projects: a connection each would wait on the write lock of the others
+    inventory_cache = None
+    if args.cache_file and not args.streaming:
+        inventory_cache = InventoryCache(args.cache_file)
+    try:
+        with ThreadPoolExecutor(max_workers=project_workers) as executor:
+            futures = [executor.submit(run, get_target_args(args, target), plans, kustomization_index,
+                                       harbor_clients[target.harbor_url].for_project(target.project_name), metrics,
+                                       audit, inventory_cache, deletion_limits[target.harbor_url], plan_writer)
+                       for target in targets]
+            return [future.result() for future in futures]
+    finally:
+        if inventory_cache is not None:
+            inventory_cache.close()
+        for harbor_url, harbor_client in harbor_clients.items():
+            logger.info(f"Registry {harbor_url}:")
+            log_connection_stats(harbor_client)
+            harbor_client.close()
+
+
+async def run_async(args, plans, kustomization_index, harbor_client, metrics=None, audit=None, rate_limiter=None):
+    """
+    Crawl, evaluate and delete the project of `args` with the AsyncHarborClient `harbor_client`, the deletions
+    sharing the RateLimiter `rate_limiter` of the registry if given. Return a RunResult.
+    """
+    target = Target(args.harbor_url, args.project_name, args.domain_name)
+    report = DeletionReport()
+    inventory = await build_inventory_async(harbor_client, args.project_name, args.repository_name,
+                                            args.repository_prefix, get_artifact_query(args), args.shard, metrics)
+    with timed(metrics, 'rule_evaluation'):
+        images_to_delete, delete_actions = evaluate_inventory(inventory, kustomization_index, args, plans, audit)
+    if metrics is not None:
+        metrics.count('tags_evaluated', sum(len(images) for _, images in inventory) * len(plans))
+
+    log_images_to_delete(args, plans, images_to_delete)
+    if has_space_target(args):
+        storage_quota = await harbor_client.get_storage_quota() if args.target_quota is not None else None
+        delete_actions = select_for_space_target(args, delete_actions, storage_quota)
+    if not args.plan_out:
+        if args.dry_run:
+            delete_images(harbor_client, delete_actions, dry_run=True)
+        else:
+            with timed(metrics, 'deletion'):
+                report = await delete_images_async(harbor_client, delete_actions, rps=args.delete_rps,
+                                                   retries=args.delete_retries, rate_limiter=rate_limiter)
+            report.log_summary()
+    return RunResult(target, delete_actions, report)
+
+
+async def run_targets_async(args, targets, plans, kustomization_index, metrics=None, audit=None):
+    """
+    Run every project at once with the asyncio client, one AsyncHarborClient per registry shared by its
+    projects with its --delete-rps rate, and one semaphore bounding the requests in flight across all registries.
+    Return the RunResults.
+    """
+    semaphore = asyncio.Semaphore(args.max_concurrency)
+    harbor_clients = {}
+    rate_limiters = {}
+    for target in targets:
+        if target.harbor_url not in harbor_clients:
+            rate_limiters[target.harbor_url] = RateLimiter(args.delete_rps)
+            harbor_clients[target.harbor_url] = AsyncHarborClient(
+                harbor_url=target.harbor_url, project_name=target.project_name, username=args.username,
+                password=args.password, max_concurrency=args.max_concurrency, http2=args.http2, semaphore=semaphore,
+                metrics=metrics)
+    try:
+        return await asyncio.gather(*(run_async(get_target_args(args, target), plans, kustomization_index,
+                                                harbor_clients[target.harbor_url].for_project(target.project_name),
+                                                metrics, audit, rate_limiters[target.harbor_url])
+                                      for target in targets))
+    finally:
+        for harbor_client in harbor_clients.values():
+            await harbor_client.aclose()
+
+
+def write_run_plan(plan_writer, results):
+    """
+    Write the deletions of every project to the PlanWriter of --plan-out, tagging those of other registries
+    with their URL. Those of --streaming runs were written as they were computed.
+    """
+    for result in results:
+        plan_writer.write(result.delete_actions, result.target.harbor_url)
+
+
+def log_run_summary(results):
+    """Log the deletions of every project, and their total when several projects were processed."""
+    logger.info("#" * 10 + " Summary " + "#" * 10)
+    for result in results:
+        logger.info(f"Project {result.target.project_name} of {result.target.harbor_url}: "
+                    f"{result.planned} delete requests planned, {result.report.deleted_count} sent, "
+                    f"{len(result.report.failed)} failed")
+    if len(results) > 1:
+        logger.info(f"Total: {sum(result.planned for result in results)} delete requests planned, "
+                    f"{sum(result.report.deleted_count for result in results)} sent, "
+                    f"{sum(len(result.report.failed) for result in results)} failed")
+
+
+def apply_plan(args, metrics=None):
+    """Run the deletions of a plan file, skipping those its journal records as done; return the failed ones."""
+    delete_actions = read_plan(args.apply_plan)
+    with PlanJournal(args.journal or f"{args.apply_plan}.journal") as journal:
+        pending_actions = journal.pending(delete_actions)
+        logger.info(f"Plan {args.apply_plan}: {len(delete_actions)} deletions, "
+                    f"{len(delete_actions) - len(pending_actions)} already done")
+        if args.dry_run:
+            delete_images(None, pending_actions, dry_run=True)
+            return []
+
+        # the deletions are run project by project, the projects of a registry sharing one session
+        actions_by_project = {}
+        for action in pending_actions:
+            project_name = action.repository.split('/')[0]
+            actions_by_project.setdefault((action.harbor_url or args.harbor_url, project_name), []).append(action)
+        harbor_clients = {}
+        deletion_limits = {}
+        failed_deletions = []
+        try:
+            for (harbor_url, project_name), actions in actions_by_project.items():
+                if harbor_url not in harbor_clients:
+                    harbor_clients[harbor_url] = create_harbor_client(args, harbor_url, project_name,
+                                                                      metrics=metrics)
+                    deletion_limits[harbor_url] = DeletionLimits.create(args.delete_rps, args.delete_workers)
+                with timed(metrics, 'deletion'):
+                    report = delete_images(harbor_clients[harbor_url].for_project(project_name), actions,
+                                           workers=args.delete_workers, rps=args.delete_rps,
+                                           retries=args.delete_retries, journal=journal,
+                                           limits=deletion_limits[harbor_url])
+                failed_deletions += report.failed
+        finally:
+            for harbor_client in harbor_clients.values():
+                harbor_client.close()
+    return failed_deletions
+
+
+def compile_policies(args, cleanup_policy=None):
+    """
+    Load, merge and validate the cleanup policies, those of harbor_cleanup_policy.yaml unless `cleanup_policy`
+    is given, exit on an invalid one, return their compiled plans.
+    """
+    if cleanup_policy is None:
+        cleanup_policy = load_cleanup_policy()
+    policies = merge_policies(cleanup_policy, args)
+    for policy in policies:
+        try:
+            validate_policy(policy)
+        except ValueError as e:
+            logger.error(f"Error in policy '{policy['name']}': {str(e)}")
+            exit(1)
+    plans = [compile_policy(policy) for policy in policies]
+    if logger.isEnabledFor(logging.DEBUG):
+        for policy in policies:
+            logger.debug("Rules of policy '%s':\n%s\n", policy['name'], pformat(policy))
+    return plans
+
+
+def get_log_level(args):
+    """Summaries only by default, then the decisions of every repository (-v) and every image listed (-vv)."""
+    if args.quiet:
+        return logging.WARNING
+    if args.verbose >= 2:
+        return TRACE
+    return logging.DEBUG if args.verbose else logging.INFO
+
+
+def set_log_levels(args):
+    """
+    Apply the verbosity to the logger of the cleaner and to those of the libraries, which never log below INFO.
+    httpx logs every request at INFO, those lines are only kept with -v.
+    """
+    level = get_log_level(args)
+    logger.setLevel(level)
+    logging.getLogger().setLevel(max(level, logging.INFO))
+    logging.getLogger('httpx').setLevel(logging.INFO if level < logging.INFO else logging.WARNING)
+
+
+def get_pipeline_conflicts(args):
+    """Return the options set on the command line that --pipeline does not support."""
+    options = {'--cache-file': args.cache_file, '--streaming': args.streaming}
+    return [option for option, value in options.items() if value]
+
+
+def get_async_conflicts(args):
+    """Return the options set on the command line that the asyncio client does not support."""
+    options = {'--cache-file': args.cache_file, '--streaming': args.streaming, '--pipeline': args.pipeline,
+               '--scan-workers': args.scan_workers > 1, '--delete-workers': args.delete_workers > 1,
+               '--min-concurrency': args.min_concurrency > 1}
+    return [option for option, value in options.items() if value]
+
+
+def main(args, metrics):
+    """Run the cleanup described by the arguments, return the deletions that failed."""
+    if has_space_target(args) and (args.streaming or args.pipeline or args.apply_plan):
+        # deletions are ranked once every repository of a project is evaluated
+        raise ValueError("--free-bytes and --target-quota cannot be used with --streaming, --pipeline or "
+                         "--apply-plan")
+    if args.use_async and get_async_conflicts(args):
+        raise ValueError(f"{', '.join(get_async_conflicts(args))} cannot be used with --async")
+    if args.pipeline and get_pipeline_conflicts(args):
+        raise ValueError(f"{', '.join(get_pipeline_conflicts(args))} cannot be used with --pipeline")
+    if args.apply_plan:
+        # a plan is applied as written, without listing the registry or evaluating policies
+        return apply_plan(args, metrics)
+
+    targets = get_targets(args)
+    plans = compile_policies(args)
+    # the kustomization files are scanned once for the domains of every registry
+    domain_names = sorted({target.domain_name for target in targets})
+    with metrics.phase('kustomization_scan'):
+        kustomization_index = build_kustomization_index(domain_names, args.kustomization_root,
+                                                        args.kustomization_prune, args.kustomization_workers,
+                                                        args.kustomization_cache)
+    if logger.isEnabledFor(TRACE):
+        logger.log(TRACE, "List of images from kustomization.yaml files:\n%s\n",
+                   "\n".join(map(str, kustomization_index.images())))
+
+    audit = AuditLog(args.audit_log) if args.audit_log else None
+    plan_writer = PlanWriter(args.plan_out, args.harbor_url) if args.plan_out else None
+    try:
+        if args.use_async:
+            results = asyncio.run(run_targets_async(args, targets, plans, kustomization_index, metrics, audit))
+        else:
+            results = run_targets(args, targets, plans, kustomization_index, metrics, audit, plan_writer)
+        if plan_writer is not None:
+            write_run_plan(plan_writer, results)
+    finally:
+        if audit is not None:
+            audit.close()
+        if plan_writer is not None:
+            plan_writer.close()
+    if args.report_out:
+        save_report(args.report_out, build_report(results, args.shard))
+    log_run_summary(results)
+    return [failure for result in results for failure in result.report.failed]
 
-            list_tags_to_delete = get_tags_to_delete(repository, list_harbor_images, kustomization_yaml_images, args, policy)
 
-            list_images_to_delete += [f"{repository['name']}:{tag}" for tag in list_tags_to_delete]
-            logger.info(f"========> policy: {policy['name']}, repository: {repository['name']} end <========\n")
+if __name__ == '__main__':
+    args = parse_args()
+    set_log_levels(args)
+    metrics = Metrics()
 
-        delete_images(harbor_client, list_images_to_delete, args.dry_run)
-        logger.info(f"========== Process with policy '{policy['name']} complete ========== \n")
+    try:
+        if args.profile:
+            with profiled(args.profile):
+                failed_deletions = main(args, metrics)
+        else:
+            failed_deletions = main(args, metrics)
+    except (ValueError, HarborApiError) as e:
+        logger.error(str(e))
+        exit(1)
+    finally:
+        metrics.log_summary()
+        if args.metrics_out:
+            save_metrics(args.metrics_out, metrics)
+        if args.prometheus_out:
+            write_prometheus_textfile(args.prometheus_out, metrics)
+
+    if failed_deletions:
+        logger.error(f"{len(failed_deletions)} images could not be deleted")
+        exit(1)
@@ -0,0 +1,59 @@
+from collections import deque
+
+
+class SubstringMatcher:
+    """
+    Aho-Corasick automaton telling whether a string contains any of the patterns.
+    Built once, a lookup costs O(len(text)) however many patterns there are.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = tuple(patterns)
+        self._match_all = '' in self.patterns
+        self._goto = [{}]
+        self._terminal = [False]
+        for pattern in set(self.patterns):
+            node = 0
+            for char in pattern:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto.append({})
+                    self._terminal.append(False)
+                    self._goto[node][char] = next_node
+                node = next_node
+            self._terminal[node] = bool(pattern)
+        self._fail = self._build_fail_links()
+
+    def _build_fail_links(self):
+        fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                state = fail[node]
+                while state and char not in self._goto[state]:
+                    state = fail[state]
+                fallback = self._goto[state].get(char, 0)
+                fail[child] = fallback if fallback != child else 0
+                # a node also matches every pattern ending at its fallback state
+                self._terminal[child] = self._terminal[child] or self._terminal[fail[child]]
+        return fail
+
+    def __bool__(self):
+        return bool(self.patterns)
+
+    def search(self, text):
+        """Return True if text contains any of the patterns."""
+        if self._match_all:
+            return True
+        goto, fail, terminal = self._goto, self._fail, self._terminal
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if terminal[node]:
+                return True
+        return False
@@ -0,0 +1,39 @@
+import argparse
+import logging
+
+from plan import merge_plans
+from report import merge_reports, missing_shards, read_report, save_report
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+logger = logging.getLogger('logger')
+
+
+def parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        description='Merge the plans and reports written by the shards of a --shard run into one.')
+    parser.add_argument('--plans', nargs='*', default=[], help='Plan files written with --plan-out')
+    parser.add_argument('--plan-out', default=None, help='File the merged plan is written to')
+    parser.add_argument('--reports', nargs='*', default=[], help='Report files written with --report-out')
+    parser.add_argument('--report-out', default=None, help='File the merged report is written to')
+    args = parser.parse_args()
+    if args.plans and not args.plan_out:
+        parser.error('--plans requires --plan-out')
+    if args.reports and not args.report_out:
+        parser.error('--reports requires --report-out')
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.plans:
+        merge_plans(args.plans, args.plan_out)
+    if args.reports:
+        report = merge_reports(read_report(path) for path in args.reports)
+        missing = missing_shards(report)
+        if missing:
+            logger.warning(f"The reports of shards {', '.join(missing)} are missing")
+        save_report(args.report_out, report)
+        for project in report["projects"]:
+            logger.info(f"Project {project['project']} of {project['harbor_url']}: {project['planned']} delete "
+                        f"requests planned, {project['deleted']} sent, {len(project['failed'])} failed")
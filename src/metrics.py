@@ -0,0 +1,233 @@
+import bisect
+import cProfile
+import json
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from urllib.parse import urlparse
+
+logger = logging.getLogger('logger')
+
+# upper bounds in seconds of the buckets of the HTTP latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# phases evaluating rules, those of --streaming and --pipeline fetching artifacts meanwhile
+EVALUATION_PHASES = ('rule_evaluation', 'streaming_evaluation', 'pipeline')
+# the names of projects, repositories, digests and tags are replaced in the endpoints, so that their number
+# does not grow with the registry
+_ENDPOINT_PATTERNS = [
+    (re.compile(r'^(/api/v2\.0/projects/)[^/]+'), r'\1{project}'),
+    (re.compile(r'(/repositories/)[^/]+'), r'\1{repository}'),
+    (re.compile(r'(/artifacts/)[^/]+'), r'\1{reference}'),
+    (re.compile(r'(/tags/)[^/]+'), r'\1{tag}'),
+]
+
+
+def endpoint_of(url):
+    """The path of a Harbor API URL with its project, repository, reference and tag as placeholders."""
+    path = urlparse(url).path
+    for pattern, replacement in _ENDPOINT_PATTERNS:
+        path = pattern.sub(replacement, path)
+    return path
+
+
+class EndpointStats:
+    """Requests, response bytes and latency histogram of one method and endpoint."""
+
+    def __init__(self):
+        self.statuses = Counter()
+        self.bytes = 0
+        self.seconds = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    @property
+    def requests(self):
+        return sum(self.statuses.values())
+
+    def observe(self, status, seconds, size):
+        self.statuses[status] += 1
+        self.bytes += size
+        self.seconds += seconds
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def to_dict(self):
+        cumulative = 0
+        histogram = {}
+        for bound, count in zip([*LATENCY_BUCKETS, '+Inf'], self.buckets):
+            cumulative += count
+            histogram[str(bound)] = cumulative
+        statuses = {str(status): count for status, count in self.statuses.items()}
+        return {"requests": self.requests, "statuses": statuses, "bytes": self.bytes,
+                "seconds": round(self.seconds, 6), "latency_buckets": histogram}
+
+
+class Metrics:
+    """
+    Measurements of a run, shared by the threads of every project: seconds spent in each phase, HTTP requests
+    per endpoint and counters such as the number of tags evaluated. The seconds of a phase run by concurrent
+    projects add up, so they can exceed the duration of the run.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.phases = Counter()
+        self.counters = Counter()
+        self.endpoints = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - started)
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            self.phases[name] += seconds
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def observe_request(self, method, url, status, seconds, size=0):
+        """Record a request, `status` being None for a transport error."""
+        key = (method, endpoint_of(url))
+        with self._lock:
+            stats = self.endpoints.get(key)
+            if stats is None:
+                stats = self.endpoints[key] = EndpointStats()
+            stats.observe(status if status is not None else 'error', seconds, size)
+
+    @property
+    def tags_per_second(self):
+        """Tags evaluated per second of rule evaluation."""
+        seconds = sum(self.phases.get(name, 0) for name in EVALUATION_PHASES)
+        return round(self.counters['tags_evaluated'] / seconds) if seconds else None
+
+    def to_dict(self):
+        with self._lock:
+            return {"started": self.started, "seconds": round(time.time() - self.started, 3),
+                    "phases": {name: round(seconds, 6) for name, seconds in self.phases.items()},
+                    "counters": dict(self.counters), "tags_per_second": self.tags_per_second,
+                    "http": [dict(method=method, endpoint=endpoint, **stats.to_dict())
+                             for (method, endpoint), stats in sorted(self.endpoints.items())]}
+
+    def to_prometheus(self):
+        """The metrics in the Prometheus text exposition format, for the node exporter textfile collector."""
+        data = self.to_dict()
+        lines = ['# HELP harbor_cleanup_run_seconds Duration of the run.',
+                 '# TYPE harbor_cleanup_run_seconds gauge',
+                 f'harbor_cleanup_run_seconds {data["seconds"]}',
+                 '# HELP harbor_cleanup_last_run_timestamp_seconds Start time of the run.',
+                 '# TYPE harbor_cleanup_last_run_timestamp_seconds gauge',
+                 f'harbor_cleanup_last_run_timestamp_seconds {data["started"]}',
+                 '# HELP harbor_cleanup_phase_seconds Seconds spent in each phase, summed over the projects.',
+                 '# TYPE harbor_cleanup_phase_seconds gauge']
+        lines += [f'harbor_cleanup_phase_seconds{{phase="{name}"}} {seconds}'
+                  for name, seconds in data["phases"].items()]
+        for name, value in data["counters"].items():
+            lines += [f'# TYPE harbor_cleanup_{name}_total counter', f'harbor_cleanup_{name}_total {value}']
+        if data["tags_per_second"] is not None:
+            lines += ['# HELP harbor_cleanup_tags_per_second Tags evaluated per second of rule evaluation.',
+                      '# TYPE harbor_cleanup_tags_per_second gauge',
+                      f'harbor_cleanup_tags_per_second {data["tags_per_second"]}']
+
+        requests, sizes, latencies = [], [], []
+        for endpoint in data["http"]:
+            labels = f'method="{endpoint["method"]}",endpoint="{endpoint["endpoint"]}"'
+            requests += [f'harbor_cleanup_http_requests_total{{{labels},status="{status}"}} {count}'
+                         for status, count in endpoint["statuses"].items()]
+            sizes.append(f'harbor_cleanup_http_response_bytes_total{{{labels}}} {endpoint["bytes"]}')
+            latencies += [f'harbor_cleanup_http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}'
+                          for bound, count in endpoint["latency_buckets"].items()]
+            latencies += [f'harbor_cleanup_http_request_duration_seconds_sum{{{labels}}} {endpoint["seconds"]}',
+                          f'harbor_cleanup_http_request_duration_seconds_count{{{labels}}} {endpoint["requests"]}']
+        if requests:
+            lines += ['# HELP harbor_cleanup_http_requests_total Harbor API requests by endpoint and status.',
+                      '# TYPE harbor_cleanup_http_requests_total counter', *requests,
+                      '# HELP harbor_cleanup_http_response_bytes_total Bytes of the Harbor API responses.',
+                      '# TYPE harbor_cleanup_http_response_bytes_total counter', *sizes,
+                      '# HELP harbor_cleanup_http_request_duration_seconds Latency of the Harbor API requests.',
+                      '# TYPE harbor_cleanup_http_request_duration_seconds histogram', *latencies]
+        return '\n'.join(lines) + '\n'
+
+    def log_summary(self):
+        phases = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in self.phases.items())
+        requests = sum(stats.requests for stats in self.endpoints.values())
+        logger.info(f"Phases: {phases or 'none'}; {requests} HTTP requests; "
+                    f"{self.counters['tags_evaluated']} tags evaluated ({self.tags_per_second or '-'} tags/s)")
+
+
+def timed(metrics, name):
+    """Time a block as the phase `name` of the Metrics `metrics`, if any."""
+    return metrics.phase(name) if metrics is not None else nullcontext()
+
+
+def save_metrics(path, metrics):
+    with open(path, 'w') as f:
+        json.dump(metrics.to_dict(), f, indent=2)
+    logger.info(f"Wrote the metrics of the run to {path}")
+
+
+def write_prometheus_textfile(path, metrics):
+    """Write the metrics to a .prom file, through a rename so that the collector never reads half a file."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(metrics.to_prometheus())
+    os.replace(tmp_path, path)
+    logger.info(f"Wrote the Prometheus metrics of the run to {path}")
+
+
+@contextmanager
+def profiled(prefix):
+    """
+    Profile the block with cProfile, in every thread started meanwhile too, and trace its allocations with
+    tracemalloc. Write the pstats dump to <prefix>.prof and the tracemalloc snapshot to <prefix>.tracemalloc.
+    From Python 3.12, cProfile is built on sys.monitoring and one profile covers every thread: a second one
+    cannot be enabled, so no profile is started per thread.
+    """
+    profiles = [cProfile.Profile()]
+    lock = threading.Lock()
+    per_thread = sys.version_info < (3, 12)
+
+    def profile_thread(*_):
+        # called once by each new thread, the profile replaces this hook in the thread
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is active, the thread must not die of its bootstrap
+            return
+        with lock:
+            profiles.append(profile)
+
+    tracemalloc.start()
+    if per_thread:
+        threading.setprofile(profile_thread)
+    profiles[0].enable()
+    try:
+        yield
+    finally:
+        profiles[0].disable()
+        if per_thread:
+            threading.setprofile(None)
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(f"{prefix}.prof")
+        snapshot.dump(f"{prefix}.tracemalloc")
+        logger.info(f"Wrote the profile to {prefix}.prof and the allocations to {prefix}.tracemalloc, "
+                    f"peak traced memory {peak / 2 ** 20:.1f} MiB")
@@ -0,0 +1,121 @@
+import logging
+import queue
+import threading
+
+from deleter import DeletionReport
+
+logger = logging.getLogger('logger')
+
+_DONE = object()
+
+
+class _Stage:
+    """Runs a stage in threads; after a failure the stage keeps draining its input so no other stage blocks."""
+
+    def __init__(self, errors):
+        self._errors = errors
+        self.failed = threading.Event()
+
+    def run(self, func, *args):
+        if self.failed.is_set():
+            return None
+        try:
+            return func(*args)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.error(f"Pipeline stage failed: {e}")
+            self._errors.append(e)
+            self.failed.set()
+            return None
+
+
+def run_pipeline(repositories, get_images, evaluate, delete, policy_count, fetch_workers=1, delete_workers=1,
+                 queue_size=100):
+    """
+    Run repository discovery -> artifact fetch -> rule evaluation -> deletion as stages connected by bounded
+    queues, so deleting the images of the first repositories overlaps with fetching the next ones and a slow
+    stage throttles the ones before it.
+
+    repositories: iterable of (short name, repository) pairs
+    get_images(short name) -> tag records
+    evaluate(repository, records) -> (one list of tags to delete per policy, DeleteActions of the repository)
+    delete(action) -> None on success or the error
+
+    Repositories are evaluated in discovery order whatever order the fetches complete in. At most `queue_size`
+    repositories are fetched and not evaluated yet, so a slow repository holds back the fetches after it instead of
+    letting the whole project pile up in memory. Return the images to delete per policy and the DeletionReport.
+    """
+    repositories_queue = queue.Queue(queue_size)
+    images_queue = queue.Queue(queue_size)
+    deletions_queue = queue.Queue(queue_size)
+    errors = []
+    stage = _Stage(errors)
+    images_to_delete = [[] for _ in range(policy_count)]
+    report = DeletionReport()
+    # taken in discovery order, so the slot of the next repository to evaluate is always held
+    in_flight = threading.Semaphore(max(queue_size, 1))
+
+    def discover():
+        def put_all():
+            for index, item in enumerate(repositories):
+                in_flight.acquire()
+                repositories_queue.put((index, item))
+        stage.run(put_all)
+        for _ in range(fetch_workers):
+            repositories_queue.put(_DONE)
+
+    def fetch():
+        while True:
+            item = repositories_queue.get()
+            if item is _DONE:
+                images_queue.put(_DONE)
+                return
+            index, (name, repository) = item
+            images_queue.put((index, repository, stage.run(get_images, name)))
+
+    def schedule(repository, records):
+        tags_per_policy, actions = evaluate(repository, records)
+        for policy_index, tags in enumerate(tags_per_policy):
+            images_to_delete[policy_index] += [f"{repository['name']}:{tag}" for tag in tags]
+        for action in actions:
+            deletions_queue.put(action)
+
+    def evaluate_in_order():
+        pending = {}
+        next_index = 0
+        done = 0
+        while done < fetch_workers:
+            item = images_queue.get()
+            if item is _DONE:
+                done += 1
+                continue
+            index, repository, records = item
+            pending[index] = (repository, records)
+            while next_index in pending:
+                repository, records = pending.pop(next_index)
+                next_index += 1
+                stage.run(schedule, repository, records)
+                in_flight.release()
+        for _ in range(delete_workers):
+            deletions_queue.put(_DONE)
+
+    def delete_all():
+        while True:
+            action = deletions_queue.get()
+            if action is _DONE:
+                return
+            error = stage.run(delete, action)
+            if not stage.failed.is_set():
+                report.add(action, error)
+
+    threads = [threading.Thread(target=discover)]
+    threads += [threading.Thread(target=fetch) for _ in range(fetch_workers)]
+    threads += [threading.Thread(target=evaluate_in_order)]
+    threads += [threading.Thread(target=delete_all) for _ in range(delete_workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+    return images_to_delete, report
@@ -0,0 +1,126 @@
+import json
+import logging
+import os
+import threading
+
+from deleter import DeleteAction
+
+logger = logging.getLogger('logger')
+
+
+def action_to_dict(action):
+    data = {"repository": action.repository, "digest": action.digest, "tags": list(action.tags),
+            "artifact": action.artifact}
+    if action.harbor_url:
+        data["harbor_url"] = action.harbor_url
+    if action.size:
+        data["size"] = action.size
+    return data
+
+
+def action_from_dict(data):
+    return DeleteAction(data["repository"], data["digest"], tuple(data["tags"]), data["artifact"],
+                        data.get("harbor_url"), data.get("size", 0))
+
+
+class PlanWriter:
+    """
+    JSON Lines plan file, one DeleteAction per line, written as the deletions are computed, from several threads.
+    The actions of a registry other than `harbor_url`, the --harbor-url of the run, are tagged with its URL.
+    """
+
+    def __init__(self, path, harbor_url=None):
+        self._path = path
+        self._harbor_url = harbor_url
+        self._file = open(path, 'w')
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, actions, harbor_url=None):
+        """Append the actions, those of the registry `harbor_url` if given."""
+        if harbor_url is not None and harbor_url != self._harbor_url:
+            actions = [action._replace(harbor_url=harbor_url) for action in actions]
+        lines = [json.dumps(action_to_dict(action), separators=(',', ':')) + '\n' for action in actions]
+        with self._lock:
+            self._file.writelines(lines)
+            self.count += len(lines)
+
+    def close(self):
+        self._file.close()
+        logger.info(f"Wrote a plan of {self.count} deletions to {self._path}")
+
+
+def write_plan(path, actions):
+    """Write the DeleteActions to a JSON Lines file, one action per line, return their number."""
+    with PlanWriter(path) as writer:
+        writer.write(actions)
+    return writer.count
+
+
+def read_plan(path):
+    """Read the DeleteActions of a plan written by write_plan."""
+    with open(path) as f:
+        return [action_from_dict(json.loads(line)) for line in f if line.strip()]
+
+
+def merge_plans(paths, out_path):
+    """Concatenate plans, e.g. of the shards of a run, into one; a deletion found in several plans is kept once."""
+    delete_actions = []
+    seen = set()
+    for path in paths:
+        for action in read_plan(path):
+            if action in seen:
+                logger.warning(f"Deletion {action} of {path} is already in another plan")
+                continue
+            seen.add(action)
+            delete_actions.append(action)
+    return write_plan(out_path, delete_actions)
+
+
+class PlanJournal:
+    """
+    Append-only record of the deletions of a plan that completed. Every line is flushed to disk as it is
+    written, so a run killed at any point loses at most the line being written; a truncated last line is
+    ignored when the journal is loaded again.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self.done = set()
+        line = '\n'
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        self.done.add(action_from_dict(json.loads(line)))
+                    except (ValueError, KeyError, TypeError):
+                        logger.warning(f"Ignoring an incomplete line of the journal {path}")
+        self._file = open(path, 'a')
+        if not line.endswith('\n'):
+            # terminate a truncated last line so that it does not swallow the next record
+            self._file.write('\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def pending(self, actions):
+        """Return the actions not recorded as done yet."""
+        return [action for action in actions if action not in self.done]
+
+    def record(self, action):
+        self.done.add(action)
+        self._file.write(json.dumps(action_to_dict(action), separators=(',', ':')) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,110 @@
+import heapq
+import re
+import time
+from dataclasses import dataclass
+
+from matcher import SubstringMatcher
+
+DELETE_RULE_TYPES = ('DeleteByTimeInName', 'DeleteByTagName', 'DeleteByCreateTime')
+
+
+@dataclass(frozen=True)
+class CompiledRule:
+    name: str
+    type: str
+    pattern: re.Pattern
+    limit: int = 0
+    days: int = 0
+
+
+@dataclass(frozen=True)
+class CompiledPolicy:
+    """Immutable evaluation plan of a validated policy, built once per run."""
+    name: str
+    delete_rules: tuple
+    ignore_repos: SubstringMatcher
+    ignore_tags: SubstringMatcher
+
+
+def get_rule_name(rule):
+    if 'name' in rule:
+        return rule['name']
+    if rule['type'] in DELETE_RULE_TYPES:
+        return rule['type'] + '-' + rule['regexp']
+    return rule['type']
+
+
+def compile_policy(policy):
+    """Compile a validated policy: precompile the rule patterns and group the ignore lists."""
+    delete_rules = []
+    ignore_repos = []
+    ignore_tags = []
+    for rule in policy['rules']:
+        if rule['type'] in DELETE_RULE_TYPES:
+            delete_rules.append(CompiledRule(name=get_rule_name(rule), type=rule['type'],
+                                             pattern=re.compile(rule['regexp']),
+                                             limit=rule.get('limit', 0), days=rule.get('days', 0)))
+        elif rule['type'] == 'IgnoreRepos':
+            ignore_repos += rule['repos']
+        elif rule['type'] == 'IgnoreTags':
+            ignore_tags += rule['tags']
+    return CompiledPolicy(name=policy['name'], delete_rules=tuple(delete_rules),
+                          ignore_repos=SubstringMatcher(ignore_repos), ignore_tags=SubstringMatcher(ignore_tags))
+
+
+def classify_images(plan, records):
+    """Return, for each delete rule of the plan, the tag records matching the rule, in a single pass."""
+    matchers = [rule.pattern.match for rule in plan.delete_rules]
+    matched = [[] for _ in matchers]
+    for record in records:
+        tag = record.tag
+        for i, match in enumerate(matchers):
+            if match(tag):
+                matched[i].append(record)
+    return matched
+
+
+class StreamingEvaluator:
+    """
+    Evaluate the delete rules of a compiled policy on tag records as they stream in.
+    Limit rules keep a heap of their `limit` newest matches: a record pushed out of the heap can never
+    become one of the newest again, so it is emitted as a deletion candidate right away. The evaluator itself
+    holds O(limit) records per rule instead of O(tags), with the same result as sorting all matches; the
+    candidates it emits are kept by the caller.
+    """
+
+    SORT_KEYS = {'DeleteByTimeInName': lambda record: record.name_date,
+                 'DeleteByTagName': lambda record: record.tag}
+
+    def __init__(self, plan, now=None):
+        self._rules = plan.delete_rules
+        now = int(time.time()) if now is None else now
+        self._cutoffs = [now - rule.days * 86400 for rule in self._rules]
+        self._heaps = [[] for _ in self._rules]
+        self._seq = 0
+
+    def feed(self, record):
+        """Return the (record, rule) deletion candidates decided by this record."""
+        candidates = []
+        self._seq += 1
+        for rule, heap, cutoff in zip(self._rules, self._heaps, self._cutoffs):
+            if not rule.pattern.match(record.tag):
+                continue
+            if rule.type == 'DeleteByCreateTime':
+                if 0 < record.pushed_at < cutoff:
+                    candidates.append((record, rule))
+            elif rule.limit:
+                # on equal keys the record seen last is evicted first, as with a stable reverse sort
+                heapq.heappush(heap, (self.SORT_KEYS[rule.type](record), -self._seq, record))
+                if len(heap) > rule.limit:
+                    candidates.append((heapq.heappop(heap)[2], rule))
+        return candidates
+
+    def is_limited(self, record):
+        """Whether a limit rule matches the record, which stays undecided until it is evicted or the stream ends."""
+        return any(rule.limit and rule.type in self.SORT_KEYS and rule.pattern.match(record.tag)
+                   for rule in self._rules)
+
+    def retained(self):
+        """Return the (record, rule) pairs still among the `limit` newest matches of their rule, which are kept."""
+        return [(entry[2], rule) for rule, heap in zip(self._rules, self._heaps) for entry in heap]
@@ -0,0 +1,61 @@
+import argparse
+import logging
+import re
+
+logger = logging.getLogger('logger')
+
+SIZE_UNITS = {'': 1, 'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30, 'T': 2 ** 40, 'P': 2 ** 50}
+size_regexp = re.compile(r'(\d+(?:\.\d+)?)\s*([KMGTP]?)(?:I?B)?', re.IGNORECASE)
+
+
+def parse_size(value):
+    """Parse a size such as 500G, 1.5TiB or 1048576 into bytes, as an argparse type. Units are powers of 1024."""
+    match = size_regexp.fullmatch(value.strip())
+    if match is None:
+        raise argparse.ArgumentTypeError(f"invalid size '{value}', expected e.g. 500G")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def parse_percentage(value):
+    """Parse 'P%' or 'P', 0 <= P < 100, as an argparse type."""
+    try:
+        percentage = float(value.strip().rstrip('%'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid percentage '{value}', expected e.g. 80%")
+    if not 0 <= percentage < 100:
+        raise argparse.ArgumentTypeError(f"invalid percentage '{value}', expected 0 <= P < 100")
+    return percentage
+
+
+def format_size(size):
+    for unit in ('P', 'T', 'G', 'M', 'K'):
+        if size >= SIZE_UNITS[unit]:
+            return f"{size / SIZE_UNITS[unit]:.1f}{unit}iB"
+    return f"{size}B"
+
+
+def bytes_over_quota(used, hard, target_percentage):
+    """Bytes to delete to bring the storage `used` of a project down to `target_percentage` of its quota `hard`."""
+    if hard is None or hard < 0:
+        raise ValueError("--target-quota needs a project with a storage quota")
+    return max(0, used - int(hard * target_percentage / 100))
+
+
+def select_largest(delete_actions, target_bytes):
+    """
+    Return the fewest DeleteActions reclaiming `target_bytes`, largest first, and the bytes they reclaim.
+    Only artifact deletions reclaim space. The copies of a digest in several repositories share their layers:
+    they are selected together and counted once. The selection stops as soon as the target is met.
+    """
+    artifacts = {}
+    for action in delete_actions:
+        if action.size:
+            artifacts.setdefault(action.digest or action, []).append(action)
+    selected = []
+    reclaimed = 0
+    for actions in sorted(artifacts.values(), key=lambda actions: actions[0].size, reverse=True):
+        if reclaimed >= target_bytes:
+            break
+        selected += actions
+        reclaimed += actions[0].size
+    return selected, reclaimed
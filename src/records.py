@@ -0,0 +1,58 @@
+import sys
+from calendar import timegm
+from datetime import datetime
+
+from utils import extract_date, parse_push_time
+
+# name_date of tags without a time in their name, sorts before any real date
+NO_DATE = -2 ** 62
+
+
+def to_epoch(value):
+    """Return a naive UTC datetime as integer epoch seconds, 0 when unknown."""
+    return timegm(value.timetuple()) if value is not None else 0
+
+
+def format_epoch(epoch):
+    return datetime.utcfromtimestamp(epoch).strftime('%Y-%m-%dT%H:%M:%SZ') if epoch else None
+
+
+class TagRecord:
+    """
+    A tag of a repository with the values used by the rules parsed once, at ingestion.
+    Timestamps are integer epoch seconds and the repository name is interned, so a record only
+    costs the slots themselves plus its tag string.
+    """
+    __slots__ = ('name', 'tag', 'pushed_at', 'pulled_at', 'digest', 'size', 'name_date')
+
+    def __init__(self, name, tag, pushed_at, pulled_at, digest=None, size=0):
+        self.name = sys.intern(name)
+        self.tag = tag
+        self.pushed_at = pushed_at
+        self.pulled_at = pulled_at
+        # shared by the records of all tags of the same artifact
+        self.digest = digest
+        # bytes of the artifact, 0 when unknown
+        self.size = size
+        name_date = extract_date(tag)
+        self.name_date = to_epoch(name_date) if name_date is not None else NO_DATE
+
+    @classmethod
+    def from_harbor(cls, name, tag, digest=None, size=0):
+        """Build a record from a tag of a Harbor artifact listing."""
+        return cls(name, tag['name'], to_epoch(parse_push_time(tag.get('push_time'))),
+                   to_epoch(parse_push_time(tag.get('pull_time'))), digest, size)
+
+    @classmethod
+    def from_row(cls, name, row):
+        return cls(name, *row)
+
+    def to_row(self):
+        return [self.tag, self.pushed_at, self.pulled_at, self.digest, self.size]
+
+    def to_dict(self):
+        return {"name": self.name, "tag": self.tag, "digest": self.digest, "push_time": format_epoch(self.pushed_at),
+                "pull_time": format_epoch(self.pulled_at), "size": self.size}
+
+    def __repr__(self):
+        return str(self.to_dict())
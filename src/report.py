@@ -0,0 +1,60 @@
+import json
+import logging
+
+from plan import action_to_dict
+
+logger = logging.getLogger('logger')
+
+
+def project_report(result):
+    """Summary of the RunResult of a project, as stored in a report file."""
+    return {"harbor_url": result.target.harbor_url, "project": result.target.project_name,
+            "planned": result.planned, "deleted": result.report.deleted_count,
+            "failed": [{"action": action_to_dict(action), "error": str(error)}
+                       for action, error in result.report.failed]}
+
+
+def build_report(results, shard=None):
+    """Report of a run: the Shard it processed, if any, and the summary of every project."""
+    return {"shards": [str(shard)] if shard else [], "projects": [project_report(result) for result in results]}
+
+
+def save_report(path, report):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Wrote the report of {len(report['projects'])} projects to {path}")
+
+
+def merge_reports(reports):
+    """
+    Combine reports, e.g. of the shards of a run, into one: the counts of a project present in several
+    reports are added up and their failures concatenated.
+    """
+    merged = {"shards": [], "projects": []}
+    projects = {}
+    for report in reports:
+        merged["shards"] += report["shards"]
+        for project in report["projects"]:
+            key = (project["harbor_url"], project["project"])
+            if key not in projects:
+                projects[key] = {"harbor_url": project["harbor_url"], "project": project["project"],
+                                 "planned": 0, "deleted": 0, "failed": []}
+                merged["projects"].append(projects[key])
+            projects[key]["planned"] += project["planned"]
+            projects[key]["deleted"] += project["deleted"]
+            projects[key]["failed"] += project["failed"]
+    return merged
+
+
+def missing_shards(report):
+    """Return the shards i/N of the report's shard count N that none of the merged reports covered."""
+    shards = {tuple(int(part) for part in shard.split('/')) for shard in report["shards"]}
+    missing = []
+    for count in sorted({count for _, count in shards}):
+        missing += [f"{index}/{count}" for index in range(count) if (index, count) not in shards]
+    return missing
+
+
+def read_report(path):
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,29 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def ordered_map(func, items, workers=1):
+    """
+    Yield (item, func(item)) pairs in the order of items, running up to `workers` calls at once.
+    At most 2 * workers results are buffered, so slow consumers throttle the workers.
+    """
+    if workers <= 1:
+        for item in items:
+            yield item, func(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append((item, executor.submit(func, item)))
+            if len(pending) >= workers * 2:
+                item_, future = pending.popleft()
+                yield item_, future.result()
+        while pending:
+            item_, future = pending.popleft()
+            yield item_, future.result()
+
+
+def scan_repositories(get_images, repository_names, workers=1):
+    """Fetch images of the given repositories concurrently, yielding (repository_name, images) in order."""
+    return ordered_map(get_images, repository_names, workers)
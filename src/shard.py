@@ -0,0 +1,31 @@
+import argparse
+import hashlib
+from typing import NamedTuple
+
+
+def stable_hash(name):
+    """Hash of a repository name that, unlike hash(), is the same in every process and on every host."""
+    return int.from_bytes(hashlib.sha256(name.encode()).digest()[:8], 'big')
+
+
+class Shard(NamedTuple):
+    """Shard `index` of `count`: the repositories whose stable hash modulo `count` is `index`."""
+    index: int
+    count: int
+
+    def __str__(self):
+        return f"{self.index}/{self.count}"
+
+    def contains(self, repository_name):
+        return stable_hash(repository_name) % self.count == self.index
+
+
+def parse_shard(value):
+    """Parse 'i/N', 0 <= i < N, as an argparse type."""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid shard '{value}', expected i/N")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"invalid shard '{value}', expected 0 <= i < N")
+    return Shard(index, count)
@@ -0,0 +1,167 @@
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+from config import load_cleanup_policy
+from inventory_cache import InventoryCache
+from kustomization import DEFAULT_PRUNE_DIRS, KustomizationIndex, build_kustomization_index
+from main import combined_list, compile_policies, get_delete_actions, get_tags_to_delete
+from quota import format_size
+
+logger = logging.getLogger('logger')
+
+# number of deployed tags hit listed in the log, the report has all of them
+LOGGED_HITS = 10
+
+
+class SimulationResult(NamedTuple):
+    """What a policy would do to the inventory snapshots: the deletions, and the deployed tags they would hit."""
+    source: str
+    policy: str
+    tags_deleted: int
+    delete_requests: int
+    bytes_reclaimed: int
+    deployed_hits: list
+    seconds: float
+
+
+# snapshot shared by the policies evaluated in a worker process, set once per process by _init_worker
+_snapshot = None
+
+
+def _init_worker(inventories, kustomization_index, domain_name):
+    global _snapshot
+    _snapshot = (inventories, kustomization_index, argparse.Namespace(domain_name=domain_name))
+
+
+def simulate_policy(source, plan):
+    """
+    Evaluate a compiled policy on the snapshot of the process, without protecting deployed tags, so that the tags
+    kustomization files deploy and the policy would delete are reported instead of silently kept.
+    """
+    inventories, kustomization_index, args = _snapshot
+    started = time.perf_counter()
+    no_deployments = KustomizationIndex()
+    tags_deleted = delete_requests = bytes_reclaimed = 0
+    deployed_hits = []
+    # the layers of a digest found in several repositories are reclaimed once
+    digests = set()
+    for inventory in inventories:
+        for repository, records in inventory:
+            tags = get_tags_to_delete(repository, records, no_deployments, args, plan)
+            deployed = kustomization_index.protected_tags(f"{args.domain_name}/{repository['name']}")
+            deployed_hits += [f"{repository['name']}:{tag}" for tag in tags if tag in deployed]
+            tags = [tag for tag in tags if tag not in deployed]
+            actions = get_delete_actions(repository, records, tags)
+            tags_deleted += len(tags)
+            delete_requests += len(actions)
+            for action in actions:
+                if action.size and (action.digest is None or action.digest not in digests):
+                    digests.add(action.digest)
+                    bytes_reclaimed += action.size
+    return SimulationResult(source, plan.name, tags_deleted, delete_requests, bytes_reclaimed, deployed_hits,
+                            time.perf_counter() - started)
+
+
+def simulate(inventories, kustomization_index, domain_name, plans, workers=1):
+    """
+    Evaluate the (source, compiled policy) pairs `plans` on the inventory snapshots, in up to `workers` processes,
+    return their SimulationResults in order. No Harbor API call is made.
+    """
+    sources = [source for source, _ in plans]
+    compiled = [plan for _, plan in plans]
+    if workers > 1 and len(plans) > 1:
+        # the snapshot is sent once to every worker process, not once per policy
+        with ProcessPoolExecutor(max_workers=min(workers, len(plans)), initializer=_init_worker,
+                                 initargs=(inventories, kustomization_index, domain_name)) as executor:
+            return list(executor.map(simulate_policy, sources, compiled))
+    _init_worker(inventories, kustomization_index, domain_name)
+    return [simulate_policy(source, plan) for source, plan in plans]
+
+
+def load_plans(args):
+    """Compile the policies of every file of --policies, as (file, compiled policy) pairs."""
+    plans = []
+    for path in args.policies:
+        if not os.path.exists(path):
+            raise ValueError(f"Policy file {path} not found")
+        plans += [(path, plan) for plan in compile_policies(args, load_cleanup_policy(path))]
+    return plans
+
+
+def log_results(results):
+    logger.info("#" * 10 + " Simulation " + "#" * 10)
+    for result in results:
+        logger.info(f"{result.source} - '{result.policy}': {result.tags_deleted} tags deleted in "
+                    f"{result.delete_requests} requests, {format_size(result.bytes_reclaimed)} reclaimed, "
+                    f"{len(result.deployed_hits)} deployed tags hit ({result.seconds:.2f}s)")
+        if result.deployed_hits:
+            more = len(result.deployed_hits) - LOGGED_HITS
+            logger.warning(f"{result.source} - '{result.policy}' deletes deployed tags: "
+                           f"{', '.join(result.deployed_hits[:LOGGED_HITS])}"
+                           + (f" and {more} more" if more > 0 else ""))
+
+
+def save_results(path, results):
+    with open(path, 'w') as f:
+        json.dump([result._asdict() for result in results], f, indent=2)
+    logger.info(f"Wrote the simulation of {len(results)} policies to {path}")
+
+
+def parse_args(argv=None):
+    """Parse command-line arguments, those of the process unless `argv` is given."""
+    parser = argparse.ArgumentParser(
+        description='Evaluate cleanup policy variants on the inventory cached by a --cache-file run, offline.')
+    parser.add_argument('--cache-file', required=True, help='SQLite inventory cache written by a --cache-file run')
+    parser.add_argument('--project-name', type=combined_list, nargs='*', default=[],
+                        help='Projects of the cache to evaluate (default: all of them)')
+    parser.add_argument('--policies', nargs='+', required=True,
+                        help='Policy files, in the format of harbor_cleanup_policy.yaml; every policy of every '
+                             'file is evaluated')
+    parser.add_argument('--domain-name', required=True, help='Domain name to match against image names')
+    parser.add_argument('--ignore-tags', type=combined_list, nargs='*', default=[],
+                        help='List of image tags to exclude from deletion, added to every policy')
+    parser.add_argument('--ignore-repos', type=combined_list, nargs='*', default=[],
+                        help='List of image repos to exclude from deletion, added to every policy')
+    parser.add_argument('--kustomization-root', default='.',
+                        help='Directory scanned for kustomization files whose deployed tags are reported')
+    parser.add_argument('--kustomization-prune', type=combined_list, nargs='*', default=[DEFAULT_PRUNE_DIRS],
+                        help='Directory names skipped while scanning for kustomization files')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='Number of processes evaluating policies (default: one per CPU)')
+    parser.add_argument('--report-out', default=None, help='Write the results of every policy to this JSON file')
+    args = parser.parse_args(argv)
+    args.project_name = [project for sublist in args.project_name for project in sublist]
+    args.ignore_tags = [tag for sublist in args.ignore_tags for tag in sublist]
+    args.ignore_repos = [repo for sublist in args.ignore_repos for repo in sublist]
+    args.kustomization_prune = [directory for sublist in args.kustomization_prune for directory in sublist]
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    started = time.perf_counter()
+    try:
+        plans = load_plans(args)
+    except ValueError as e:
+        logger.error(str(e))
+        exit(1)
+    with InventoryCache(args.cache_file) as cache:
+        inventories = cache.load(args.project_name)
+    if not inventories:
+        logger.error(f"No inventory of {', '.join(args.project_name) or 'any project'} in {args.cache_file}")
+        exit(1)
+    for inventory in inventories:
+        logger.info(f"Inventory of project {inventory.project_name}: {len(inventory)} repositories, "
+                    f"{sum(len(images) for _, images in inventory)} images")
+    kustomization_index = build_kustomization_index(args.domain_name, args.kustomization_root,
+                                                    args.kustomization_prune)
+    results = simulate(inventories, kustomization_index, args.domain_name, plans, args.workers)
+    log_results(results)
+    if args.report_out:
+        save_results(args.report_out, results)
+    logger.info(f"Simulated {len(plans)} policies in {time.perf_counter() - started:.1f}s")
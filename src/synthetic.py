@@ -0,0 +1,116 @@
+import os
+import random
+import time
+from datetime import datetime
+
+from inventory import Inventory
+from records import TagRecord
+
+
+def format_harbor_time(epoch):
+    return datetime.utcfromtimestamp(epoch).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+def artifact_size(digest):
+    """Size of an artifact, between 10 MiB and 1 GiB, derived from its digest to leave the random sequence as is."""
+    return 10 * 2 ** 20 + int(digest[7:15], 16) % (2 ** 30 - 10 * 2 ** 20)
+
+
+class SyntheticRegistry:
+    """
+    Deterministic, generated Harbor project of `tag_count` tags spread over `repository_count` repositories,
+    for benchmarks and tests. Artifacts mix date-stamped CI builds (master_20240105123000), dev branch builds
+    (dev_1f3a9c2) and semver releases (v1.4.2); a fraction `shared_digest_ratio` of them carry a second tag,
+    so that several tags share a digest. The same arguments always give the same registry.
+    """
+    CI_RATIO = 0.5
+    DEV_RATIO = 0.3
+
+    def __init__(self, project_name='project', tag_count=1000, repository_count=None, seed=0, now=None,
+                 shared_digest_ratio=0.1, days=365):
+        self.project_name = project_name
+        self.tag_count = tag_count
+        self.repository_count = repository_count or max(1, tag_count // 1000)
+        self.seed = seed
+        self.now = int(now if now is not None else time.time())
+        self.shared_digest_ratio = shared_digest_ratio
+        self.days = days
+        per_repository, remainder = divmod(tag_count, self.repository_count)
+        self._tag_counts = [per_repository + (index < remainder) for index in range(self.repository_count)]
+
+    def repository_names(self):
+        """Short names of the repositories, without the project."""
+        return [f"app-{index}" for index in range(self.repository_count)]
+
+    def repository(self, repository_name, artifacts=None):
+        """A repository as listed by the Harbor API."""
+        artifacts = artifacts if artifacts is not None else self.artifacts(repository_name)
+        return {"name": f"{self.project_name}/{repository_name}", "artifact_count": len(artifacts),
+                "update_time": format_harbor_time(self.now)}
+
+    def repositories(self):
+        return [self.repository(name) for name in self.repository_names()]
+
+    def artifacts(self, repository_name):
+        """The artifacts of a repository as listed by the Harbor API, newest first."""
+        index = int(repository_name.rsplit('-', 1)[1])
+        rng = random.Random(f"{self.seed}:{index}")
+        artifacts = []
+        remaining = self._tag_counts[index]
+        while remaining > 0:
+            number = len(artifacts)
+            pushed_at = self.now - rng.randint(0, self.days * 86400)
+            shape = rng.random()
+            if shape < SyntheticRegistry.CI_RATIO:
+                name = f"master_{datetime.utcfromtimestamp(pushed_at).strftime('%Y%m%d%H%M%S')}_{number}"
+            elif shape < SyntheticRegistry.CI_RATIO + SyntheticRegistry.DEV_RATIO:
+                name = f"dev_{rng.getrandbits(28):07x}{number}"
+            else:
+                name = f"v{number // 100}.{number // 10 % 10}.{number % 10}"
+            names = [name]
+            if remaining > 1 and rng.random() < self.shared_digest_ratio:
+                names.append(f"build-{number}")
+            push_time = format_harbor_time(pushed_at)
+            pull_time = format_harbor_time(rng.randint(pushed_at, self.now)) if rng.random() < 0.5 else None
+            digest = f"sha256:{rng.getrandbits(256):064x}"
+            artifacts.append({"digest": digest, "size": artifact_size(digest), "push_time": push_time,
+                              "tags": [{"name": tag, "push_time": push_time, "pull_time": pull_time}
+                                       for tag in names]})
+            remaining -= len(names)
+        artifacts.sort(key=lambda artifact: artifact["push_time"], reverse=True)
+        return artifacts
+
+    def records(self, repository_name, artifacts=None):
+        """The TagRecords of a repository, as HarborClient builds them."""
+        artifacts = artifacts if artifacts is not None else self.artifacts(repository_name)
+        full_name = f"{self.project_name}/{repository_name}"
+        return [TagRecord.from_harbor(full_name, tag, artifact["digest"], artifact["size"])
+                for artifact in artifacts for tag in artifact["tags"]]
+
+    def inventory(self):
+        inventory = Inventory(self.project_name)
+        for name in self.repository_names():
+            artifacts = self.artifacts(name)
+            inventory.add(self.repository(name, artifacts), self.records(name, artifacts))
+        return inventory
+
+    def write_kustomizations(self, root, domain_name, file_count, images_per_file=3):
+        """Write `file_count` kustomization files deploying random tags of the registry, return their paths."""
+        rng = random.Random(f"{self.seed}:kustomization")
+        names = self.repository_names()
+        tags = {}
+        paths = []
+        for number in range(file_count):
+            directory = os.path.join(root, f"overlay-{number % 10}", f"app-{number}")
+            os.makedirs(directory, exist_ok=True)
+            lines = ["images:"]
+            for name in rng.sample(names, min(images_per_file, len(names))):
+                if name not in tags:
+                    tags[name] = [tag["name"] for artifact in self.artifacts(name) for tag in artifact["tags"]]
+                lines += [f"  - name: {domain_name}/{self.project_name}/{name}",
+                          f"    newTag: \"{rng.choice(tags[name])}\""]
+            path = os.path.join(directory, "kustomization.yaml")
+            with open(path, 'w') as f:
+                f.write("\n".join(lines) + "\n")
+            paths.append(path)
+        return paths
@@ -0,0 +1,125 @@
+import json
+import logging
+import random
+import time
+from argparse import Namespace
+
+from audit import AuditLog
+from kustomization import KustomizationIndex
+from main import TRACE, get_log_level, get_tags_to_delete, get_tags_to_delete_streaming, set_log_levels
+from policy import compile_policy
+from records import TagRecord
+
+
+def read_decisions(path):
+    with open(path) as f:
+        return {line["tag"]: (line["decision"], line["reason"], line["rule"]) for line in map(json.loads, f)}
+
+
+def make_records():
+    rng = random.Random(2)
+    now = int(time.time())
+    return [TagRecord('p/app', f"{rng.choice(['dev', 'master', 'feature'])}_{i:03d}{rng.choice(['', '_fix'])}",
+                      now - rng.randint(0, 90) * 86400, 0, f"sha256:{i}") for i in range(200)]
+
+
+def make_plan():
+    return compile_policy({'name': 'p', 'rules': [
+        {'type': 'DeleteByTagName', 'regexp': '^dev_.*', 'limit': 10},
+        {'name': 'old fixes', 'type': 'DeleteByCreateTime', 'regexp': '.*_fix$', 'days': 45},
+        {'type': 'IgnoreTags', 'tags': ['_01']}]})
+
+
+def test_audit_log_decisions(tmp_path):
+    records = make_records()
+    plan = make_plan()
+    args = Namespace(domain_name='registry.example.com')
+    kustomization_index = KustomizationIndex()
+    deployed = next(record.tag for record in records if record.tag.startswith('dev_'))
+    kustomization_index.add('registry.example.com/p/app', deployed)
+
+    with AuditLog(str(tmp_path / 'audit.jsonl')) as audit:
+        tags_to_delete = get_tags_to_delete({'name': 'p/app'}, records, kustomization_index, args, plan, audit)
+        assert audit.count == len(records)
+    decisions = read_decisions(str(tmp_path / 'audit.jsonl'))
+
+    assert len(decisions) == len(records)
+    assert sorted(tag for tag, (decision, _, _) in decisions.items() if decision == 'delete') == tags_to_delete
+    assert decisions[deployed] == ('keep', 'deployed', 'DeleteByTagName-^dev_.*')
+    reasons = {reason for _, reason, _ in decisions.values()}
+    assert reasons == {'matched', 'retained', 'deployed', 'ignored_tag', 'no_rule'}
+    assert all(rule == 'IgnoreTags' for _, reason, rule in decisions.values() if reason == 'ignored_tag')
+
+
+def test_audit_log_ignored_repository(tmp_path):
+    records = make_records()
+    plan = compile_policy({'name': 'p', 'rules': [{'type': 'IgnoreRepos', 'repos': ['app']}]})
+    with AuditLog(str(tmp_path / 'audit.jsonl')) as audit:
+        get_tags_to_delete({'name': 'p/app'}, records, KustomizationIndex(), Namespace(domain_name='r'), plan, audit)
+    assert set(read_decisions(str(tmp_path / 'audit.jsonl')).values()) == {('keep', 'ignored_repository', 'IgnoreRepos')}
+
+
+def test_streaming_audit_matches_full_evaluation(tmp_path):
+    records = make_records()
+    plan = make_plan()
+    args = Namespace(domain_name='registry.example.com')
+    kustomization_index = KustomizationIndex()
+    kustomization_index.add('registry.example.com/p/app', records[0].tag)
+
+    with AuditLog(str(tmp_path / 'full.jsonl')) as audit:
+        get_tags_to_delete({'name': 'p/app'}, records, kustomization_index, args, plan, audit)
+    with AuditLog(str(tmp_path / 'streamed.jsonl')) as audit:
+        get_tags_to_delete_streaming({'name': 'p/app'}, iter(records), kustomization_index, args, [plan], audit)
+        # one line per tag, written as the stream is evaluated
+        assert audit.count == len(records)
+
+    assert read_decisions(str(tmp_path / 'streamed.jsonl')) == read_decisions(str(tmp_path / 'full.jsonl'))
+
+
+def test_streaming_audit_rule_order_and_ignored_repository(tmp_path):
+    records = make_records()
+    # old tags are evicted by the limit rule late in the stream, after the later rule condemned them
+    plan = compile_policy({'name': 'p', 'rules': [
+        {'type': 'DeleteByTagName', 'regexp': '.*', 'limit': 20},
+        {'name': 'old', 'type': 'DeleteByCreateTime', 'regexp': '.*', 'days': 30}]})
+    ignoring = compile_policy({'name': 'ignoring', 'rules': [{'type': 'IgnoreRepos', 'repos': ['app']}]})
+    args = Namespace(domain_name='registry.example.com')
+
+    with AuditLog(str(tmp_path / 'full.jsonl')) as audit:
+        for policy in (plan, ignoring):
+            get_tags_to_delete({'name': 'p/app'}, records, KustomizationIndex(), args, policy, audit)
+    with AuditLog(str(tmp_path / 'streamed.jsonl')) as audit:
+        get_tags_to_delete_streaming({'name': 'p/app'}, iter(records), KustomizationIndex(), args, [plan, ignoring],
+                                     audit)
+        assert audit.count == 2 * len(records)
+
+    with open(tmp_path / 'full.jsonl') as f:
+        full = sorted(f)
+    with open(tmp_path / 'streamed.jsonl') as f:
+        streamed = sorted(f)
+    assert streamed == full
+    assert {line['rule'] for line in map(json.loads, full) if line['decision'] == 'delete'} == \
+        {'DeleteByTagName-.*', 'old'}
+
+
+def test_get_log_level():
+    assert get_log_level(Namespace(verbose=0, quiet=False)) == logging.INFO
+    assert get_log_level(Namespace(verbose=1, quiet=False)) == logging.DEBUG
+    assert get_log_level(Namespace(verbose=3, quiet=False)) == TRACE
+    assert get_log_level(Namespace(verbose=0, quiet=True)) == logging.WARNING
+
+
+def test_set_log_levels():
+    loggers = [logging.getLogger(name) for name in ('logger', None, 'httpx')]
+    levels = [logger.level for logger in loggers]
+    try:
+        set_log_levels(Namespace(verbose=0, quiet=True))
+        assert [logger.level for logger in loggers] == [logging.WARNING] * 3
+        # the requests logged by httpx are kept from -v, the other libraries stay at INFO
+        set_log_levels(Namespace(verbose=0, quiet=False))
+        assert [logger.level for logger in loggers] == [logging.INFO, logging.INFO, logging.WARNING]
+        set_log_levels(Namespace(verbose=2, quiet=False))
+        assert [logger.level for logger in loggers] == [TRACE, logging.INFO, logging.INFO]
+    finally:
+        for logger, level in zip(loggers, levels):
+            logger.setLevel(level)
@@ -0,0 +1,73 @@
+import threading
+import time
+
+from concurrency import AdaptiveLimiter, retry_delay
+from harbor_client import HarborApiError
+
+
+def test_limit_grows_until_congestion_then_halves():
+    limiter = AdaptiveLimiter(floor=2, ceiling=8)
+    for _ in range(10):
+        limiter.release(limiter.acquire(), 200)
+    assert limiter.limit == 8
+
+    limiter.release(limiter.acquire(), 503)
+    assert limiter.limit == 4
+    # additive increase once congestion has been seen
+    limiter.release(limiter.acquire(), 200)
+    assert limiter.limit == 4.25
+
+
+def test_concurrent_failures_decrease_once():
+    limiter = AdaptiveLimiter(floor=1, ceiling=8)
+    for _ in range(7):
+        limiter.release(limiter.acquire(), 200)
+    started = [limiter.acquire() for _ in range(4)]
+    for start in started:
+        limiter.release(start, 429)
+    assert limiter.limit == 4
+    assert limiter.in_flight == 0
+
+
+def test_slow_responses_are_congestion():
+    limiter = AdaptiveLimiter(floor=1, ceiling=8)
+    for _ in range(3):
+        limiter.release(limiter.acquire(), 200, key='GET')
+    assert limiter.limit == 4
+    limiter.release(limiter.acquire() - 1.0, 200, key='GET')
+    assert limiter.limit == 2
+    # latencies of other kinds of requests have their own baseline
+    limiter.release(limiter.acquire() - 1.0, 200, key='DELETE')
+    assert limiter.limit == 2.5
+
+
+def test_limit_bounds_requests_in_flight():
+    limiter = AdaptiveLimiter(floor=2, ceiling=2)
+    peak = []
+
+    def request():
+        started = limiter.acquire()
+        peak.append(limiter.in_flight)
+        time.sleep(0.01)
+        limiter.release(started, 200)
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) == 2
+
+
+def test_retry_after_holds_back_new_requests():
+    limiter = AdaptiveLimiter(floor=1, ceiling=4)
+    limiter.release(limiter.acquire(), 429, retry_after=0.2)
+    started = time.monotonic()
+    limiter.release(limiter.acquire(), 200)
+    assert time.monotonic() - started >= 0.15
+
+
+def test_retry_delay():
+    assert retry_delay(1.0, 2, HarborApiError(503, 'url')) == 4.0
+    assert retry_delay(1.0, 2, HarborApiError(429, 'url', retry_after='7')) == 7.0
+    assert retry_delay(1.0, 0, HarborApiError(429, 'url', retry_after='Wed, 21 Oct 2015 07:28:00 GMT')) == 1.0
@@ -0,0 +1,95 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from deleter import DeleteAction, DeletionExecutor, DeletionLimits, RateLimiter, count_tags_per_digest, group_deletions
+from harbor_client import HarborApiError
+from records import TagRecord
+
+
+class FakeHarborClient:
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = []
+
+    def delete_action(self, image):
+        self.calls.append(image)
+        if self.failures.get(image):
+            status_code = self.failures[image].pop(0)
+            raise HarborApiError(status_code, image)
+
+
+def test_retries_throttled_deletions():
+    harbor_client = FakeHarborClient({"p/repo:1": [429, 503]})
+    report = DeletionExecutor(harbor_client, retries=3, backoff=0).delete(["p/repo:1", "p/repo:2"])
+    assert report.deleted == ["p/repo:1", "p/repo:2"]
+    assert report.failed == []
+    assert harbor_client.calls.count("p/repo:1") == 3
+
+
+def test_failures_are_collected():
+    harbor_client = FakeHarborClient({"p/repo:1": [403], "p/repo:2": [500, 500, 500], "p/repo:3": [404]})
+    report = DeletionExecutor(harbor_client, workers=4, retries=2, backoff=0).delete(
+        ["p/repo:1", "p/repo:2", "p/repo:3"])
+    # an image that is already gone is not a failure
+    assert report.deleted == ["p/repo:3"]
+    assert [(image, error.status_code) for image, error in report.failed] == [("p/repo:1", 403), ("p/repo:2", 500)]
+    assert harbor_client.calls.count("p/repo:1") == 1
+
+
+def test_transport_errors_are_collected():
+    httpx = pytest.importorskip('httpx')
+
+    class UnreachableHarborClient:
+        def delete_action(self, image):
+            raise httpx.ConnectError("connection refused")
+
+    report = DeletionExecutor(UnreachableHarborClient(), retries=1, backoff=0).delete(["p/repo:1"])
+    assert [(image, type(error)) for image, error in report.failed] == [("p/repo:1", httpx.ConnectError)]
+
+
+def test_rate_limiter():
+    rate_limiter = RateLimiter(rps=100)
+    start = time.monotonic()
+    for _ in range(11):
+        rate_limiter.wait()
+    assert time.monotonic() - start >= 0.09
+
+
+def test_projects_share_deletion_limits():
+    class SlowHarborClient:
+        def __init__(self):
+            self.in_flight = self.max_in_flight = 0
+            self._lock = threading.Lock()
+
+        def delete_action(self, image):
+            with self._lock:
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            time.sleep(0.01)
+            with self._lock:
+                self.in_flight -= 1
+
+    harbor_client = SlowHarborClient()
+    limits = DeletionLimits.create(rps=200, workers=2)
+    executors = [DeletionExecutor(harbor_client, workers=4, rps=1000, limits=limits) for _ in range(2)]
+    start = time.monotonic()
+    # the two projects of the registry delete at the same time
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        reports = list(pool.map(lambda executor: executor.delete([f"p/repo:{i}" for i in range(10)]), executors))
+    assert [len(report.deleted) for report in reports] == [10, 10]
+    assert harbor_client.max_in_flight == 2
+    assert time.monotonic() - start >= 19 / 200
+
+
+def test_group_deletions():
+    records = [TagRecord("p/app", tag, 0, 0, digest) for tag, digest in
+               [("v1", "sha256:a"), ("latest", "sha256:a"), ("v2", "sha256:b"), ("v2-rc", "sha256:b"),
+                ("v3", None)]]
+    condemned = [record for record in records if record.tag in ("v1", "v2", "v2-rc", "v3")]
+    assert group_deletions("p/app", condemned, count_tags_per_digest(records)) == [
+        DeleteAction("p/app", None, ("v3",), True),
+        DeleteAction("p/app", "sha256:a", ("v1",), False),
+        DeleteAction("p/app", "sha256:b", ("v2", "v2-rc"), True)]
@@ -0,0 +1,97 @@
+import pytest
+
+from deleter import DeleteAction, DeletionExecutor, group_deletions
+from fake_harbor import FakeHarbor, FakeHarborServer, parse_query
+from harbor_client import HarborClient, build_query
+from inventory import build_inventory
+from synthetic import SyntheticRegistry
+
+REGISTRY = SyntheticRegistry(tag_count=750, repository_count=3, seed=3, now=1700000000)
+
+
+@pytest.fixture()
+def fake_harbor():
+    fake = FakeHarbor().add_registry(REGISTRY)
+    with FakeHarborServer(fake) as server:
+        fake.url = server.url
+        yield fake
+
+
+def test_parse_query():
+    assert parse_query('name=~app,tags=v1,push_time=[~2024-01-01 00:00:00]') == \
+        [('name', 'fuzzy', 'app'), ('tags', 'exact', 'v1'), ('push_time', 'range', (None, '2024-01-01 00:00:00'))]
+    assert parse_query(None) == []
+
+
+def _tags(records):
+    return [(record.tag, record.digest) for record in records]
+
+
+def test_listing_follows_pagination(fake_harbor):
+    with HarborClient(fake_harbor.url, 'project', 'username', 'password') as harbor_client:
+        assert [repository['name'] for repository in harbor_client.get_repositories()] == \
+            ['project/app-0', 'project/app-1', 'project/app-2']
+        assert _tags(harbor_client.get_images('app-0')) == _tags(REGISTRY.records('app-0'))
+        # 250 tags of fewer artifacts, at 100 artifacts per page
+        assert fake_harbor.stats[('GET', 200)] == 1 + 3
+        inventory = build_inventory(harbor_client, 'project', workers=3)
+        assert sum(len(records) for _, records in inventory) == 750
+
+
+def test_listing_filters(fake_harbor):
+    artifacts = REGISTRY.artifacts('app-2')
+    with HarborClient(fake_harbor.url, 'project', 'username', 'password') as harbor_client:
+        assert [repository['name'] for repository in harbor_client.get_repositories(name='app-1')] == \
+            ['project/app-1']
+
+        records = harbor_client.get_images('app-2', build_query(fuzzy={'tags': 'master_'}))
+        expected = [artifact for artifact in artifacts if any('master_' in tag['name'] for tag in artifact['tags'])]
+        assert _tags(records) == _tags(REGISTRY.records('app-2', expected))
+
+        cutoff = '2023-06-01 00:00:00'
+        records = harbor_client.get_images('app-2', build_query(ranges={'push_time': (None, cutoff)}))
+        expected = [artifact for artifact in artifacts if artifact['push_time'][:19].replace('T', ' ') <= cutoff]
+        assert expected and _tags(records) == _tags(REGISTRY.records('app-2', expected))
+
+
+def test_deletions_update_the_registry(fake_harbor):
+    records = REGISTRY.records('app-0')
+    with HarborClient(fake_harbor.url, 'project', 'username', 'password') as harbor_client:
+        actions = group_deletions('project/app-0', records[:20], {})
+        report = DeletionExecutor(harbor_client, workers=4).delete(actions)
+        assert len(report.deleted) == len(actions) and not report.failed
+        remaining = harbor_client.get_images('app-0')
+        assert {record.tag for record in remaining} == {record.tag for record in records[20:]}
+        # deleting again finds nothing and counts as done
+        assert DeletionExecutor(harbor_client).delete_one(actions[0]) is None
+        assert fake_harbor.stats[('DELETE', 404)] == 1
+
+        artifact = fake_harbor.artifacts('project', 'app-1')[0]
+        tags = [tag['name'] for tag in artifact['tags']]
+        harbor_client.delete_action(DeleteAction('project/app-1', artifact['digest'], (tags[0],), False))
+        # removing a tag keeps the artifact
+        assert fake_harbor.artifacts('project', 'app-1')[0]['digest'] == artifact['digest']
+        assert [tag['name'] for tag in fake_harbor.artifacts('project', 'app-1')[0]['tags']] == tags[1:]
+
+
+def test_client_retries_injected_faults():
+    fake = FakeHarbor(error_rate=0.2, throttle_rate=0.2, retry_after=0, seed=1).add_registry(REGISTRY)
+    with FakeHarborServer(fake) as server:
+        with HarborClient(server.url, 'project', 'username', 'password', retries=10, backoff=0,
+                          max_concurrency=4) as harbor_client:
+            inventory = build_inventory(harbor_client, 'project', workers=4)
+            assert sum(len(records) for _, records in inventory) == 750
+            actions = group_deletions('project/app-2', REGISTRY.records('app-2')[:30], {})
+            report = DeletionExecutor(harbor_client, workers=4, retries=10, backoff=0).delete(actions)
+            assert not report.failed
+    assert fake.stats[('GET', 429)] and fake.stats[('GET', 503)]
+
+
+def test_capacity_throttles_concurrent_requests():
+    fake = FakeHarbor(latency=0.01, capacity=1, retry_after=0).add_registry(REGISTRY)
+    with FakeHarborServer(fake) as server:
+        with HarborClient(server.url, 'project', 'username', 'password', retries=10, backoff=0,
+                          max_concurrency=8) as harbor_client:
+            build_inventory(harbor_client, 'project', workers=8)
+    assert fake.peak_in_flight > 1
+    assert fake.stats[('GET', 429)]
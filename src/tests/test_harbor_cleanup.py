@@ -1,6 +1,8 @@
 import pytest
 from unittest.mock import MagicMock
 from main import *
+from kustomization import get_harbor_images
+from utils import sort_tag
 
 
 @pytest.fixture()
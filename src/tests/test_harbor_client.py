@@ -0,0 +1,209 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+from async_harbor_client import AsyncHarborClient
+from deleter import DeleteAction, delete_images_async
+from harbor_client import HarborApiError, HarborClient, build_query
+from inventory import build_inventory_async
+
+ARTIFACTS = [{"digest": f"sha256:{i}", "tags": [{"name": f"v{i}", "push_time": "2024-01-01T00:00:00Z",
+                                                  "pull_time": "2024-01-01T00:00:00Z"}]} for i in range(250)]
+
+
+class _HarborHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests_seen = []
+    # status codes answered, in order, before serving GET requests normally
+    failures = []
+    # seconds taken to answer a page of artifacts
+    artifact_delay = 0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        self.requests_seen.append((url.path, query))
+        if self.failures:
+            self.send_response(self.failures.pop(0))
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        headers = {}
+        if url.path.endswith('/artifacts'):
+            time.sleep(self.artifact_delay)
+            page, page_size = int(query.get('page', 1)), int(query['page_size'])
+            data = ARTIFACTS[(page - 1) * page_size:page * page_size]
+            if page * page_size < len(ARTIFACTS):
+                headers['Link'] = f'<{url.path}?page={page + 1}&page_size={page_size}>; rel="next"'
+        else:
+            data = [{"name": "project/repo"}, {"name": "project/other"}]
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_DELETE(self):
+        self.requests_seen.append((self.path, {}))
+        if self.path.endswith('/missing'):
+            self.send_response(404)
+        else:
+            self.send_response(500 if self.path.endswith('/broken') else 200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def harbor_server():
+    _HarborHandler.requests_seen = []
+    _HarborHandler.failures = []
+    _HarborHandler.artifact_delay = 0
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _HarborHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def test_session_reuses_connections(harbor_server):
+    with HarborClient(harbor_server, 'project', 'username', 'password') as harbor_client:
+        for _ in range(3):
+            assert len(harbor_client.get_repositories()) == 2
+        stats = harbor_client.connection_stats()
+    assert stats == {"requests": 3, "connections": 1, "reused": 2}
+
+
+def test_project_clients_share_the_session(harbor_server):
+    with HarborClient(harbor_server, 'project', 'username', 'password') as harbor_client:
+        other_client = harbor_client.for_project('other')
+        assert other_client.get_repositories(name='app') == harbor_client.get_repositories()
+        other_client.close()
+        harbor_client.get_repositories()
+        stats = harbor_client.connection_stats()
+    assert _HarborHandler.requests_seen[0][1]['q'] == 'name=other/app'
+    assert stats == {"requests": 3, "connections": 1, "reused": 2}
+
+
+def test_budget_wait_is_not_latency(harbor_server):
+    class RequestTimes:
+        def __init__(self):
+            self.seconds = []
+
+        def observe_request(self, method, url, status_code, seconds, size=None):
+            self.seconds.append(seconds)
+
+    request_times = RequestTimes()
+    budget = threading.BoundedSemaphore(1)
+    with HarborClient(harbor_server, 'project', 'username', 'password', budget=budget,
+                      metrics=request_times) as harbor_client:
+        # another registry holds the whole budget for a while
+        budget.acquire()
+        thread = threading.Thread(target=harbor_client.get_repositories)
+        thread.start()
+        time.sleep(0.5)
+        budget.release()
+        thread.join()
+    assert len(request_times.seconds) == 1
+    assert request_times.seconds[0] < 0.5
+
+
+def test_endpoints_have_their_own_latency_baseline(harbor_server):
+    _HarborHandler.artifact_delay = 0.2
+    with HarborClient(harbor_server, 'project', 'username', 'password', max_concurrency=8) as harbor_client:
+        limits = []
+        for _ in range(3):
+            harbor_client.get_repositories()
+            limits.append(harbor_client.concurrency_limit)
+            # slower than the listing of repositories, as steady as it
+            harbor_client.get_images('repo')
+            limits.append(harbor_client.concurrency_limit)
+    assert limits == sorted(limits)
+    assert limits[-1] == 8
+
+
+def test_get_images_follows_pagination(harbor_server):
+    with HarborClient(harbor_server, 'project', 'username', 'password') as harbor_client:
+        images = harbor_client.get_images('repo', query=build_query(fuzzy={'tags': 'v1'}))
+    assert [image.tag for image in images] == [f"v{i}" for i in range(250)]
+    assert [query.get('page', '1') for _, query in _HarborHandler.requests_seen] == ['1', '2', '3']
+    first_query = _HarborHandler.requests_seen[0][1]
+    assert first_query['page_size'] == str(HarborClient.PAGE_SIZE)
+    assert first_query['q'] == 'tags=~v1'
+    assert first_query['with_scan_overview'] == 'false'
+
+
+def test_get_repositories_by_prefix(harbor_server):
+    with HarborClient(harbor_server, 'project', 'username', 'password') as harbor_client:
+        repositories = harbor_client.get_repositories(name_prefix='re')
+    assert repositories == [{"name": "project/repo"}]
+    assert _HarborHandler.requests_seen[0][1]['q'] == 'name=~project/re'
+
+
+def test_get_retries_throttled_requests(harbor_server):
+    _HarborHandler.failures = [429, 503]
+    with HarborClient(harbor_server, 'project', 'username', 'password', max_concurrency=4) as harbor_client:
+        assert len(harbor_client.get_repositories()) == 2
+    assert len(_HarborHandler.requests_seen) == 3
+
+
+def test_get_raises_harbor_api_error(harbor_server):
+    _HarborHandler.failures = [404]
+    with HarborClient(harbor_server, 'project', 'username', 'password') as harbor_client:
+        with pytest.raises(HarborApiError) as error:
+            harbor_client.get_repositories()
+    assert error.value.status_code == 404
+
+
+def test_async_get_retries_throttled_requests(harbor_server):
+    pytest.importorskip('httpx')
+    _HarborHandler.failures = [429, 503]
+
+    async def list_repositories():
+        async with AsyncHarborClient(harbor_server, 'project', 'username', 'password') as harbor_client:
+            return await harbor_client.get_repositories()
+
+    assert len(asyncio.run(list_repositories())) == 2
+    assert len(_HarborHandler.requests_seen) == 3
+
+
+def test_build_query():
+    assert build_query() is None
+    assert build_query(exact={'name': 'p/app'}, ranges={'push_time': (None, '2024-01-01 00:00:00')}) == \
+        'name=p/app,push_time=[~2024-01-01 00:00:00]'
+
+
+def test_async_client(harbor_server):
+    pytest.importorskip('httpx')
+
+    async def scan_and_delete():
+        async with AsyncHarborClient(harbor_server, 'project', 'username', 'password',
+                                     max_concurrency=4) as harbor_client:
+            inventory = await build_inventory_async(harbor_client, 'project')
+            actions = [DeleteAction('project/repo', 'sha256:1', ('v1',), True),
+                       DeleteAction('project/repo', 'sha256:2', ('missing',), False),
+                       DeleteAction('project/repo', 'sha256:3', ('broken',), False)]
+            report = await delete_images_async(harbor_client, actions, retries=0)
+        return inventory, report
+
+    inventory, report = asyncio.run(scan_and_delete())
+    assert [repository['name'] for repository, _ in inventory] == ['project/repo', 'project/other']
+    assert [image.tag for image in inventory.images('project/repo')] == [f"v{i}" for i in range(250)]
+    # an already deleted tag counts as deleted
+    assert [str(action) for action in report.deleted] == ['project/repo@sha256:1 (v1)', 'project/repo:missing']
+    assert [(str(action), error.status_code) for action, error in report.failed] == [('project/repo:broken', 500)]
+    assert ('/api/v2.0/projects/project/repositories/repo/artifacts/sha256:1', {}) in _HarborHandler.requests_seen
+    assert ('/api/v2.0/projects/project/repositories/repo/artifacts/sha256:3/tags/broken', {}) \
+        in _HarborHandler.requests_seen
@@ -0,0 +1,97 @@
+import pytest
+
+from fake_harbor import FakeHarbor, FakeHarborServer
+from harbor_client import HarborClient
+from inventory import build_inventory, iter_repositories
+from inventory_cache import InventoryCache
+from records import TagRecord
+from shard import Shard
+from synthetic import SyntheticRegistry
+
+
+class FakeHarborClient:
+    def __init__(self, images):
+        self.images = images
+        self.update_times = {name: "2024-01-01T00:00:00Z" for name in images}
+        self.calls = []
+
+    def get_repositories(self, name=None, name_prefix=None):
+        self.calls.append("repositories")
+        return [{"name": f"project/{name_}", "update_time": self.update_times[name_],
+                 "artifact_count": len(images)} for name_, images in self.images.items()
+                if name in (None, name_) and name_.startswith(name_prefix or '')]
+
+    def get_images(self, repository_name):
+        self.calls.append(repository_name)
+        return self.images[repository_name]
+
+
+@pytest.fixture()
+def harbor_client():
+    return FakeHarborClient({"app": [TagRecord("project/app", "v1", 0, 0)],
+                             "db": [TagRecord("project/db", "v2", 0, 0)]})
+
+
+def test_build_inventory(harbor_client):
+    inventory = build_inventory(harbor_client, "project", workers=2)
+    assert [repository["name"] for repository, _ in inventory] == ["project/app", "project/db"]
+    assert [record.tag for record in inventory.images("project/db")] == ["v2"]
+    # iterating the snapshot again does not hit the registry
+    list(inventory)
+    assert harbor_client.calls == ["repositories", "app", "db"]
+
+
+def test_build_inventory_single_repository(harbor_client):
+    inventory = build_inventory(harbor_client, "project", repository_name="db")
+    assert len(inventory) == 1
+    with pytest.raises(ValueError, match="project/app"):
+        build_inventory(harbor_client, "project", repository_name="missing")
+
+
+def test_build_inventory_from_cache(tmp_path):
+    harbor_client = FakeHarborClient({"app": [TagRecord("project/app", "v1", 0, 0)],
+                                      "db": [TagRecord("project/db", "v2", 0, 0)]})
+    with InventoryCache(str(tmp_path / "inventory.db")) as cache:
+        build_inventory(harbor_client, "project", cache=cache)
+        harbor_client.calls = []
+        harbor_client.update_times["db"] = "2024-01-02T00:00:00Z"
+        inventory = build_inventory(harbor_client, "project", cache=cache)
+        assert harbor_client.calls == ["repositories", "db"]
+        assert [record.tag for record in inventory.images("project/app")] == ["v1"]
+
+        harbor_client.calls = []
+        build_inventory(harbor_client, "project", cache=cache, refresh_all=True)
+        assert harbor_client.calls == ["repositories", "app", "db"]
+
+        # entries written before artifact sizes were stored are fetched again
+        cache._connection.execute("UPDATE repositories SET images = ? WHERE name = 'project/app'",
+                                  ('[["v1",0,0,null]]',))
+        harbor_client.calls = []
+        build_inventory(harbor_client, "project", cache=cache)
+        assert harbor_client.calls == ["repositories", "app"]
+
+
+def test_inventory_cache_commits_each_put(tmp_path, harbor_client):
+    path = str(tmp_path / "inventory.db")
+    with InventoryCache(path) as cache:
+        cache.put("project", {"name": "project/app"}, harbor_client.images["app"])
+        # another connection writes without waiting for the first to commit
+        with InventoryCache(path) as other:
+            other.put("other", {"name": "other/app"}, harbor_client.images["app"])
+        assert cache.get("other", {"name": "other/app"}) is not None
+
+
+def test_iter_repositories_as_pages_arrive():
+    fake = FakeHarbor().add_registry(SyntheticRegistry(tag_count=150, repository_count=150))
+    with FakeHarborServer(fake) as server:
+        with HarborClient(server.url, 'project', 'username', 'password') as harbor_client:
+            repositories = iter_repositories(harbor_client, 'project')
+            name, repository = next(repositories)
+            assert (name, repository['name']) == ('app-0', 'project/app-0')
+            # the second page is only requested once the first one is consumed
+            assert harbor_client.connection_stats()['requests'] == 1
+            assert len(list(repositories)) == 149
+            assert harbor_client.connection_stats()['requests'] == 2
+            shard = Shard(0, 2)
+            assert [repository['name'] for _, repository in iter_repositories(harbor_client, 'project', shard=shard)] \
+                == [f'project/app-{i}' for i in range(150) if shard.contains(f'project/app-{i}')]
@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from kustomization import build_kustomization_index, get_kustomization_files
+
+KUSTOMIZATION = """images:
+  - name: harbor.example.com/project/{app}
+    newTag: "{tag}"
+  - name: docker.io/library/nginx
+    newTag: "1.25"
+"""
+
+
+@pytest.fixture()
+def gitops_tree(tmp_path):
+    for overlay, app, tag in [("prod", "app", "v1"), ("staging", "app", "v2"), ("prod", "db", "v3"),
+                              (".git", "app", "v0")]:
+        directory = tmp_path / overlay / app
+        directory.mkdir(parents=True)
+        (directory / "kustomization.yaml").write_text(KUSTOMIZATION.format(app=app, tag=tag))
+    return tmp_path
+
+
+def test_get_kustomization_files_prunes_directories(gitops_tree):
+    files = get_kustomization_files(str(gitops_tree), prune_dirs=[".git"])
+    assert [os.path.relpath(file, gitops_tree) for file in files] == [
+        "prod/app/kustomization.yaml", "prod/db/kustomization.yaml", "staging/app/kustomization.yaml"]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_build_kustomization_index(gitops_tree, workers):
+    index = build_kustomization_index("harbor.example.com", str(gitops_tree), prune_dirs=[".git"], workers=workers)
+    assert index.protected_tags("harbor.example.com/project/app") == {"v1", "v2"}
+    assert index.protected_tags("harbor.example.com/project/db") == {"v3"}
+    assert index.protected_tags("docker.io/library/nginx") == set()
+
+
+def test_build_kustomization_index_cache(gitops_tree, tmp_path_factory):
+    cache_path = str(tmp_path_factory.mktemp("cache") / "kustomization.json")
+    build_kustomization_index("harbor.example.com", str(gitops_tree), prune_dirs=[".git"], cache_path=cache_path)
+    kustomization_file = gitops_tree / "prod" / "db" / "kustomization.yaml"
+    kustomization_file.write_text(KUSTOMIZATION.format(app="db", tag="v4"))
+    os.utime(kustomization_file, ns=(0, 0))
+    index = build_kustomization_index("harbor.example.com", str(gitops_tree), prune_dirs=[".git"],
+                                      cache_path=cache_path)
+    assert index.protected_tags("harbor.example.com/project/db") == {"v4"}
+    assert index.protected_tags("harbor.example.com/project/app") == {"v1", "v2"}
+
+
+def test_build_kustomization_index_for_several_domains(gitops_tree):
+    index = build_kustomization_index(["harbor.example.com", "docker.io"], str(gitops_tree), prune_dirs=[".git"])
+    assert index.protected_tags("harbor.example.com/project/app") == {"v1", "v2"}
+    assert index.protected_tags("docker.io/library/nginx") == {"1.25"}
@@ -0,0 +1,98 @@
+from argparse import Namespace
+
+from fake_harbor import FakeHarbor, FakeHarborServer
+from harbor_client import HarborClient
+from inventory import build_inventory, list_repositories
+from inventory_cache import InventoryCache
+from kustomization import KustomizationIndex
+from main import (Target, evaluate_inventory, evaluate_streaming, get_async_conflicts, get_pipeline_conflicts,
+                  get_target_args, get_targets, parse_args, run, run_targets)
+from plan import read_plan
+from policy import compile_policy
+from synthetic import SyntheticRegistry
+
+
+def test_get_targets():
+    args = Namespace(harbor_url='https://harbor.example.com', domain_name='harbor.example.com',
+                     project_name=['library', 'apps@https://harbor.example.com/', 'apps@https://harbor2.example.com'])
+    targets = get_targets(args)
+    assert targets == [Target('https://harbor.example.com', 'library', 'harbor.example.com'),
+                       Target('https://harbor.example.com', 'apps', 'harbor.example.com'),
+                       Target('https://harbor2.example.com', 'apps', 'harbor2.example.com')]
+    target_args = get_target_args(args, targets[2])
+    assert (target_args.harbor_url, target_args.project_name, target_args.domain_name) == targets[2]
+    assert args.project_name[0] == 'library'
+
+
+def test_get_async_conflicts():
+    required = ['--harbor-url', 'https://harbor.example.com', '--username', 'u', '--password', 'p',
+                '--project-name', 'library', '--domain-name', 'harbor.example.com', '--async']
+    assert get_async_conflicts(parse_args(required + ['--max-concurrency', '50'])) == []
+    assert get_async_conflicts(parse_args(required + ['--cache-file', 'cache.db', '--scan-workers', '8'])) == \
+        ['--cache-file', '--scan-workers']
+
+
+
+def test_get_pipeline_conflicts():
+    required = ['--harbor-url', 'https://harbor.example.com', '--username', 'u', '--password', 'p',
+                '--project-name', 'library', '--domain-name', 'harbor.example.com', '--pipeline']
+    assert get_pipeline_conflicts(parse_args(required + ['--scan-workers', '8'])) == []
+    assert get_pipeline_conflicts(parse_args(required + ['--streaming', '--cache-file', 'cache.db'])) == \
+        ['--cache-file', '--streaming']
+
+def test_run_targets_share_inventory_cache(tmp_path):
+    fake = FakeHarbor(latency=0.01)
+    for project_name in ('library', 'apps'):
+        fake.add_registry(SyntheticRegistry(project_name, tag_count=200, repository_count=4, seed=3))
+    plan = compile_policy({'name': 'p', 'rules': [{'type': 'DeleteByCreateTime', 'regexp': '.*', 'days': 30}]})
+    path = str(tmp_path / 'inventory.db')
+    with FakeHarborServer(fake) as server:
+        args = parse_args(['--harbor-url', server.url, '--username', 'u', '--password', 'p',
+                           '--project-name', 'library', 'apps', '--domain-name', 'harbor.example.com',
+                           '--cache-file', path, '--project-workers', '2', '--scan-workers', '2', '--dry-run'])
+        # the projects are crawled at the same time into the same cache file
+        results = run_targets(args, get_targets(args), [plan], KustomizationIndex())
+    assert [result.target.project_name for result in results] == ['library', 'apps']
+    with InventoryCache(path) as cache:
+        inventories = cache.load()
+    assert sorted((inventory.project_name, len(inventory)) for inventory in inventories) == \
+        [('apps', 4), ('library', 4)]
+
+
+STREAMING_PLAN = {'name': 'p', 'rules': [{'type': 'DeleteByTagName', 'regexp': '^dev_.*', 'limit': 5},
+                                         {'type': 'DeleteByCreateTime', 'regexp': '.*', 'days': 60}]}
+
+
+def test_evaluate_streaming_flushes_each_repository():
+    fake = FakeHarbor().add_registry(SyntheticRegistry(tag_count=600, repository_count=3, seed=7))
+    plans = [compile_policy(STREAMING_PLAN)]
+    args = Namespace(domain_name='harbor.example.com', tag_filter=None, pushed_after=None, pushed_before=None)
+    flushed = []
+    with FakeHarborServer(fake) as server:
+        with HarborClient(server.url, 'project', 'username', 'password') as harbor_client:
+            image_counts, action_count = evaluate_streaming(harbor_client, list_repositories(harbor_client, 'project'),
+                                                            KustomizationIndex(), args, plans, flushed.append)
+            inventory = build_inventory(harbor_client, 'project')
+    images_to_delete, delete_actions = evaluate_inventory(inventory, KustomizationIndex(), args, plans)
+    # one flush per repository, the deletions of a repository are not held once it is evaluated
+    assert [{action.repository for action in actions} for actions in flushed] == \
+        [{'project/app-0'}, {'project/app-1'}, {'project/app-2'}]
+    assert [action for actions in flushed for action in actions] == delete_actions
+    assert (image_counts, action_count) == ([len(images_to_delete[0])], len(delete_actions))
+
+
+def test_streaming_run_writes_plan(tmp_path):
+    fake = FakeHarbor().add_registry(SyntheticRegistry(tag_count=600, repository_count=3, seed=7))
+    plans = [compile_policy(STREAMING_PLAN)]
+    with FakeHarborServer(fake) as server:
+        required = ['--harbor-url', server.url, '--username', 'u', '--password', 'p', '--project-name', 'project',
+                    '--domain-name', 'harbor.example.com']
+        args = parse_args(required + ['--plan-out', str(tmp_path / 'batch.jsonl')])
+        args.project_name = 'project'
+        batch = run(args, plans, KustomizationIndex())
+        args = parse_args(required + ['--streaming', '--plan-out', str(tmp_path / 'streamed.jsonl')])
+        args.project_name = 'project'
+        streamed = run(args, plans, KustomizationIndex())
+    assert streamed.delete_actions == []
+    assert streamed.planned == batch.planned > 0
+    assert read_plan(str(tmp_path / 'streamed.jsonl')) == batch.delete_actions
@@ -0,0 +1,27 @@
+import random
+
+from matcher import SubstringMatcher
+
+
+def test_search():
+    matcher = SubstringMatcher(["latest", "1.0.0", "he", "she", "hers"])
+    assert matcher.search("latest")
+    assert matcher.search("v1.0.0-rc")
+    assert matcher.search("ushers")
+    assert not matcher.search("v1.0.1")
+    assert not matcher.search("")
+
+
+def test_empty_patterns():
+    assert not SubstringMatcher([]).search("anything")
+    assert not SubstringMatcher([])
+    assert SubstringMatcher([""]).search("anything")
+
+
+def test_search_matches_substring_scan():
+    rng = random.Random(0)
+    patterns = ["".join(rng.choice("ab") for _ in range(rng.randint(1, 4))) for _ in range(20)]
+    matcher = SubstringMatcher(patterns)
+    for _ in range(500):
+        text = "".join(rng.choice("abc") for _ in range(rng.randint(0, 10)))
+        assert matcher.search(text) == any(pattern in text for pattern in patterns)
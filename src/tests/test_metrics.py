@@ -0,0 +1,93 @@
+import cProfile
+import json
+import os
+import pstats
+import threading
+
+from fake_harbor import FakeHarbor, FakeHarborServer
+from harbor_client import HarborClient
+from inventory import build_inventory
+from metrics import Metrics, endpoint_of, profiled, save_metrics, write_prometheus_textfile
+from synthetic import SyntheticRegistry
+
+
+def test_endpoint_of():
+    assert endpoint_of('https://harbor/api/v2.0/projects/project/repositories/team%2Fapp/artifacts?page=2') == \
+        '/api/v2.0/projects/{project}/repositories/{repository}/artifacts'
+    assert endpoint_of('https://harbor/api/v2.0/projects/project/repositories/app/artifacts/sha256:1/tags/v1') == \
+        '/api/v2.0/projects/{project}/repositories/{repository}/artifacts/{reference}/tags/{tag}'
+
+
+def test_metrics_report(tmp_path):
+    metrics = Metrics()
+    with metrics.phase('rule_evaluation'):
+        metrics.count('tags_evaluated', 1000)
+    metrics.add_time('rule_evaluation', 1.0)
+    metrics.observe_request('GET', 'https://harbor/api/v2.0/projects/p/repositories', 200, 0.02, 100)
+    metrics.observe_request('GET', 'https://harbor/api/v2.0/projects/p/repositories', 503, 3.0, 10)
+    metrics.observe_request('DELETE', 'https://harbor/api/v2.0/projects/p/repositories/a/artifacts/v1', None, 0.1)
+
+    data = metrics.to_dict()
+    assert data["counters"] == {"tags_evaluated": 1000}
+    assert 0 < data["tags_per_second"] <= 1000
+    listing = data["http"][1]
+    assert (listing["method"], listing["requests"], listing["bytes"]) == ('GET', 2, 110)
+    assert listing["statuses"] == {"200": 1, "503": 1}
+    assert (listing["latency_buckets"]["0.01"], listing["latency_buckets"]["0.025"],
+            listing["latency_buckets"]["+Inf"]) == (0, 1, 2)
+    assert data["http"][0]["statuses"] == {"error": 1}
+
+    save_metrics(str(tmp_path / 'metrics.json'), metrics)
+    assert json.loads((tmp_path / 'metrics.json').read_text())["counters"] == {"tags_evaluated": 1000}
+    write_prometheus_textfile(str(tmp_path / 'metrics.prom'), metrics)
+    text = (tmp_path / 'metrics.prom').read_text()
+    assert 'harbor_cleanup_tags_evaluated_total 1000' in text
+    assert 'harbor_cleanup_http_requests_total{method="GET",endpoint="/api/v2.0/projects/{project}/repositories",' \
+           'status="503"} 1' in text
+    assert 'le="+Inf"} 2' in text
+
+
+def test_harbor_client_records_requests():
+    fake = FakeHarbor().add_registry(SyntheticRegistry(tag_count=500, repository_count=2, seed=1))
+    metrics = Metrics()
+    with FakeHarborServer(fake) as server:
+        with HarborClient(server.url, 'project', 'username', 'password', metrics=metrics) as harbor_client:
+            build_inventory(harbor_client, 'project', workers=2, metrics=metrics)
+    assert set(metrics.phases) == {'repository_listing', 'artifact_fetch'}
+    requests = {(endpoint["method"], endpoint["endpoint"]): endpoint for endpoint in metrics.to_dict()["http"]}
+    artifacts = requests[('GET', '/api/v2.0/projects/{project}/repositories/{repository}/artifacts')]
+    assert artifacts["requests"] == fake.stats[('GET', 200)] - 1
+    assert artifacts["bytes"] > 0
+
+
+def test_profiled_covers_threads(tmp_path):
+    def work():
+        sorted(range(1000), key=lambda value: -value)
+
+    prefix = str(tmp_path / 'run')
+    with profiled(prefix):
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+    functions = {function for _, _, function in pstats.Stats(f'{prefix}.prof').stats}
+    assert 'work' in functions
+    assert os.path.getsize(f'{prefix}.tracemalloc') > 0
+
+
+def test_profiled_threads_survive_a_failing_profiler(tmp_path, monkeypatch):
+    def enable_in_main_thread(profile):
+        # as cProfile from Python 3.12 when a profiler is already active
+        if threading.current_thread() is not threading.main_thread():
+            raise ValueError("Another profiling tool is already active")
+        enable(profile)
+
+    enable = cProfile.Profile.enable
+    monkeypatch.setattr(cProfile.Profile, 'enable', enable_in_main_thread)
+    results = []
+    prefix = str(tmp_path / 'run')
+    with profiled(prefix):
+        thread = threading.Thread(target=lambda: results.append(sum(range(1000))))
+        thread.start()
+        thread.join()
+    assert results == [499500]
+    assert os.path.exists(f'{prefix}.prof')
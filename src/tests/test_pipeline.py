@@ -0,0 +1,70 @@
+import random
+import threading
+import time
+
+import pytest
+
+from pipeline import run_pipeline
+
+REPOSITORIES = [(f"repo{i}", {"name": f"project/repo{i}"}) for i in range(20)]
+
+
+def get_images(name):
+    time.sleep(random.random() / 200)
+    return [f"{name}-v{i}" for i in range(5)]
+
+
+def evaluate(repository, records):
+    # policy 0 deletes the first two tags, policy 1 the second and third one
+    tags_per_policy = [[tag.split('-')[1] for tag in records[:2]], [tag.split('-')[1] for tag in records[1:3]]]
+    actions = [f"{repository['name']}:{tag.split('-')[1]}" for tag in records[:3]]
+    return tags_per_policy, actions
+
+
+def test_pipeline_plan_and_deletions():
+    deleted = []
+    lock = threading.Lock()
+
+    def delete(image):
+        with lock:
+            deleted.append(image)
+
+    images_to_delete, report = run_pipeline(REPOSITORIES, get_images, evaluate, delete, 2, fetch_workers=4,
+                                            delete_workers=3, queue_size=2)
+    assert images_to_delete[0] == [f"project/repo{i}:v{j}" for i in range(20) for j in (0, 1)]
+    assert images_to_delete[1] == [f"project/repo{i}:v{j}" for i in range(20) for j in (1, 2)]
+    assert sorted(deleted) == sorted(f"project/repo{i}:v{j}" for i in range(20) for j in (0, 1, 2))
+    assert sorted(report.deleted) == sorted(deleted)
+
+
+def test_pipeline_bounds_fetched_repositories():
+    repositories = [(f"repo{i}", {"name": f"project/repo{i}"}) for i in range(100)]
+    fetched = []
+
+    def slow_head_get_images(name):
+        if name == "repo0":
+            time.sleep(0.2)
+        fetched.append(name)
+        return get_images(name)
+
+    def evaluate_first(repository, records):
+        if repository['name'] == "project/repo0":
+            evaluate_first.fetched_before = len(fetched)
+        return evaluate(repository, records)
+
+    images_to_delete, _ = run_pipeline(repositories, slow_head_get_images, evaluate_first, lambda image: None, 2,
+                                       fetch_workers=4, queue_size=2)
+    # the repositories after the slow one wait for it to be evaluated instead of being all fetched
+    assert evaluate_first.fetched_before <= 2
+    assert len(images_to_delete[0]) == 200
+
+
+def test_pipeline_stage_failure():
+    def failing_get_images(name):
+        if name == "repo3":
+            raise RuntimeError("listing failed")
+        return get_images(name)
+
+    with pytest.raises(RuntimeError, match="listing failed"):
+        run_pipeline(REPOSITORIES, failing_get_images, evaluate, lambda image: None, 2, fetch_workers=2,
+                     queue_size=1)
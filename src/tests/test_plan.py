@@ -0,0 +1,44 @@
+from deleter import DeleteAction, DeletionExecutor
+from harbor_client import HarborApiError
+from plan import PlanJournal, read_plan, write_plan
+
+ACTIONS = [DeleteAction('p/app', 'sha256:1', ('v1', 'v1.0'), True, size=2 ** 30),
+           DeleteAction('p/app', 'sha256:2', ('v2',), False),
+           DeleteAction('p/app', None, ('v3',), True),
+           DeleteAction('p/app', 'sha256:1', ('v1',), True, 'https://harbor2.example.com')]
+
+
+class FakeHarborClient:
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.calls = []
+
+    def delete_action(self, action):
+        self.calls.append(action)
+        if action in self.failing:
+            raise HarborApiError(403, str(action))
+
+
+def test_plan_round_trip(tmp_path):
+    path = tmp_path / 'plan.jsonl'
+    assert write_plan(path, iter(ACTIONS)) == 4
+    assert read_plan(path) == ACTIONS
+
+
+def test_journal_skips_completed_deletions(tmp_path):
+    path = tmp_path / 'plan.jsonl.journal'
+    harbor_client = FakeHarborClient(failing=[ACTIONS[1]])
+    with PlanJournal(path) as journal:
+        report = DeletionExecutor(harbor_client, retries=0).delete(journal.pending(ACTIONS), journal)
+    assert len(report.failed) == 1
+
+    # a run killed while writing leaves a truncated line
+    with open(path, 'a') as f:
+        f.write('{"repository": "p/a')
+    harbor_client = FakeHarborClient()
+    with PlanJournal(path) as journal:
+        assert journal.pending(ACTIONS) == [ACTIONS[1]]
+        DeletionExecutor(harbor_client).delete(journal.pending(ACTIONS), journal)
+    assert harbor_client.calls == [ACTIONS[1]]
+    with PlanJournal(path) as journal:
+        assert journal.pending(ACTIONS) == []
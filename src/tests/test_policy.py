@@ -0,0 +1,70 @@
+import dataclasses
+import random
+import time
+from argparse import Namespace
+
+import pytest
+
+from kustomization import KustomizationIndex
+from main import get_tags_to_delete, get_tags_to_delete_streaming
+from policy import StreamingEvaluator, classify_images, compile_policy
+from records import TagRecord
+
+
+@pytest.fixture()
+def policy():
+    return {'name': 'Test Policy',
+            'rules': [{'type': 'DeleteByTagName', 'regexp': '^dev_.*', 'limit': 2},
+                      {'name': 'old', 'type': 'DeleteByCreateTime', 'regexp': '.*', 'days': 30},
+                      {'type': 'IgnoreRepos', 'repos': ['base']},
+                      {'type': 'IgnoreTags', 'tags': ['latest']}]}
+
+
+def test_compile_policy(policy):
+    plan = compile_policy(policy)
+    assert [rule.name for rule in plan.delete_rules] == ['DeleteByTagName-^dev_.*', 'old']
+    assert plan.ignore_repos.patterns == ('base',)
+    assert plan.ignore_tags.search('latest-build')
+    # the source policy is left untouched and the plan is immutable
+    assert 'name' not in policy['rules'][0]
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        plan.delete_rules[0].limit = 5
+
+
+def test_classify_images(policy):
+    records = [TagRecord('p/app', tag, 0, 0) for tag in ['dev_1', 'master_1', 'dev_2']]
+    dev_records, all_records = classify_images(compile_policy(policy), records)
+    assert [record.tag for record in dev_records] == ['dev_1', 'dev_2']
+    assert all_records == records
+
+
+def test_streaming_evaluation_matches_full_evaluation():
+    rng = random.Random(1)
+    now = int(time.time())
+    records = [TagRecord('p/app', f"{rng.choice(['dev', 'master'])}_{rng.choice(['2024010', '2023120'])}{i % 10}"
+                                  f"{rng.choice(['', '_fix'])}{i}", now - rng.randint(0, 90) * 86400, 0)
+               for i in range(300)]
+    plan = compile_policy({'name': 'p', 'rules': [
+        {'type': 'DeleteByTagName', 'regexp': '^dev_.*', 'limit': 20},
+        {'type': 'DeleteByTimeInName', 'regexp': '^master_.*', 'limit': 10},
+        {'type': 'DeleteByCreateTime', 'regexp': '.*_fix.*', 'days': 45},
+        {'type': 'IgnoreTags', 'tags': ['_fix7']}]})
+    args = Namespace(domain_name='registry.example.com')
+    kustomization_index = KustomizationIndex()
+    kustomization_index.add('registry.example.com/p/app', records[0].tag)
+
+    expected = get_tags_to_delete({'name': 'p/app'}, records, kustomization_index, args, plan)
+    streamed, = get_tags_to_delete_streaming({'name': 'p/app'}, iter(records), kustomization_index, args, [plan])
+    streamed = [record.tag for record in streamed]
+    assert streamed == expected
+    assert records[0].tag not in streamed
+
+
+def test_streaming_evaluator_memory_is_bounded():
+    plan = compile_policy({'name': 'p', 'rules': [{'type': 'DeleteByTagName', 'regexp': '.*', 'limit': 5}]})
+    evaluator = StreamingEvaluator(plan)
+    candidates = []
+    for i in range(1000):
+        candidates += evaluator.feed(TagRecord('p/app', f"{i:04d}", 0, 0))
+    assert len(candidates) == 995
+    assert max(len(heap) for heap in evaluator._heaps) == 5
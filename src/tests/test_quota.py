@@ -0,0 +1,73 @@
+import argparse
+
+import pytest
+
+from deleter import DeleteAction
+from fake_harbor import FakeHarbor, FakeHarborServer
+from harbor_client import HarborClient
+from kustomization import KustomizationIndex
+from main import parse_args, run
+from policy import compile_policy
+from quota import bytes_over_quota, format_size, parse_percentage, parse_size, select_largest
+from synthetic import SyntheticRegistry
+
+
+def test_parse_size():
+    assert parse_size('500G') == 500 * 2 ** 30
+    assert parse_size('1.5TiB') == 3 * 2 ** 39
+    assert parse_size('20mb') == 20 * 2 ** 20
+    assert parse_size('1048576') == 2 ** 20
+    assert format_size(3 * 2 ** 39) == '1.5TiB'
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_size('lots')
+
+
+def test_parse_percentage():
+    assert parse_percentage('80%') == 80
+    assert parse_percentage('12.5') == 12.5
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_percentage('100%')
+
+
+def test_bytes_over_quota():
+    assert bytes_over_quota(900, 1000, 80) == 100
+    assert bytes_over_quota(700, 1000, 80) == 0
+    with pytest.raises(ValueError):
+        bytes_over_quota(700, -1, 80)
+
+
+def test_select_largest():
+    actions = [DeleteAction('p/a', 'sha256:1', ('v1',), True, size=100),
+               DeleteAction('p/a', 'sha256:2', ('v2', 'build-2'), True, size=300),
+               DeleteAction('p/b', 'sha256:2', ('v2',), True, size=300),
+               DeleteAction('p/a', 'sha256:3', ('v3',), False),
+               DeleteAction('p/a', 'sha256:4', ('v4',), True, size=200)]
+    # the copies of sha256:2 are deleted together and counted once
+    assert select_largest(actions, 250) == ([actions[1], actions[2]], 300)
+    assert select_largest(actions, 301) == ([actions[1], actions[2], actions[4]], 500)
+    # tag deletes reclaim nothing
+    assert select_largest(actions, 10 ** 6) == ([actions[1], actions[2], actions[4], actions[0]], 600)
+    assert select_largest(actions, 0) == ([], 0)
+
+
+def test_run_with_target_quota():
+    registry = SyntheticRegistry(tag_count=300, repository_count=3, seed=4, shared_digest_ratio=0)
+    fake = FakeHarbor().add_registry(registry)
+    plan = compile_policy({'name': 'p', 'rules': [{'type': 'DeleteByCreateTime', 'regexp': '.*', 'days': 30}]})
+    with FakeHarborServer(fake) as server:
+        with HarborClient(server.url, 'project', 'username', 'password') as harbor_client:
+            used, _ = harbor_client.get_storage_quota()
+            fake.quota = used
+            args = parse_args(['--harbor-url', server.url, '--username', 'username', '--password', 'password',
+                               '--project-name', 'project', '--domain-name', 'harbor.example.com',
+                               '--target-quota', '90%'])
+            args.project_name = 'project'
+            result = run(args, [plan], KustomizationIndex(), harbor_client)
+            used_after, _ = harbor_client.get_storage_quota()
+
+    sizes = [action.size for action in result.delete_actions]
+    assert sizes == sorted(sizes, reverse=True)
+    assert len(result.report.deleted) == len(result.delete_actions)
+    assert used_after <= used * 0.9
+    # the last deletion was needed to reach the target
+    assert used_after + sizes[-1] > used * 0.9
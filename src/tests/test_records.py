@@ -0,0 +1,36 @@
+import time
+from datetime import datetime
+
+from main import get_delete_tags_by_create_time, get_delete_tags_by_time_in_name
+from policy import CompiledRule
+from records import NO_DATE, TagRecord, to_epoch
+
+
+def test_from_harbor():
+    record = TagRecord.from_harbor("p/app", {"name": "master_20240505", "push_time": "2024-05-06T08:19:17.123Z",
+                                             "pull_time": "0001-01-01T00:00:00.000Z"})
+    assert record.pushed_at == to_epoch(datetime(2024, 5, 6, 8, 19, 17))
+    assert record.name_date == to_epoch(datetime(2024, 5, 5))
+    assert record.to_dict()["push_time"] == "2024-05-06T08:19:17Z"
+    assert TagRecord.from_row("p/app", record.to_row()).to_dict() == record.to_dict()
+
+
+def test_records_share_repository_name():
+    first, second = (TagRecord("".join(["p/", "app"]), tag, 0, 0) for tag in ["v1", "v2"])
+    assert first.name is second.name
+    assert not hasattr(first, "__dict__")
+
+
+def test_time_in_name_with_undated_tags():
+    records = [TagRecord("p/app", tag, 0, 0) for tag in ["master_20240101", "master", "master_20240301"]]
+    assert records[1].name_date == NO_DATE
+    rule = CompiledRule(name="rule", type="DeleteByTimeInName", pattern=None, limit=1)
+    assert get_delete_tags_by_time_in_name(records, rule) == ["master_20240101", "master"]
+
+
+def test_create_time():
+    records = [TagRecord("p/app", "old", to_epoch(datetime(2020, 1, 1)), 0),
+               TagRecord("p/app", "new", int(time.time()), 0),
+               TagRecord("p/app", "unknown", 0, 0)]
+    rule = CompiledRule(name="rule", type="DeleteByCreateTime", pattern=None, days=30)
+    assert get_delete_tags_by_create_time(records, rule) == ["old"]
@@ -0,0 +1,18 @@
+import random
+import time
+
+from scanner import ordered_map
+
+
+def _slow_square(x):
+    time.sleep(random.random() / 100)
+    return x * x
+
+
+def test_ordered_map_keeps_input_order():
+    items = list(range(50))
+    assert list(ordered_map(_slow_square, items, workers=8)) == [(x, x * x) for x in items]
+
+
+def test_ordered_map_sequential():
+    assert list(ordered_map(_slow_square, [1, 2, 3])) == [(1, 1), (2, 4), (3, 9)]
@@ -0,0 +1,50 @@
+import argparse
+
+import pytest
+
+from deleter import DeleteAction, DeletionReport
+from main import RunResult, Target
+from plan import merge_plans, read_plan, write_plan
+from report import build_report, merge_reports, missing_shards
+from shard import Shard, parse_shard
+
+
+def test_shards_partition_repositories():
+    names = [f"project/app-{i}" for i in range(1000)]
+    shards = [Shard(index, 4) for index in range(4)]
+    assignments = [[shard for shard in shards if shard.contains(name)] for name in names]
+    assert all(len(assigned) == 1 for assigned in assignments)
+    # the same repository always falls in the same shard, in any process
+    assert Shard(1, 4).contains("project/app-0") == (assignments[0][0].index == 1)
+    assert min(sum(shard.contains(name) for name in names) for shard in shards) > 200
+
+
+def test_parse_shard():
+    assert parse_shard("2/8") == Shard(2, 8)
+    assert str(parse_shard("0/1")) == "0/1"
+    for value in ["8/8", "-1/2", "1", "a/b", "0/0"]:
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_shard(value)
+
+
+def test_merge_shard_plans_and_reports(tmp_path):
+    target = Target('https://harbor.example.com', 'project', 'harbor.example.com')
+    reports = []
+    for index, tags in enumerate([["v1", "v2"], ["v3"]]):
+        actions = [DeleteAction(f"project/app-{index}", None, (tag,), True) for tag in tags]
+        write_plan(tmp_path / f"plan-{index}.jsonl", actions)
+        deletion_report = DeletionReport()
+        for action in actions[1:]:
+            deletion_report.add(action, None)
+        deletion_report.add(actions[0], RuntimeError("boom"))
+        reports.append(build_report([RunResult(target, actions, deletion_report)], Shard(index, 3)))
+
+    assert merge_plans([tmp_path / "plan-0.jsonl", tmp_path / "plan-1.jsonl", tmp_path / "plan-1.jsonl"],
+                       tmp_path / "plan.jsonl") == 3
+    assert [action.tags for action in read_plan(tmp_path / "plan.jsonl")] == [("v1",), ("v2",), ("v3",)]
+
+    merged = merge_reports(reports)
+    project, = merged["projects"]
+    assert (project["planned"], project["deleted"]) == (3, 1)
+    assert [failure["action"]["tags"] for failure in project["failed"]] == [["v1"], ["v3"]]
+    assert missing_shards(merged) == ["2/3"]
@@ -0,0 +1,81 @@
+from argparse import Namespace
+
+import pytest
+import yaml
+
+from inventory_cache import InventoryCache
+from kustomization import KustomizationIndex
+from main import evaluate_inventory
+from policy import compile_policy
+from simulate import load_plans, parse_args, simulate
+from synthetic import SyntheticRegistry
+
+POLICIES = [{'name': 'keep 50', 'rules': [{'type': 'DeleteByTagName', 'regexp': '^dev_.*', 'limit': 50},
+                                          {'type': 'IgnoreRepos', 'repos': ['app-2']}]},
+            {'name': 'keep 5', 'rules': [{'type': 'DeleteByTagName', 'regexp': '^dev_.*', 'limit': 5},
+                                         {'type': 'DeleteByCreateTime', 'regexp': '^v.*', 'days': 90}]}]
+
+
+def cached_inventories(tmp_path, registry):
+    with InventoryCache(str(tmp_path / 'inventory.db')) as cache:
+        for name in registry.repository_names():
+            artifacts = registry.artifacts(name)
+            cache.put(registry.project_name, registry.repository(name, artifacts), registry.records(name, artifacts))
+        cache.commit()
+        return cache.load()
+
+
+def test_load_inventory_snapshot(tmp_path):
+    registry = SyntheticRegistry(tag_count=600, repository_count=3, seed=5)
+    inventory, = cached_inventories(tmp_path, registry)
+    assert inventory.project_name == 'project'
+    assert [repository['name'] for repository in inventory.repositories] == \
+        [repository['name'] for repository in registry.repositories()]
+    records = inventory.images('project/app-0')
+    assert [(record.tag, record.digest, record.size) for record in records] == \
+        [(record.tag, record.digest, record.size) for record in registry.records('app-0')]
+
+
+def test_simulate_matches_evaluation(tmp_path):
+    registry = SyntheticRegistry(tag_count=3000, repository_count=3, seed=5)
+    inventories = cached_inventories(tmp_path, registry)
+    # the 10th newest dev tag is only deleted by the stricter policy
+    deployed = sorted((record for record in registry.records('app-0') if record.tag.startswith('dev_')),
+                      key=lambda record: record.tag, reverse=True)[9]
+    kustomization_index = KustomizationIndex()
+    kustomization_index.add(f'harbor.example.com/{deployed.name}', deployed.tag)
+    plans = [('policies.yaml', compile_policy(policy)) for policy in POLICIES]
+
+    results = simulate(inventories, kustomization_index, 'harbor.example.com', plans, workers=2)
+    in_process = simulate(inventories, kustomization_index, 'harbor.example.com', plans)
+    assert [result._replace(seconds=0) for result in results] == [result._replace(seconds=0) for result in in_process]
+
+    args = Namespace(domain_name='harbor.example.com')
+    for (_, plan), result in zip(plans, results):
+        images_to_delete, delete_actions = evaluate_inventory(inventories[0], kustomization_index, args, [plan])
+        assert result.policy == plan.name
+        assert result.tags_deleted == len(images_to_delete[0])
+        assert result.delete_requests == len(delete_actions)
+        assert 0 < result.bytes_reclaimed <= sum(action.size for action in delete_actions)
+    assert [result.deployed_hits for result in results] == [[], [f'{deployed.name}:{deployed.tag}']]
+
+
+def test_load_plans(tmp_path):
+    path = tmp_path / 'policies.yaml'
+    # a run adds the missing rule types from the default policy, which only validates with a regexp for each
+    rules = [{'type': 'DeleteByTimeInName', 'regexp': '^master_.*', 'limit': 10},
+             {'type': 'DeleteByCreateTime', 'regexp': '.*', 'days': 30}, {'type': 'IgnoreTags', 'tags': []}]
+    path.write_text(yaml.safe_dump({'policies': [dict(policy, rules=policy['rules'] + rules) for policy in POLICIES]}))
+    args = parse_args(['--cache-file', 'inventory.db', '--policies', str(path), '--domain-name', 'harbor.example.com',
+                       '--ignore-tags', 'latest'])
+    plans = load_plans(args)
+    assert [(source, plan.name) for source, plan in plans] == [(str(path), 'keep 50'), (str(path), 'keep 5')]
+    assert plans[1][1].ignore_tags.search('latest')
+
+
+def test_load_plans_rejects_file_without_policies(tmp_path):
+    path = tmp_path / 'policies.yaml'
+    path.write_text(yaml.safe_dump({'rules': []}))
+    args = parse_args(['--cache-file', 'inventory.db', '--policies', str(path), '--domain-name', 'harbor.example.com'])
+    with pytest.raises(ValueError, match=str(path)):
+        load_plans(args)
@@ -0,0 +1,34 @@
+from benchmarks import BENCHMARKS, find_regressions, run_benchmarks
+from synthetic import SyntheticRegistry
+
+
+def test_synthetic_registry_is_deterministic():
+    registry = SyntheticRegistry(tag_count=2500, repository_count=3, seed=7, now=1700000000)
+    inventory = registry.inventory()
+    assert [repository['name'] for repository in inventory.repositories] == \
+        ['project/app-0', 'project/app-1', 'project/app-2']
+    assert sum(len(records) for _, records in inventory) == 2500
+    assert SyntheticRegistry(tag_count=2500, repository_count=3, seed=7, now=1700000000).artifacts('app-1') == \
+        registry.artifacts('app-1')
+
+    records = inventory.images('project/app-0')
+    tags = [record.tag for record in records]
+    assert len(set(tags)) == len(tags)
+    assert any(tag.startswith('master_') for tag in tags) and any(tag.startswith('v') for tag in tags)
+    assert len({record.digest for record in records}) < len(records)
+    assert all(record.pushed_at <= 1700000000 for record in records)
+
+
+def test_write_kustomizations(tmp_path):
+    registry = SyntheticRegistry(tag_count=300, repository_count=5)
+    paths = registry.write_kustomizations(str(tmp_path), 'harbor.example.com', 4, images_per_file=2)
+    assert len(paths) == 4
+    assert 'harbor.example.com/project/app-' in open(paths[0]).read()
+
+
+def test_run_benchmarks():
+    results = run_benchmarks(sizes=[300], memory=False)
+    assert [result['benchmark'] for result in results] == [benchmark.name for benchmark in BENCHMARKS]
+    assert all(result['tags'] == 300 and result['tags_per_second'] > 0 for result in results)
+    baseline = [dict(result, tags_per_second=result['tags_per_second'] * 2) for result in results[:1]]
+    assert [result for result, _ in find_regressions(results, baseline, 1.25)] == results[:1]
@@ -1,4 +1,6 @@
-from utils import regexp_match, extract_semver
+from datetime import datetime
+
+from utils import regexp_match, extract_semver, extract_date
 
 
 def test_regexp_match():
@@ -13,3 +15,10 @@ def test_extract_semver():
     assert extract_semver('version-1.2.3') == '1.2.3'
     assert extract_semver('2.0') == ''
     assert extract_semver('1.2.3-beta.1') == '1.2.3'
+
+
+def test_extract_date():
+    assert extract_date('master_20240505') == datetime(2024, 5, 5)
+    assert extract_date('master_20240506120000') == datetime(2024, 5, 6, 12, 0, 0)
+    assert extract_date('build_99999999') is None
+    assert extract_date('latest') is None
@@ -1,4 +1,9 @@
 import re
+from datetime import datetime
+
+# longest first, so that a 14 digit timestamp is not read as its 8 digit date
+date_regexp = re.compile(r'\d{14}|\d{12}|\d{8}')
+DATE_FORMATS = {8: '%Y%m%d', 12: '%Y%m%d%H%M', 14: '%Y%m%d%H%M%S'}
 
 
 def regexp_match(exp: str, string: str) -> bool:
@@ -10,3 +15,30 @@ def extract_semver(tag: str) -> str:
     if match:
         return match.group(0)
     return ""
+
+
+def sort_tag(tag) -> list:
+    """Sort tags by semantic versioning."""
+    semver = extract_semver(tag)
+    version_parts = semver.split('_')
+    return [int(part) for part in version_parts if part.isdigit()]
+
+
+def extract_date(s):
+    """Return the date/time embedded in a tag name, or None."""
+    match = date_regexp.search(s)
+    if match:
+        date_str = match.group()
+        try:
+            return datetime.strptime(date_str, DATE_FORMATS[len(date_str)])
+        except ValueError:
+            # digits that are not a valid date, e.g. a build number
+            return None
+    return None
+
+
+def parse_push_time(push_time):
+    """Parse a Harbor timestamp such as 2024-05-05T08:19:17.123Z into a naive UTC datetime."""
+    if not push_time:
+        return None
+    return datetime.fromisoformat(push_time.replace('Z', ''))